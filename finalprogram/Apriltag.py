@@ -13,7 +13,6 @@ Apriltags 3 version: Aleksandar Petrov, Spring 2019
 '''
 from __future__ import division
 from __future__ import print_function
-from picamera import PiCamera
 import ctypes
 import os
 import numpy
@@ -108,6 +107,56 @@ class _ApriltagPose(ctypes.Structure):
 
 ######################################################################
 
+_FAMILIES = ('tag16h5', 'tag25h9', 'tag36h11', 'tagCircle21h7',
+             'tagCircle49h12', 'tagCustom48h12', 'tagStandard41h12',
+             'tagStandard52h13')
+
+# restype and argtypes of every libapriltag function the wrapper calls
+_SIGNATURES = {
+    'apriltag_detector_create': (ctypes.POINTER(_ApriltagDetector), []),
+    'apriltag_detector_destroy': (None, [ctypes.POINTER(_ApriltagDetector)]),
+    'apriltag_detector_add_family_bits': (None, [ctypes.POINTER(_ApriltagDetector),
+                                                 ctypes.POINTER(_ApriltagFamily),
+                                                 ctypes.c_int]),
+    'apriltag_detector_detect': (ctypes.POINTER(_ZArray), [ctypes.POINTER(_ApriltagDetector),
+                                                           ctypes.POINTER(_ImageU8)]),
+    'apriltag_detections_destroy': (None, [ctypes.POINTER(_ZArray)]),
+    'image_u8_create': (ctypes.POINTER(_ImageU8), [ctypes.c_uint, ctypes.c_uint]),
+    'image_u8_destroy': (None, [ctypes.POINTER(_ImageU8)]),
+    'estimate_tag_pose': (ctypes.c_double, [ctypes.POINTER(_ApriltagDetectionInfo),
+                                            ctypes.POINTER(_ApriltagPose)]),
+    'matd_destroy': (None, [ctypes.POINTER(_Matd)]),
+}
+for _family in _FAMILIES:
+    _SIGNATURES[_family + '_create'] = (ctypes.POINTER(_ApriltagFamily), [])
+    _SIGNATURES[_family + '_destroy'] = (None, [ctypes.POINTER(_ApriltagFamily)])
+
+class _Functions(object):
+    '''libapriltag functions with their signatures declared once.'''
+
+    def __init__(self, libc):
+        for name, (restype, argtypes) in _SIGNATURES.items():
+            func = getattr(libc, name)
+            func.restype = restype
+            func.argtypes = argtypes
+            setattr(self, name, func)
+
+# numpy view of an apriltag_detection struct, so a whole batch of detections
+# can be copied into one array and sliced per field
+_DETECTION_DTYPE = numpy.dtype({
+    'names': ['family', 'id', 'hamming', 'decision_margin', 'H', 'c', 'p'],
+    'formats': [numpy.uintp, numpy.intc, numpy.intc, numpy.float32, numpy.uintp,
+                (numpy.float64, (2,)), (numpy.float64, (4, 2))],
+    'offsets': [_ApriltagDetection.family.offset, _ApriltagDetection.id.offset,
+                _ApriltagDetection.hamming.offset, _ApriltagDetection.decision_margin.offset,
+                _ApriltagDetection.H.offset, _ApriltagDetection.c.offset,
+                _ApriltagDetection.p.offset],
+    'itemsize': ctypes.sizeof(_ApriltagDetection)})
+
+_MATD_DATA_OFFSET = _Matd.data.offset
+
+######################################################################
+
 def _ptr_to_array2d(datatype, ptr, rows, cols):
     array_type = (datatype*cols)*rows
     array_buf = array_type.from_address(ctypes.addressof(ptr))
@@ -172,13 +221,66 @@ class Detection():
         return self.__str__()
 
 
+class Detections(object):
+
+    '''Struct-of-arrays result of Detector.detect_batch(). Row i of every
+array belongs to detection i. The arrays are views into buffers owned by the
+detector and are overwritten by its next detection call; copy what you keep.
+
+tag_family: list of family names (bytes)
+tag_id, hamming, decision_margin: shape (n,)
+homography: shape (n, 3, 3)
+center: shape (n, 2)
+corners: shape (n, 4, 2)
+pose_R, pose_t, pose_err: shapes (n, 3, 3), (n, 3, 1), (n,), None unless
+pose estimation was requested, NaN for detections left out by pose_ids or
+max_poses'''
+
+    def __init__(self):
+        self.tag_family = []
+        self.tag_id = None
+        self.hamming = None
+        self.decision_margin = None
+        self.homography = None
+        self.center = None
+        self.corners = None
+        self.pose_R = None
+        self.pose_t = None
+        self.pose_err = None
+
+    def __len__(self):
+        return len(self.tag_family)
+
+    def __getitem__(self, i):
+        # Copy detection i out into a Detection object
+        detection = Detection()
+        detection.tag_family = self.tag_family[i]
+        detection.tag_id = int(self.tag_id[i])
+        detection.hamming = int(self.hamming[i])
+        detection.decision_margin = float(self.decision_margin[i])
+        detection.homography = self.homography[i].copy()
+        detection.center = self.center[i].copy()
+        detection.corners = self.corners[i].copy()
+        if self.pose_R is not None:
+            detection.pose_R = self.pose_R[i].copy()
+            detection.pose_t = self.pose_t[i].copy()
+            detection.pose_err = float(self.pose_err[i])
+        return detection
+
+    def __str__(self):
+        return str([int(i) for i in self.tag_id])
+
+    def __repr__(self):
+        return self.__str__()
+
+
 ######################################################################
 
 class Detector(object):
 
     '''Pythonic wrapper for apriltag_detector.
 
-    families: Tag families, separated with a space, default: tag36h11
+    families: Tag families, separated with a space, e.g. 'tag36h11 tag16h5'. All of them are decoded in the same detection pass, default: tag36h11
 
     nthreads: Number of threads, default: 1
 
@@ -193,6 +295,10 @@ class Detector(object):
     searchpath: Where to look for the Apriltag 3 library, must be a list, default: ['apriltags']
 
     debug: If 1, will save debug images. Runs very slow, default: 0
+
+    roi_padding: Margin added around previously seen tags by track(), as a multiple of the largest tag's size in pixels, default: 1.0
+
+    full_scan_interval: track() scans the whole frame at least every this many frames, default: 10
     '''
 
     def __init__(self,
@@ -203,7 +309,9 @@ class Detector(object):
                 refine_edges=1,
                 decode_sharpening=0.25,
                 debug=0,
-                searchpath=['apriltags']):
+                searchpath=['apriltags'],
+                roi_padding=1.0,
+                full_scan_interval=10):
 
         # Parse the parameters
         self.params = dict()
@@ -214,6 +322,8 @@ class Detector(object):
         self.params['refine_edges'] = refine_edges
         self.params['decode_sharpening'] = decode_sharpening
         self.params['debug'] = debug
+        self.params['roi_padding'] = roi_padding
+        self.params['full_scan_interval'] = full_scan_interval
 
         # detect OS to get extension for DLL
         uname0 = os.uname()[0]
@@ -228,6 +338,17 @@ class Detector(object):
         self.tag_detector = None
         self.tag_detector_ptr = None
 
+        # tracking state: (row0, row1, col0, col1) searched by the next
+        # track() call, tags it expects and frames since the last full scan
+        self._roi = None
+        self._tracked = 0
+        self._since_scan = 0
+
+        # image_u8 reused across frames of the same size when the caller's
+        # buffer can't be handed to the detector directly
+        self._c_img = None
+        self._c_img_array = None
+
         for path in searchpath:
             relpath = os.path.join(path, filename)
             if os.path.exists(relpath):
@@ -244,47 +365,29 @@ class Detector(object):
             raise RuntimeError('could not find DLL named ' + filename)
 
 
+        # declare the C function signatures once
+        self.fn = _Functions(self.libc)
+
         # create the c-_apriltag_detector object
-        self.libc.apriltag_detector_create.restype = ctypes.POINTER(_ApriltagDetector)
-        self.tag_detector_ptr = self.libc.apriltag_detector_create()
+        self.tag_detector_ptr = self.fn.apriltag_detector_create()
 
-        # create the family
-        self.libc.apriltag_detector_add_family_bits.restype = None
+        # create every requested family and add it to the one detector, so a
+        # single detection pass decodes all of them
         self.tag_families = dict()
-        if 'tag16h5' in self.params['families']:
-            self.libc.tag16h5_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tag16h5']=self.libc.tag16h5_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tag16h5'], 2)
-        elif 'tag25h9' in self.params['families']:
-            self.libc.tag25h9_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tag25h9']=self.libc.tag25h9_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tag25h9'], 2)
-        elif 'tag36h11' in self.params['families']:
-            self.libc.tag36h11_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tag36h11']=self.libc.tag36h11_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tag36h11'], 2)
-        elif 'tagCircle21h7' in self.params['families']:
-            self.libc.tagCircle21h7_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tagCircle21h7']=self.libc.tagCircle21h7_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tagCircle21h7'], 2)
-        elif 'tagCircle49h12' in self.params['families']:
-            self.libc.tagCircle49h12_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tagCircle49h12']=self.libc.tagCircle49h12_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tagCircle49h12'], 2)
-        elif 'tagCustom48h12' in self.params['families']:
-            self.libc.tagCustom48h12_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tagCustom48h12']=self.libc.tagCustom48h12_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tagCustom48h12'], 2)
-        elif 'tagStandard41h12' in self.params['families']:
-            self.libc.tagStandard41h12_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tagStandard41h12']=self.libc.tagStandard41h12_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tagStandard41h12'], 2)
-        elif 'tagStandard52h13' in self.params['families']:
-            self.libc.tagStandard52h13_create.restype = ctypes.POINTER(_ApriltagFamily)
-            self.tag_families['tagStandard52h13']=self.libc.tagStandard52h13_create()
-            self.libc.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families['tagStandard52h13'], 2)
-        else:
-            raise Exception('Unrecognized tag family name. Use e.g. \'tag36h11\'.\n')
+        for family in self.params['families']:
+            if family not in _FAMILIES:
+                raise Exception('Unrecognized tag family name \'' + family + '\'. Use e.g. \'tag36h11\'.\n')
+            if family in self.tag_families:
+                continue
+            self.tag_families[family] = getattr(self.fn, family + '_create')()
+            self.fn.apriltag_detector_add_family_bits(self.tag_detector_ptr, self.tag_families[family], 2)
+        if not self.tag_families:
+            raise Exception('No tag family given. Use e.g. \'tag36h11\'.\n')
+
+        # family struct address -> name, to label batched detections
+        self._family_names = dict()
+        for family, tf in self.tag_families.items():
+            self._family_names[ctypes.addressof(tf.contents)] = family.encode()
 
         # configure the parameters of the detector
         self.tag_detector_ptr.contents.nthreads = int(self.params['nthreads'])
@@ -294,137 +397,231 @@ class Detector(object):
         self.tag_detector_ptr.contents.decode_sharpening = int(self.params['decode_sharpening'])
         self.tag_detector_ptr.contents.debug = int(self.params['debug'])
 
+        # preallocated detection buffers, grown as needed
+        self._allocate(16)
+
 
 
     def __del__(self):
+        if self._c_img is not None:
+            self.fn.image_u8_destroy(self._c_img)
+
         if self.tag_detector_ptr is not None:
             # destroy the tag families
             for family, tf in self.tag_families.items():
-                if 'tag16h5' == family:
-                    self.libc.tag16h5_destroy.restype = None
-                    self.libc.tag16h5_destroy(tf)
-                elif 'tag25h9' == family:
-                    self.libc.tag25h9_destroy.restype = None
-                    self.libc.tag25h9_destroy(tf)
-                elif 'tag36h11' == family:
-                    self.libc.tag36h11_destroy.restype = None
-                    self.libc.tag36h11_destroy(tf)
-                elif 'tagCircle21h7' == family:
-                    self.libc.tagCircle21h7_destroy.restype = None
-                    self.libc.tagCircle21h7_destroy(tf)
-                elif 'tagCircle49h12' == family:
-                    self.libc.tagCircle49h12_destroy.restype = None
-                    self.libc.tagCircle49h12_destroy(tf)
-                elif 'tagCustom48h12' == family:
-                    self.libc.tagCustom48h12_destroy.restype = None
-                    self.libc.tagCustom48h12_destroy(tf)
-                elif 'tagStandard41h12' == family:
-                    self.libc.tagStandard41h12_destroy.restype = None
-                    self.libc.tagStandard41h12_destroy(tf)
-                elif 'tagStandard52h13' == family:
-                    self.libc.tagStandard52h13_destroy.restype = None
-                    self.libc.tagStandard52h13_destroy(tf)
+                getattr(self.fn, family + '_destroy')(tf)
 
             # destroy the detector
-            self.libc.apriltag_detector_destroy.restype = None
-            self.libc.apriltag_detector_destroy(self.tag_detector_ptr)
+            self.fn.apriltag_detector_destroy(self.tag_detector_ptr)
+
+    def _allocate(self, capacity):
+        self._capacity = capacity
+        self._records = numpy.zeros(capacity, dtype=_DETECTION_DTYPE)
+        self._homography = numpy.zeros((capacity, 3, 3))
+        self._pose_R = numpy.zeros((capacity, 3, 3))
+        self._pose_t = numpy.zeros((capacity, 3, 1))
+        self._pose_err = numpy.zeros(capacity)
 
-    def detect(self, img, estimate_tag_pose=False, camera_params=None, tag_size=None):
+    def detect(self, img, estimate_tag_pose=False, camera_params=None, tag_size=None,
+               pose_ids=None, max_poses=None):
 
         '''Run detectons on the provided image. The image must be a grayscale
-image of type numpy.uint8.'''
+image of type numpy.uint8. Returns a list of Detection objects.
+
+With estimate_tag_pose the pose can be limited to the tags that are needed:
+only detections whose ID is in pose_ids get one (all if None), at most
+max_poses of them, those with the highest decision_margin. The others have
+NaN pose_R, pose_t and pose_err.'''
+
+        detections = self.detect_batch(img, estimate_tag_pose, camera_params, tag_size,
+                                       pose_ids, max_poses)
+
+        return [detections[i] for i in range(len(detections))]
+
+    def detect_batch(self, img, estimate_tag_pose=False, camera_params=None, tag_size=None,
+                     pose_ids=None, max_poses=None):
+
+        '''Same as detect() but returns all detections at once as a
+Detections struct-of-arrays backed by preallocated buffers.'''
+
+        return self._detect_batch(img, estimate_tag_pose, camera_params, tag_size,
+                                  pose_ids, max_poses, 0, 0)
+
+    def track(self, img, estimate_tag_pose=False, camera_params=None, tag_size=None,
+              pose_ids=None, max_poses=None):
+
+        '''Detection for a video stream. Like detect_batch(), but after tags
+are found only a padded region around them is searched in the next frame.
+The whole frame is scanned again when a tracked tag is missed and every
+full_scan_interval frames. Coordinates are always in the full frame.'''
+
+        if self._roi is not None and self._since_scan < self.params['full_scan_interval']:
+            row0, row1, col0, col1 = self._roi
+            self._since_scan += 1
+            result = self._detect_batch(img[row0:row1, col0:col1], estimate_tag_pose,
+                                        camera_params, tag_size, pose_ids, max_poses, col0, row0)
+            if len(result) >= self._tracked:
+                self._update_roi(result, img.shape)
+                return result
+
+        result = self._detect_batch(img, estimate_tag_pose, camera_params, tag_size,
+                                    pose_ids, max_poses, 0, 0)
+        self._since_scan = 0
+        self._update_roi(result, img.shape)
+        return result
+
+    def _update_roi(self, detections, shape):
+
+        # Region around the detected tags to search in the next frame
+        self._tracked = len(detections)
+        if not self._tracked:
+            self._roi = None
+            return
+        corners = detections.corners
+        low = corners.min(axis=1)
+        high = corners.max(axis=1)
+        pad = self.params['roi_padding'] * (high - low).max()
+        col0, row0 = numpy.floor(low.min(axis=0) - pad).astype(int)
+        col1, row1 = numpy.ceil(high.max(axis=0) + pad).astype(int) + 1
+        self._roi = (max(int(row0), 0), min(int(row1), shape[0]),
+                     max(int(col0), 0), min(int(col1), shape[1]))
+
+    def _detect_batch(self, img, estimate_tag_pose, camera_params, tag_size, pose_ids, max_poses, x0, y0):
+
+        # x0, y0: position of img in the full frame, added to the results
 
         assert len(img.shape) == 2
         assert img.dtype == numpy.uint8
 
-        c_img = self._convert_image(img)
+        if estimate_tag_pose:
+            if camera_params==None:
+                raise Exception('camera_params must be provided to detect if estimate_tag_pose is set to True')
+            if tag_size==None:
+                raise Exception('tag_size must be provided to detect if estimate_tag_pose is set to True')
 
-        return_info = []
+        c_img = self._convert_image(img)
 
         #detect apriltags in the image
-        self.libc.apriltag_detector_detect.restype = ctypes.POINTER(_ZArray)
-        detections = self.libc.apriltag_detector_detect(self.tag_detector_ptr, c_img)
-
-        apriltag = ctypes.POINTER(_ApriltagDetection)()
-
-
-        for i in range(0, detections.contents.size):
-
-            #extract the data for each apriltag that was identified
-            zarray_get(detections, i, ctypes.byref(apriltag))
-
-            tag = apriltag.contents
-
-            homography = _matd_get_array(tag.H).copy() # numpy.zeros((3,3))  # Don't ask questions, move on with your life
-            center = numpy.ctypeslib.as_array(tag.c, shape=(2,)).copy()
-            corners = numpy.ctypeslib.as_array(tag.p, shape=(4, 2)).copy()
-
-            detection = Detection()
-            detection.tag_family = ctypes.string_at(tag.family.contents.name)
-            detection.tag_id = tag.id
-            detection.hamming = tag.hamming
-            detection.decision_margin = tag.decision_margin
-            detection.homography = homography
-            detection.center = center
-            detection.corners = corners
-
-            if estimate_tag_pose:
-                if camera_params==None:
-                    raise Exception('camera_params must be provided to detect if estimate_tag_pose is set to True')
-                if tag_size==None:
-                    raise Exception('tag_size must be provided to detect if estimate_tag_pose is set to True')
-
-                camera_fx, camera_fy, camera_cx, camera_cy = [ c for c in camera_params ]
+        detections = self.fn.apriltag_detector_detect(self.tag_detector_ptr, c_img)
+
+        n = detections.contents.size
+        if n > self._capacity:
+            self._allocate(max(n, 2*self._capacity))
+
+        # copy every apriltag_detection struct into the record buffer, then
+        # every 3x3 homography into its own buffer
+        ptrs = (ctypes.c_void_p * n).from_address(detections.contents.data) if n else []
+        rec_addr = self._records.ctypes.data
+        rec_size = _DETECTION_DTYPE.itemsize
+        for i in range(n):
+            ctypes.memmove(rec_addr + i*rec_size, ptrs[i], rec_size)
+        records = self._records[:n]
+        H_addr = self._homography.ctypes.data
+        H_size = self._homography[0].nbytes
+        for i, H in enumerate(records['H']):
+            ctypes.memmove(H_addr + i*H_size, int(H) + _MATD_DATA_OFFSET, H_size)
+
+        if x0 or y0:
+            records['c'] += (x0, y0)
+            records['p'] += (x0, y0)
+            shift = numpy.array([[1., 0., x0], [0., 1., y0], [0., 0., 1.]])
+            numpy.matmul(shift, self._homography[:n], out=self._homography[:n])
+
+        result = Detections()
+        result.tag_family = [self._family_names[int(f)] for f in records['family']]
+        result.tag_id = records['id']
+        result.hamming = records['hamming']
+        result.decision_margin = records['decision_margin']
+        result.homography = self._homography[:n]
+        result.center = records['c']
+        result.corners = records['p']
+
+        if estimate_tag_pose:
+            camera_fx, camera_fy, camera_cx, camera_cy = [ c for c in camera_params ]
+            # the principal point is relative to img, not the full frame
+            camera_cx -= x0
+            camera_cy -= y0
+            info = _ApriltagDetectionInfo(tagsize=tag_size,
+                                          fx=camera_fx,
+                                          fy=camera_fy,
+                                          cx=camera_cx,
+                                          cy=camera_cy)
+            pose = _ApriltagPose()
+            # Only the detections that are going to be used get a pose
+            selected = [i for i in range(n) if pose_ids is None or int(records['id'][i]) in pose_ids]
+            if max_poses is not None and len(selected) > max_poses:
+                selected.sort(key=lambda i: -records['decision_margin'][i])
+                selected = selected[:max_poses]
+            self._pose_R[:n] = numpy.nan
+            self._pose_t[:n] = numpy.nan
+            self._pose_err[:n] = numpy.nan
+            for i in selected:
+                info.det = ctypes.cast(ptrs[i], ctypes.POINTER(_ApriltagDetection))
+                self._pose_err[i] = self.fn.estimate_tag_pose(ctypes.byref(info), ctypes.byref(pose))
+                self._pose_R[i] = _matd_get_array(pose.R)
+                self._pose_t[i] = _matd_get_array(pose.t)
+                self.fn.matd_destroy(pose.R)
+                self.fn.matd_destroy(pose.t)
+            result.pose_R = self._pose_R[:n]
+            result.pose_t = self._pose_t[:n]
+            result.pose_err = self._pose_err[:n]
+
+        self.fn.apriltag_detections_destroy(detections)
+
+        return result
 
-                info = _ApriltagDetectionInfo(det=apriltag,
-                                              tagsize=tag_size,
-                                              fx=camera_fx,
-                                              fy=camera_fy,
-                                              cx=camera_cx,
-                                              cy=camera_cy)
-                pose = _ApriltagPose()
 
-                self.libc.estimate_tag_pose.restype = ctypes.c_double
-                err = self.libc.estimate_tag_pose(ctypes.byref(info), ctypes.byref(pose))
-
-                detection.pose_R = _matd_get_array(pose.R).copy()
-                detection.pose_t = _matd_get_array(pose.t).copy()
-                detection.pose_err = err
-
-
-            #Append this dict to the tag data array
-            return_info.append(detection)
+    def _convert_image(self, img):
 
-        self.libc.image_u8_destroy.restype = None
-        self.libc.image_u8_destroy(c_img)
+        '''Returns an image_u8 pointer for img. The image_u8 is owned by the
+detector (or wraps img) and must not be destroyed by the caller.'''
 
-        self.libc.apriltag_detections_destroy.restype = None
-        self.libc.apriltag_detections_destroy(detections)
+        height = img.shape[0]
+        width = img.shape[1]
 
-        return return_info
+        if self._can_wrap(img):
+            # Zero-copy: point an image_u8 straight at the numpy buffer. The
+            # caller keeps img alive until detect() returns.
+            c_img = _ImageU8(width=width,
+                             height=height,
+                             stride=img.strides[0],
+                             buf=img.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8)))
+            return ctypes.pointer(c_img)
+
+        if self._c_img is None or self._c_img.contents.width != width \
+                or self._c_img.contents.height != height:
+            if self._c_img is not None:
+                self.fn.image_u8_destroy(self._c_img)
+            self._c_img = self.fn.image_u8_create(width, height)
+            self._c_img_array = _image_u8_get_array(self._c_img)
 
+        # copy the opencv image into the destination array, accounting for the
+        # difference between stride & width.
+        self._c_img_array[:, :width] = img
 
-    def _convert_image(self, img):
+        return self._c_img
 
-        height = img.shape[0]
-        width = img.shape[1]
+    def _can_wrap(self, img):
 
-        self.libc.image_u8_create.restype = ctypes.POINTER(_ImageU8)
-        c_img = self.libc.image_u8_create(width, height)
+        '''True if img can be passed to the C detector without copying.'''
 
-        tmp = _image_u8_get_array(c_img)
+        # Rows must be contiguous bytes
+        if img.strides[1] != 1 or img.strides[0] < img.shape[1]:
+            return False
 
-        # copy the opencv image into the destination array, accounting for the
-        # difference between stride & width.
-        tmp[:, :width] = img
+        # Without decimation a non-zero quad_sigma blurs the input image in
+        # place, which would modify the caller's frame
+        detector = self.tag_detector_ptr.contents
+        if detector.quad_sigma != 0 and detector.quad_decimate <= 1:
+            return False
 
-        # tmp goes out of scope here but we don't care because
-        # the underlying data is still in c_img.
-        return c_img
+        return True
 
 
 if __name__ == '__main__':
 
+    import capture
+
     # test_images_path = 'test'
 
     visualization = True
@@ -461,7 +658,7 @@ if __name__ == '__main__':
     x=1 
     buf=-1
     index=0
-    camera = PiCamera()
+    camera = capture.PiCameraSource((640, 480))
     time.sleep(0.1)
     #### TEST WITH THE SAMPLE IMAGE ####
     try:
@@ -473,9 +670,7 @@ if __name__ == '__main__':
             #start_time1=time.time()
             #ret, img = cam.read()
             #img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            camera.capture('/home/pi/Desktop/image.jpg')
-            test1 =cv2.imread('/home/pi/Desktop/image.jpg')
-            img=cv2.cvtColor(test1, cv2.COLOR_BGR2GRAY)
+            ret, img = camera.read()
             tags = at_detector.detect(img)
             if tags:
                 ans=type(int(str(tags[0])))
@@ -502,7 +697,7 @@ if __name__ == '__main__':
         
     except KeyboardInterrupt:
         print("Ctl C pressed - ending program ")
-        cam.release()
+        camera.release()
         cv2.destroyAllWindows()
 
 
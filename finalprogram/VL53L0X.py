@@ -78,6 +78,15 @@ write_func = WRITEFUNC(i2c_write)
 # pass i2c read and write function pointers to VL53L0X library
 tof_lib.VL53L0X_set_i2c(read_func, write_func)
 
+def use_native_i2c(bus=1):
+    """Let the library access /dev/i2c-<bus> itself, without calling back into Python"""
+    if tof_lib.VL53L0X_use_native_i2c(bus) != 0:
+        raise IOError("Cannot open /dev/i2c-%d" % bus)
+
+def use_python_i2c():
+    """Go back to the smbus callbacks above"""
+    tof_lib.VL53L0X_set_i2c(read_func, write_func)
+
 class VL53L0X(object):
     """VL53L0X ToF."""
 
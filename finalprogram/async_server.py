@@ -0,0 +1,322 @@
+import asyncio
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import protocol
+
+# asyncio drone command server
+#
+# Serves the command set of the original server (see protocol.py) to any
+# number of simultaneous clients: one-shot connections, text sessions and
+# binary sessions, each with its own telemetry subscription. Hardware is
+# reached only through a HardwareActor, so GPIO/I2C calls from different
+# clients never overlap.
+#
+# The hardware object passed in must provide
+#   forward() backward() right() left() up() down() stop() quit()
+#   tof()           returns (TOF_dist, TOF_status, stamps), the newest
+#                   reading of each sensor and when it was taken (None:
+#                   never)
+#   tag()           returns (AT_visible, AT_ID, AT_dist, AT_ang, stamp)
+#   detector()      returns (quad_decimate, nthreads, frame_time, detect_rate)
+#   pose()          returns ((x, y, altitude, heading), stamp) of the last
+#                   localization fix, (None, None) before the first
+#   state()         returns (state, std, stamp) of the state estimator,
+#                   (None, None, None) before the first fix
+# tof(), tag(), detector(), pose() and state() only read shared state and
+# are called directly; everything else goes through the actor.
+#
+# Run "python async_server.py" for a stand-in server without hardware, in
+# the spirit of server_test.py, on 127.0.0.1:12002.
+
+
+class HardwareActor:
+    '''Runs hardware calls one at a time, in order, on a single worker thread.'''
+
+    def __init__(self, hw):
+        self.hw = hw
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def call(self, name, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, getattr(self.hw, name), *args)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class StandInHardware:
+    '''No hardware, returns the same placeholder values as server_test.py.'''
+
+    def forward(self):
+        pass
+
+    def backward(self):
+        pass
+
+    def right(self):
+        pass
+
+    def left(self):
+        pass
+
+    def up(self):
+        pass
+
+    def down(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def quit(self):
+        pass
+
+    def tof(self):
+        now = time.time()
+        return [5.8, 1.5, 0.1], [0, 1, 2], [now, now, now]
+
+    def tag(self):
+        return True, 3, 1.2, 32, time.time()
+
+    def detector(self):
+        return 1.0, 1, 0.05, 1.0
+
+    def pose(self):
+        return (1.0, 3.0, 1.2, 32.0), time.time()
+
+    def state(self):
+        return [1.0, 3.0, 1.2, 32.0, 0., 0., 0., 0.], [0.05, 0.05, 0.05, 3., 0.1, 0.1, 0.1, 5.], time.time()
+
+
+class Session:
+    '''State of one open session.'''
+
+    def __init__(self, writer, binary):
+        self.writer = writer
+        self.binary = binary
+        self.sub = None         # {'topics': [...], 'period': s, 'change': bool}
+        self.push_task = None
+
+    def send(self, req_id, payload):
+        # write() does not yield, so frames from the request loop and the push
+        # task never interleave
+        self.writer.write(protocol.pack_frame(req_id, payload))
+
+
+class DroneServer:
+    '''Command handling and telemetry shared by every client connection.'''
+
+    # Motion commands and the hardware call that carries them out
+    motion = {"forward": "forward", "backward": "backward", "right": "right",
+              "left": "left", "up": "up", "down": "down", "stop": "stop"}
+
+    def __init__(self, hw, AT_coords, verbose=True):
+        self.hw = hw
+        self.actor = HardwareActor(hw)
+        self.AT_coords = AT_coords      # AprilTag ID -> known (x,y) coordinates
+        self.verbose = verbose
+        self.wp = [0,0,1,0]             # Current waypoint
+        self.op_mode = 0                # 0: full auto, 1: waypoint, 2: manual
+        self.stopped = None
+        self.writers = set()            # Open client connections
+
+    # Telemetry values, shared by the poll commands and the push stream
+    def wp_value(self):
+        return list(self.wp)
+
+    def at_value(self):
+        AT_visible, AT_ID, AT_dist, AT_ang, stamp = self.hw.tag()
+        if AT_visible and (AT_ID in self.AT_coords):
+            return (AT_visible, AT_ID, self.AT_coords[AT_ID][0], self.AT_coords[AT_ID][1], AT_dist, AT_ang)
+        return (AT_visible, None, None, None, None, None)
+
+    def tof_value(self):
+        # Newest readings of the background sampler, never waits on the
+        # sensors. TOF_age is the age of the oldest of them.
+        TOF_dist, TOF_status, stamps = self.hw.tof()
+        stamps = [stamp for stamp in stamps[:3] if stamp is not None]
+        TOF_age = time.time() - min(stamps) if stamps else None
+        return list(TOF_dist[:3]), list(TOF_status[:3]), TOF_age
+
+    def det_value(self):
+        return tuple(self.hw.detector())
+
+    def pose_value(self):
+        pose, stamp = self.hw.pose()
+        if pose is None:
+            return (None, None, None, None, None)
+        return tuple(pose) + (time.time() - stamp,)
+
+    def state_value(self):
+        state, std, stamp = self.hw.state()
+        if state is None:
+            return (None,) * 17
+        return tuple(state) + tuple(std) + (time.time() - stamp,)
+
+    async def topic_value(self, topic):
+        if topic == "at":
+            return self.at_value()
+        elif topic == "tof":
+            return self.tof_value()
+        elif topic == "det":
+            return self.det_value()
+        elif topic == "pose":
+            return self.pose_value()
+        elif topic == "state":
+            return self.state_value()
+        return self.wp_value()
+
+    # Handles a single decoded command (see protocol.py), returns the reply as (kind, value)
+    async def handle_command(self, cmd, arg):
+        if self.verbose:
+            print("received message: "+protocol.format_request(cmd, arg))
+        if cmd == "quit":
+            # Close server (debugging)
+            await self.actor.call("quit")
+            self.stopped.set()
+            return ("text", "quitting")
+        elif cmd in self.motion:
+            await self.actor.call(self.motion[cmd])
+        elif cmd == "curr wp":
+            # Requesting current waypoint
+            return ("wp", self.wp_value())
+        elif cmd == "mode":
+            self.op_mode = arg
+            if self.verbose:
+                print("new op mode: " + str(self.op_mode))
+        elif cmd == "wp":
+            # Waypoint command set new waypoint
+            self.wp[:] = arg
+        elif cmd == "at":
+            # Requesting AprilTag data
+            return ("at", self.at_value())
+        elif cmd == "tof":
+            # Requesting time of flight data
+            return ("tof", self.tof_value())
+        elif cmd == "det":
+            # Requesting AprilTag detector settings
+            return ("det", self.det_value())
+        elif cmd == "pose":
+            # Requesting the drone's position from localization
+            return ("pose", self.pose_value())
+        elif cmd == "state":
+            # Requesting the state estimator's drone state
+            return ("state", self.state_value())
+        else:
+            if self.verbose:
+                print("Not recognized")
+            return ("text", "Not recognized")
+        return ("text", "")
+
+    # Handles commands that only make sense inside a session
+    async def handle_session_command(self, session, cmd, arg):
+        if cmd == "sub":
+            # sub <topics> <rate in Hz> [change]
+            topics, rate, change = arg
+            if rate <= 0 or not topics or not all(t in protocol.TOPICS for t in topics):
+                return ("text", "Bad subscription")
+            session.sub = {'topics': topics, 'period': 1./rate, 'change': change}
+            if session.push_task is None:
+                session.push_task = asyncio.ensure_future(self.push_telemetry(session))
+            return ("text", "ok")
+        elif cmd == "unsub":
+            session.sub = None
+            if session.push_task is not None:
+                session.push_task.cancel()
+                session.push_task = None
+            return ("text", "ok")
+        return await self.handle_command(cmd, arg)
+
+    async def push_telemetry(self, session):
+        last = {}
+        next_time = time.time()
+        while session.sub is not None:
+            sub = session.sub
+            for topic in sub['topics']:
+                value = await self.topic_value(topic)
+                # The age of ToF readings, pose fixes and estimates changes
+                # all the time, only the values count
+                key = value[:2] if topic == "tof" else value[:4] if topic == "pose" else \
+                    value[:-1] if topic == "state" else value
+                if sub['change'] and last.get(topic) == key:
+                    continue
+                last[topic] = key
+                session.send(protocol.PUSH_ID, protocol.pack_push(topic, value, session.binary))
+            await session.writer.drain()
+            next_time = max(next_time + sub['period'], time.time())
+            await asyncio.sleep(next_time - time.time())
+
+    async def serve_session(self, reader, writer, binary):
+        session = Session(writer, binary)
+        try:
+            while True:
+                header = await reader.readexactly(protocol.FRAME_HEADER.size)
+                length, req_id = protocol.FRAME_HEADER.unpack(header)
+                if length > protocol.MAX_FRAME_SIZE:
+                    raise ValueError("Frame of {} bytes exceeds limit".format(length))
+                payload = await reader.readexactly(length)
+                if binary:
+                    cmd, arg = protocol.unpack_request(payload)
+                else:
+                    cmd, arg = protocol.parse_request(payload.decode())
+                kind, value = await self.handle_session_command(session, cmd, arg)
+                if binary:
+                    session.send(req_id, protocol.pack_reply(kind, value))
+                else:
+                    session.send(req_id, protocol.format_reply(kind, value).encode())
+                await writer.drain()
+        finally:
+            session.sub = None
+            if session.push_task is not None:
+                session.push_task.cancel()
+
+    async def handle_client(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            message = (await reader.read(1024)).decode()
+            if message == protocol.SESSION_REQUEST or message == protocol.BINARY_REQUEST:
+                # Keep the connection open and switch it to framed requests
+                binary = message == protocol.BINARY_REQUEST
+                accept = protocol.BINARY_ACCEPT if binary else protocol.SESSION_ACCEPT
+                writer.write(accept.encode())
+                await writer.drain()
+                await self.serve_session(reader, writer, binary)
+            elif message:
+                # One-shot text request
+                kind, value = await self.handle_command(*protocol.parse_request(message))
+                writer.write(protocol.format_reply(kind, value).encode())
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            # Client closed the connection
+            pass
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            print("Session error: " + str(e))
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def serve(self, host, port):
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print("The server is ready to receive")
+        try:
+            await self.stopped.wait()
+        finally:
+            server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await server.wait_closed()
+            self.actor.close()
+
+
+def run(hw, host, port, AT_coords, verbose=True):
+    asyncio.run(DroneServer(hw, AT_coords, verbose).serve(host, port))
+
+
+if __name__ == '__main__':
+    # Stand-in server for testing the base station and load_test.py without a drone
+    import landmarks
+    AT_coords = landmarks.LandmarkMap(landmarks.MAP_FILE)
+    run(StandInHardware(), '127.0.0.1', 12002, AT_coords, verbose='-q' not in sys.argv)
@@ -4,7 +4,9 @@ from pygame.locals import *
 import ctypes
 import socket
 import threading
+import queue
 from numpy import arange
+import protocol
 
 ### Globals ###
 
@@ -12,7 +14,9 @@ from numpy import arange
 AT_ID = None        # Visible AprilTag ID or None if no AT visible or ATs disabled
 alt = None          # Last known altitude or None if ATs disabled or not yet found
 coords = None       # Last known position (x,y) or None if ATs disabled or not yet found
-orient = None       # Last known orientation in deg or None if ATs disabled or not yet found
+orient = None       # Last known heading in deg (see drone_heading) or None if ATs disabled or not yet found
+pose_age = None     # Age of the drone's last localization fix in seconds
+state_age = None    # Age of the drone's last state estimate in seconds
 
 # Time of flight distances
 # Left, center, right
@@ -24,52 +28,187 @@ TOF_dist = [0.,0.,0.]
 # 1: Danger
 # 2: Collision imminent
 TOF_status = [0, 0, 0]
+TOF_age = None          # Age of the ToF readings in seconds
 
 # While loop variable
 running = True
 
 class conn:
 
-    def __init__(self, ip, port):
-        self.clientSocket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        self.clientSocket.connect((ip,port))
+    # Reply kind expected for each command in text mode (see protocol.py)
+    reply_kind = {"at": "at", "tof": "tof", "curr wp": "wp", "det": "det", "pose": "pose", "state": "state"}
+
+    # session=True keeps one socket open for every request (falls back to
+    # one-shot connections if the drone does not support sessions).
+    # binary=True asks for the compact binary encoding, text is used if the
+    # drone does not support it.
+    def __init__(self, ip, port, session=False, binary=False, timeout=2.):
+        self.addr = (ip,port)
+        self.timeout = timeout
+        self.session = False
+        self.binary = False
+        self.want_session = session
+        self.want_binary = binary
+        # Pushed telemetry as (topic, value), filled once subscribed
+        self.telemetry = queue.Queue(maxsize=100)
+        if session:
+            self.reopen()
+
+    # Opens a session, again after it dropped. Returns True if there is one.
+    def reopen(self):
+        if not (self.want_binary and self.__open_session(protocol.BINARY_REQUEST, protocol.BINARY_ACCEPT, True)):
+            self.__open_session(protocol.SESSION_REQUEST, protocol.SESSION_ACCEPT, False)
+        return self.session
+
+    def __open_session(self, request, accept, binary):
+        sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.addr)
+            sock.send(request.encode())
+            answer = sock.recv(1024).decode()
+        except OSError:
+            # Drone unreachable, stay with one-shot requests
+            sock.close()
+            return False
+        if answer != accept:
+            # Older server, caller falls back
+            sock.close()
+            return False
+        sock.settimeout(None)
+        self.clientSocket = sock
+        self.binary = binary
+        self.session = True
+        self.next_id = 0
+        self.send_lock = threading.Lock()
+        self.reply_cv = threading.Condition()
+        self.waiting = set()    # Request IDs with a caller waiting on the reply
+        self.replies = {}       # Request ID -> reply payload
+        self.reader = threading.Thread(target=self.__read_replies)
+        self.reader.daemon = True
+        self.reader.start()
+        return True
 
+    def __read_replies(self):
+        try:
+            while True:
+                req_id, payload = protocol.recv_frame(self.clientSocket)
+                if req_id is None:
+                    break
+                if req_id == protocol.PUSH_ID:
+                    try:
+                        self.telemetry.put_nowait(protocol.unpack_push(payload, self.binary))
+                    except queue.Full:
+                        # UI is not keeping up, drop the update
+                        pass
+                    continue
+                with self.reply_cv:
+                    if req_id in self.waiting:
+                        self.replies[req_id] = payload
+                        self.reply_cv.notify_all()
+        except (OSError, ValueError):
+            pass
+        with self.reply_cv:
+            self.session = False
+            self.reply_cv.notify_all()
+        self.clientSocket.close()
+
+    # Sends a command (see protocol.py) and returns the reply value
+    def __request(self, cmd, arg=None, reply=True):
+        kind = self.reply_kind.get(cmd, "text")
+        if not self.session:
+            # One-shot text request on its own connection
+            sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.addr)
+            sock.send(protocol.format_request(cmd, arg).encode())
+            ret = protocol.parse_reply(kind, sock.recv(1024).decode()) if reply else None
+            sock.close()
+            return ret
+
+        if self.binary:
+            msg = protocol.pack_request(cmd, arg)
+        else:
+            msg = protocol.format_request(cmd, arg).encode()
+
+        # Requests may be pipelined, replies are matched by request ID
+        with self.send_lock:
+            req_id = self.next_id
+            self.next_id = (self.next_id + 1) % protocol.PUSH_ID
+            if reply:
+                with self.reply_cv:
+                    self.waiting.add(req_id)
+            protocol.send_frame(self.clientSocket, req_id, msg)
+        if not reply:
+            return None
+        deadline = time.time() + self.timeout
+        with self.reply_cv:
+            while req_id not in self.replies:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.session:
+                    self.waiting.discard(req_id)
+                    raise socket.timeout("No reply to " + cmd)
+                self.reply_cv.wait(remaining)
+            self.waiting.discard(req_id)
+            payload = self.replies.pop(req_id)
+        if self.binary:
+            return protocol.unpack_reply(payload)[1]
+        return protocol.parse_reply(kind, payload.decode())
+
+    # Ask the drone to push topics (see protocol.TOPICS) at rate Hz into
+    # self.telemetry. Returns False if there is no session to push over.
+    def subscribe(self, topics, rate, on_change=False):
+        if not self.session:
+            return False
+        if not topics:
+            return self.__request("unsub") == "ok"
+        return self.__request("sub", (topics, rate, on_change)) == "ok"
+
+    # Returns (AT_visible, AT_ID, x, y, AT_dist, AT_ang)
     def get_AT(self):
-        self.clientSocket.send("at".encode())
-        msg, addr = self.clientSocket.recvfrom(1024)
-        return msg.decode()
+        return self.__request("at")
 
+    # Returns (TOF_dist, TOF_status, TOF_age)
     def get_TOF(self):
-        self.clientSocket.send("tof".encode())
-        msg, addr = self.clientSocket.recvfrom(1024)
-        return msg.decode()
+        return self.__request("tof")
 
+    # Returns [x, y, z, theta]
     def get_wp(self):
-        self.clientSocket.send("curr wp".encode())
-        msg,addr = self.clientSocket.recvfrom(1024)
-        return msg.decode()
+        return self.__request("curr wp")
+
+    # Returns (quad_decimate, nthreads, frame_time, detect_rate)
+    def get_det(self):
+        return self.__request("det")
+
+    # Returns (x, y, altitude, heading, age), all None before the first fix
+    def get_pose(self):
+        return self.__request("pose")
+
+    # Returns (x, y, z, heading, u, v, w, r, their 8 standard deviations, age),
+    # all None before the first fix
+    def get_state(self):
+        return self.__request("state")
 
     def send_acc(self, dir):
         if dir == "forward" or dir == "backward" or dir == "right" \
             or dir == "left" or dir == "up" or dir == "down" or dir == "stop":
-            self.clientSocket.send(dir.encode())
+            self.__request(dir, reply=False)
         else:
             raise Exception("Acceleration direction not recognized")
 
     def send_wp(self, x, y, z, theta):
-        str = "wp " + x + "," + y + "," + z + "," + theta
-        self.clientSocket.send(str.encode())
+        self.__request("wp", [float(x), float(y), float(z), float(theta)], reply=False)
 
     def send_drive(self,mode):
-        str = "mode " + mode
-        self.clientSocket.send(str.encode())
+        self.__request("mode", int(mode), reply=False)
 
     def exit(self):
-        self.clientSocket.send("quit".encode())
-        self.clientSocket.recvfrom(1024)
+        self.__request("quit")
 
     def close(self):
-        self.clientSocket.close()
+        if self.session:
+            self.session = False
+            self.clientSocket.close()
 
 class UI:
 
@@ -655,29 +794,67 @@ class UI:
         self.err_txt = ''
         self.err_time = time.time()
 
-def get_AT_thread(ip,port):
+# Heading convention
+# The drone's heading in degrees counterclockwise from map x, as
+# localization.py defines it, rounded and wrapped to [-180, 180). Every
+# source of orient goes through drone_heading. Pose and state replies carry
+# this heading. A tag reply only carries AT_ang, the tag's heading minus the
+# drone's; the base station does not know the tag's heading and takes 0,
+# the tag's x axis along map x, which gives a drone heading of -AT_ang.
+def drone_heading(heading=0., AT_ang=0.):
+    return round((heading - AT_ang + 180.) % 360. - 180.)
+
+def parse_AT(AT_info):
     global AT_ID, coords, alt, orient
-    server = conn(ip,port)
-    AT_info = server.get_AT().split(',')
-    AT_visible = bool(AT_info[0])
-    if AT_visible:
-        AT_ID = int(AT_info[1])
-        coords = [float(AT_info[2]), float(AT_info[3])]
-        alt = float(AT_info[4])
-        orient = -1*float(AT_info[5])
-
-def get_TOF_thread(ip,port):
-    global TOF_dist, TOF_status
-    server = conn(ip,port)
-    TOF_info = server.get_TOF().split(',')
+    AT_visible, ID, x, y, AT_dist, AT_ang = AT_info
+    if AT_visible and ID is not None:
+        AT_ID = ID
+        if pose_age is None:
+            # No localization fix from the drone, show the tag's position
+            coords = [x, y]
+            alt = AT_dist
+            orient = None if AT_ang is None else drone_heading(AT_ang=AT_ang)
+
+def parse_pose(pose):
+    global coords, alt, orient, pose_age
+    x, y, z, heading, age = pose
+    if x is not None:
+        pose_age = age
+        if state_age is None:
+            # No state estimate from the drone, show the fix
+            coords = [round(x, 2), round(y, 2)]
+            alt = round(z, 2)
+            orient = drone_heading(heading)
+
+def parse_state(state):
+    global coords, alt, orient, state_age
+    x, y, z, heading = state[:4]
+    if x is not None:
+        coords = [round(x, 2), round(y, 2)]
+        alt = round(z, 2)
+        orient = drone_heading(heading)
+        state_age = state[-1]
+
+def parse_TOF(TOF_info):
+    global TOF_dist, TOF_status, TOF_age
+    dist, status, TOF_age = TOF_info
     for n in range(3):
-        TOF_dist[n] = float(TOF_info[n])
-        TOF_status[n] = int(TOF_info[n+3])
+        TOF_dist[n] = dist[n]
+        TOF_status[n] = status[n]
+
+def parse_wp(wp,ui):
+    ui.curr_wp_x, ui.curr_wp_y, ui.curr_wp_z, ui.curr_wp_theta = ['{:g}'.format(i) for i in wp]
 
-def man_control_thread(ip,port,dir):
-    server = conn(ip,port)
+def get_AT_thread(server):
+    parse_AT(server.get_AT())
+    parse_pose(server.get_pose())
+    parse_state(server.get_state())
+
+def get_TOF_thread(server):
+    parse_TOF(server.get_TOF())
+
+def man_control_thread(server,dir):
     server.send_acc(dir)
-    server.close()
 
 def str_is_num(str):
     try:
@@ -686,7 +863,7 @@ def str_is_num(str):
     except ValueError:
         return False
 
-def wp_control_thread(ip,port,ui):
+def wp_control_thread(server,ui):
 
     # Get coordinate strings
     x,y,z,theta = ui.wp_x_txt,ui.wp_y_txt,ui.wp_z_txt,ui.wp_theta_txt
@@ -712,9 +889,7 @@ def wp_control_thread(ip,port,ui):
         if str_is_num(y):
             if str_is_num(z):
                 if str_is_num(theta):
-                    server = conn(ip,port)
                     server.send_wp(x, y, z, theta)
-                    server.close()
                 else:
                     ui.print_err = True
                     ui.err_txt = u"\u03B8" + " value is not a number"
@@ -736,20 +911,49 @@ def wp_control_thread(ip,port,ui):
         ui.err_time = time.time()
         ui.wp_x_active = True
 
-def get_wp_thread(ip,port,ui):
-    server = conn(ip,port)
-    ui.curr_wp_x, ui.curr_wp_y, ui.curr_wp_z, ui.curr_wp_theta = server.get_wp().split(',')
-    server.close()
-
-def send_drive_thread(ip,port,mode):
-    server = conn(ip,port)
+def get_wp_thread(server,ui):
+    parse_wp(server.get_wp(),ui)
+
+# Subscribe to the telemetry the UI currently shows, returns False if the drone can't push
+def subscribe_telemetry(server,ui,rate):
+    topics = ["wp"]
+    if ui.AT_en:
+        topics.append("at")
+        topics.append("pose")
+        topics.append("state")
+    if ui.TOF_en:
+        topics.append("tof")
+    return server.subscribe(topics, rate, on_change=True)
+
+# Apply every pushed update waiting in the queue
+def read_telemetry(server,ui):
+    while True:
+        try:
+            topic, value = server.telemetry.get_nowait()
+        except queue.Empty:
+            break
+        if topic == "at" and ui.AT_en:
+            parse_AT(value)
+        elif topic == "pose" and ui.AT_en:
+            parse_pose(value)
+        elif topic == "state" and ui.AT_en:
+            parse_state(value)
+        elif topic == "tof" and ui.TOF_en:
+            parse_TOF(value)
+        elif topic == "wp":
+            parse_wp(value,ui)
+
+# Reopen a dropped session and subscribe again, polling goes on until then
+def resume_session_thread(server,ui,rate):
+    global streaming
+    if server.reopen():
+        streaming = subscribe_telemetry(server,ui,rate)
+
+def send_drive_thread(server,mode):
     server.send_drive(str(mode))
-    server.close()
 
-def terminate_server(ip,port):
-    server = conn(ip,port)
+def terminate_server(server):
     server.exit()
-    server.close()
 
 
 if __name__ == '__main__':
@@ -760,23 +964,44 @@ if __name__ == '__main__':
 
     ui = UI()
 
+    # One long-lived connection shared by every request thread
+    server = conn(server_ip, server_port, session=True, binary=True)
+
+    # Telemetry push rate in Hz, updates are only sent when they change
+    telemetry_rate = 10
+    streaming = subscribe_telemetry(server,ui,telemetry_rate)
+    resume_thread = None
+
     server_counter = 0
 
     try:
         while running:
 
-            # Only query drone for current waypoint, AprilTag data, and TOF data every 30 frames
-            if ui.drive == 0 and server_counter == 30:
+            if streaming and not server.session:
+                # Session dropped, poll until it is back
+                streaming = False
+            if not streaming and server.want_session and server_counter == 45 and \
+                    (resume_thread is None or not resume_thread.is_alive()):
+                resume_thread = threading.Thread(target=resume_session_thread, args=(server,ui,telemetry_rate))
+                resume_thread.daemon = True
+                resume_thread.start()
+
+            if streaming:
+                # Drone pushes waypoint, AprilTag and TOF updates
+                read_telemetry(server,ui)
+
+            # Otherwise only query drone for current waypoint, AprilTag data, and TOF data every 30 frames
+            elif ui.drive == 0 and server_counter == 30:
                 # Waypoint only changes in auto mode
-                wp_thread = threading.Thread(target=get_wp_thread, args=(server_ip,server_port,ui))
+                wp_thread = threading.Thread(target=get_wp_thread, args=(server,ui))
                 wp_thread.start()
             elif ui.AT_en and server_counter == 60:
                 # Update AprilTag if enabled
-                at_thread = threading.Thread(target=get_AT_thread, args=(server_ip,server_port))
+                at_thread = threading.Thread(target=get_AT_thread, args=(server,))
                 at_thread.start()
             elif ui.TOF_en and server_counter == 25:
                 # Update TOF distances if enabled
-                tof_thread = threading.Thread(target=get_TOF_thread, args=(server_ip,server_port))
+                tof_thread = threading.Thread(target=get_TOF_thread, args=(server,))
                 tof_thread.start()
 
             if server_counter == 60:
@@ -804,17 +1029,21 @@ if __name__ == '__main__':
                     if x > ui.quit_x and x < ui.quit_x + 40 and y < ui.quit_y + 20 and y > ui.quit_y:
                         # Quit button clicked
                         running = False
-                        terminate_server(server_ip,server_port)
+                        terminate_server(server)
                     elif x < ui.AT_switch_x + ui.switch_size[0] and x > ui.AT_switch_x and \
                             y < ui.AT_switch_y + ui.switch_size[1] and y > ui.AT_switch_y:
                         # AprilTag enable switch clicked
                         ui.AT_en = not ui.AT_en
+                        if streaming:
+                            subscribe_telemetry(server,ui,telemetry_rate)
                         if not ui.AT_en:
                             # Clear AT and localization info if ATs disabled
                             AT_ID = None
                             coords = None
                             alt = None
                             orient = None
+                            pose_age = None
+                            state_age = None
                     elif x < ui.proj_switch_x + ui.switch_size[0] and x > ui.proj_switch_x and \
                             y < ui.proj_switch_y + ui.switch_size[1] and y > ui.proj_switch_y:
                         # Projector enable switch clicked
@@ -823,14 +1052,16 @@ if __name__ == '__main__':
                             y < ui.TOF_switch_y + ui.switch_size[1] and y > ui.TOF_switch_y:
                         # Projector enable switch clicked
                         ui.TOF_en = not ui.TOF_en
+                        if streaming:
+                            subscribe_telemetry(server,ui,telemetry_rate)
                     elif x < ui.mode_x + ui.mode_but_size[0] and x > ui.mode_x and \
                             y < ui.mode_y + ui.mode_but_size[1] and y > ui.mode_y:
                         # Auto button clicked
                         ui.drive = 0
-                        wp_thread = threading.Thread(target=get_wp_thread, args=(server_ip,server_port,ui))
+                        wp_thread = threading.Thread(target=get_wp_thread, args=(server,ui))
                         wp_thread.start()
                         time.sleep(0.02)
-                        drive_thread = threading.Thread(target=send_drive_thread, args=(server_ip,server_port,ui.drive))
+                        drive_thread = threading.Thread(target=send_drive_thread, args=(server,ui.drive))
                         drive_thread.start()
                         ui.print_err = True
                         ui.err_txt = "Warning: Auto mode not yet supported"
@@ -839,10 +1070,10 @@ if __name__ == '__main__':
                             y < ui.mode_y + ui.mode_but_size[1] and y > ui.mode_y:
                         # Waypoint button clicked
                         ui.drive = 1
-                        wp_thread = threading.Thread(target=get_wp_thread, args=(server_ip,server_port,ui))
+                        wp_thread = threading.Thread(target=get_wp_thread, args=(server,ui))
                         wp_thread.start()
                         time.sleep(0.02)
-                        drive_thread = threading.Thread(target=send_drive_thread, args=(server_ip,server_port,ui.drive))
+                        drive_thread = threading.Thread(target=send_drive_thread, args=(server,ui.drive))
                         drive_thread.start()
                         ui.print_err = True
                         ui.err_txt = "Warning: Waypoint mode not yet supported"
@@ -852,7 +1083,7 @@ if __name__ == '__main__':
                         # Manual button clicked
                         ui.drive = 2
                         time.sleep(0.02)
-                        drive_thread = threading.Thread(target=send_drive_thread, args=(server_ip,server_port,ui.drive))
+                        drive_thread = threading.Thread(target=send_drive_thread, args=(server,ui.drive))
                         drive_thread.start()
                     elif ui.drive == 1:
                         # Waypoint drive mode
@@ -870,47 +1101,47 @@ if __name__ == '__main__':
                             ui.wp_theta_active = True
                         elif x > ui.wp_send_x and x < ui.wp_send_x + ui.wp_tb_size[0] and y > ui.wp_send_y and y < ui.wp_send_y + ui.wp_tb_size[1]:
                             # Send waypoint clicked
-                            move_thread = threading.Thread(target=wp_control_thread, args=(server_ip,server_port,ui))
+                            move_thread = threading.Thread(target=wp_control_thread, args=(server,ui))
                             move_thread.start()
                             time.sleep(0.02)
-                            wp_thread = threading.Thread(target=get_wp_thread, args=(server_ip,server_port,ui))
+                            wp_thread = threading.Thread(target=get_wp_thread, args=(server,ui))
                             wp_thread.start()
                     elif ui.drive == 2:
                         # Manual drive mode
                         if x > ui.pos_x and x < ui.pos_x + 70 and y > ui.pos_y and y < ui.pos_y + 70:
                             # Forward button clicked
-                            move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"forward"))
+                            move_thread = threading.Thread(target=man_control_thread, args=(server,"forward"))
                             move_thread.start()
                         elif x > ui.pos_x and x < ui.pos_x + 70 and y > ui.pos_y + 80 and y < ui.pos_y + 150:
                             # Back button clicked
-                            move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"backward"))
+                            move_thread = threading.Thread(target=man_control_thread, args=(server,"backward"))
                             move_thread.start()
                         elif x > ui.pos_x + 80 and x < ui.pos_x + 150 and y > ui.pos_y + 80 and y < ui.pos_y + 150:
                             # Right button clicked
-                            move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"right"))
+                            move_thread = threading.Thread(target=man_control_thread, args=(server,"right"))
                             move_thread.start()
                         elif x > ui.pos_x - 80 and x < ui.pos_x - 10 and y > ui.pos_y + 80 and y < ui.pos_y + 150:
                             # Left button clicked
-                            move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"left"))
+                            move_thread = threading.Thread(target=man_control_thread, args=(server,"left"))
                             move_thread.start()
                         elif x > ui.alt_x and x < ui.alt_x + 70 and y > ui.alt_y and y < ui.alt_y + 70:
                             # Up button clicked
-                            move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"up"))
+                            move_thread = threading.Thread(target=man_control_thread, args=(server,"up"))
                             move_thread.start()
                         elif x > ui.alt_x and x < ui.alt_x + 70 and y > ui.alt_y + 80 and y < ui.alt_y + 150:
                             # Down button clicked
-                            move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"down"))
+                            move_thread = threading.Thread(target=man_control_thread, args=(server,"down"))
                             move_thread.start()
                 elif(event.type is MOUSEBUTTONUP) and ui.drive == 2:
                     # Stop motors
-                    move_thread = threading.Thread(target=man_control_thread, args=(server_ip,server_port,"stop"))
+                    move_thread = threading.Thread(target=man_control_thread, args=(server,"stop"))
                     move_thread.start()
                 elif(event.type is KEYDOWN) and ui.drive == 1:
                     if event.key == pygame.K_RETURN:
-                        move_thread = threading.Thread(target=wp_control_thread, args=(server_ip,server_port,ui))
+                        move_thread = threading.Thread(target=wp_control_thread, args=(server,ui))
                         move_thread.start()
                         time.sleep(0.02)
-                        wp_thread = threading.Thread(target=get_wp_thread, args=(server_ip,server_port,ui))
+                        wp_thread = threading.Thread(target=get_wp_thread, args=(server,ui))
                         wp_thread.start()
                     elif ui.wp_x_active:
                         if event.key == pygame.K_BACKSPACE:
@@ -953,7 +1184,9 @@ if __name__ == '__main__':
 
             ui.wait_frame_rate()
     except:
+        server.close()
         pygame.quit()
         raise
 
+    server.close()
     pygame.quit()
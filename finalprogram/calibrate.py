@@ -0,0 +1,120 @@
+import argparse
+import sys
+import numpy
+import cv2
+import capture
+import calibration
+import localization
+import Apriltag
+
+# Camera calibration from recorded frames
+#
+#   python3 calibrate.py frames/ --cell 0.002
+#   python3 calibrate.py calib.avi --checkerboard 9x6 --square 0.025
+#
+# Target is either a strip of AprilTags printed from apriltags/apriltag_gen.py
+# or a checkerboard. Record the target held flat at different distances and
+# angles, filling different parts of the image, then run this on the
+# recording. Writes camera_calibration.json (see calibration.py).
+#
+# apriltag_gen.py puts tag n of the family at n * TAG_PITCH cells from the
+# left, each tag is the black square (side sqrt(bits) + 2 cells) with a two
+# cell white border. --cell is the printed size of one cell in meters: the
+# SVG output is 2 mm per cell, measure the print to be sure.
+
+GEN_FAMILIES = {'tag16h5': 4, 'tag25h9': 5, 'tag36h11': 6}     # Data bits per side
+GEN_PITCH = 10          # TAG_PITCH of apriltag_gen.py
+GEN_TAGS = 10           # NTAGS of apriltag_gen.py
+
+
+def tag_points(family, tag_id, cell, pitch=GEN_PITCH):
+    # Target positions in meters (x right, y down, z 0) of a generated tag's
+    # corners, in detection order
+    side = GEN_FAMILIES[family] + 2
+    x0 = tag_id * pitch + 2
+    y0 = 2
+    corners = localization.TAG_CORNERS
+    points = numpy.zeros((4, 3), dtype=numpy.float32)
+    points[:, 0] = (x0 + (corners[:, 0] + 1) / 2. * side) * cell
+    points[:, 1] = (y0 + (corners[:, 1] + 1) / 2. * side) * cell
+    return points
+
+
+def find_tags(detector, img, family, cell, min_tags):
+    tags = [tag for tag in detector.detect(img) if tag.tag_id < GEN_TAGS]
+    if len(tags) < min_tags:
+        return None, None
+    object_points = numpy.concatenate([tag_points(family, tag.tag_id, cell) for tag in tags])
+    image_points = numpy.concatenate([tag.corners for tag in tags]).astype(numpy.float32)
+    return object_points, image_points
+
+
+def find_checkerboard(img, board, square):
+    cols, rows = board
+    found, corners = cv2.findChessboardCorners(img, (cols, rows))
+    if not found:
+        return None, None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    corners = cv2.cornerSubPix(img, corners, (11, 11), (-1, -1), criteria)
+    object_points = numpy.zeros((rows * cols, 3), dtype=numpy.float32)
+    object_points[:, :2] = numpy.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * square
+    return object_points, corners.reshape(-1, 2)
+
+
+def main(args):
+    source = capture.ReplaySource(args.path)
+    if args.checkerboard:
+        board = [int(i) for i in args.checkerboard.split('x')]
+    else:
+        if args.family not in GEN_FAMILIES:
+            print("apriltag_gen.py only makes " + ", ".join(sorted(GEN_FAMILIES)))
+            return 1
+        detector = Apriltag.Detector(families=args.family, quad_decimate=1.0,
+                                     searchpath=args.searchpath)
+
+    object_points, image_points = [], []
+    image_size = None
+    n = 0
+    while True:
+        img, stamp = source.read_stamped()
+        if img is None:
+            break
+        n += 1
+        if (n - 1) % args.step:
+            continue
+        image_size = (img.shape[1], img.shape[0])
+        if args.checkerboard:
+            obj, pts = find_checkerboard(img, board, args.square)
+        else:
+            obj, pts = find_tags(detector, img, args.family, args.cell, args.min_tags)
+        if obj is not None:
+            object_points.append(obj)
+            image_points.append(pts)
+    source.release()
+
+    print("Target found in {} of {} frames".format(len(object_points), n))
+    if len(object_points) < args.min_frames:
+        print("Need at least {} frames with the target".format(args.min_frames))
+        return 1
+    rms, K, dist, rvecs, tvecs = cv2.calibrateCamera(object_points, image_points, image_size, None, None)
+    cal = calibration.Calibration(K, dist, image_size, rms, len(object_points))
+    calibration.save(cal, args.out)
+    print("fx, fy, cx, cy: " + ", ".join("{:.1f}".format(i) for i in cal.camera_params()))
+    print("distortion: " + " ".join("{:.4f}".format(i) for i in cal.dist_coeffs))
+    print("RMS reprojection error {:.3f} px, written to {}".format(rms, args.out))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calibrate the camera from a recording of a target")
+    parser.add_argument("path", help="video file or directory of images")
+    parser.add_argument("--family", default="tag36h11", help="family of the apriltag_gen.py target")
+    parser.add_argument("--cell", type=float, default=0.002, help="printed tag cell size in meters")
+    parser.add_argument("--min-tags", type=int, default=2, help="tags a frame needs to be used")
+    parser.add_argument("--checkerboard", help="use a checkerboard of COLSxROWS inner corners instead")
+    parser.add_argument("--square", type=float, default=0.025, help="checkerboard square size in meters")
+    parser.add_argument("--step", type=int, default=1, help="use every step-th frame")
+    parser.add_argument("--min-frames", type=int, default=10)
+    parser.add_argument("--out", default=calibration.CALIBRATION_FILE)
+    parser.add_argument("--searchpath", nargs="+", default=['apriltags/lib', 'apriltags/lib64', 'apriltags'])
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+import json
+import os
+import numpy
+import cv2
+
+# Camera intrinsics
+#
+# calibrate.py writes the camera matrix and distortion coefficients found
+# from recorded frames to a JSON file:
+#
+#   {"image_size": [640, 480],
+#    "camera_matrix": [[fx, 0, cx], [0, fy, cy], [0, 0, 1]],
+#    "dist_coeffs": [k1, k2, p1, p2, k3],
+#    "rms": 0.31, "frames": 42}
+#
+# The vision code loads it with load(). There are two ways to correct for
+# lens distortion, both keeping the same camera matrix, so camera_params
+# stay valid afterwards:
+#
+#   undistort(img)            whole frame, one cv2.remap with lookup tables
+#                             built once on first use
+#   undistort_points(pts)     only the given pixel positions (tag corners),
+#                             much cheaper when only corners are used
+#
+#   cal = calibration.load()
+#   fx, fy, cx, cy = cal.camera_params()
+#   corners = cal.undistort_points(tag.corners)
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "camera_calibration.json")
+
+
+class Calibration:
+    '''Camera matrix and distortion of one camera at one resolution.'''
+
+    def __init__(self, camera_matrix, dist_coeffs, image_size, rms=None, frames=None):
+        self.camera_matrix = numpy.array(camera_matrix, dtype=float).reshape(3, 3)
+        self.dist_coeffs = numpy.array(dist_coeffs, dtype=float).ravel()
+        self.image_size = tuple(int(i) for i in image_size)    # (width, height)
+        self.rms = rms                  # Reprojection error of the calibration in pixels
+        self.frames = frames            # Number of frames used
+        self.maps = None                # remap lookup tables, built on first undistort()
+        self.out = None
+
+    def camera_params(self):
+        # (fx, fy, cx, cy) as the detector and Localizer take them
+        K = self.camera_matrix
+        return K[0, 0], K[1, 1], K[0, 2], K[1, 2]
+
+    def undistort(self, img):
+        # Returns the undistorted frame. The result is reused by the next call.
+        if img.shape[1::-1] != self.image_size:
+            raise ValueError("Calibrated for {}x{}, frame is {}x{}".format(
+                self.image_size[0], self.image_size[1], img.shape[1], img.shape[0]))
+        if self.maps is None:
+            # Fixed point maps, the fastest form for remap
+            self.maps = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                    self.camera_matrix, self.image_size, cv2.CV_16SC2)
+        if self.out is None or self.out.shape != img.shape:
+            self.out = numpy.empty_like(img)
+        return cv2.remap(img, self.maps[0], self.maps[1], cv2.INTER_LINEAR, dst=self.out)
+
+    def undistort_points(self, points):
+        # Undistorted pixel positions of an (n, 2) array of pixel positions
+        points = numpy.asarray(points, dtype=float).reshape(-1, 1, 2)
+        return cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs,
+                                   P=self.camera_matrix).reshape(-1, 2)
+
+
+def load(path=CALIBRATION_FILE):
+    with open(path) as f:
+        data = json.load(f)
+    return Calibration(data['camera_matrix'], data['dist_coeffs'], data['image_size'],
+                       data.get('rms'), data.get('frames'))
+
+
+def save(calibration, path=CALIBRATION_FILE):
+    with open(path, 'w') as f:
+        json.dump({'image_size': list(calibration.image_size),
+                   'camera_matrix': calibration.camera_matrix.tolist(),
+                   'dist_coeffs': calibration.dist_coeffs.tolist(),
+                   'rms': calibration.rms,
+                   'frames': calibration.frames}, f, indent=1)
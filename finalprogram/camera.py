@@ -2,12 +2,10 @@
 
 print("1")
 
-from picamera.array import PiRGBArray
+import capture
 
 print("2")
 
-from picamera import PiCamera
-
 print("3")
 
 import time
@@ -18,21 +16,17 @@ import cv2
 
 print("5")
 
-# initialize the camera and grab a reference to the raw camera capture
-camera = PiCamera()
+# initialize the camera, frames are captured to memory as grayscale
+camera = capture.PiCameraSource((640, 480))
 
 print("6")
 
-camera.resolution = (640, 480)
-
 print("7")
 
 # allow the camera to warmup
 time.sleep(0.1)
 while True:
-    camera.capture('/home/pi/Desktop/image.jpg')
-    test1 =cv2.imread('/home/pi/Desktop/image.jpg')
-    gray=cv2.cvtColor(test1, cv2.COLOR_BGR2GRAY)
+    ret, gray = camera.read()
     cv2.imshow('image',gray)
     cv2.waitKey(5)
     print("0")
@@ -0,0 +1,264 @@
+import collections
+import os
+import threading
+import time
+import numpy
+import cv2
+
+# Frame sources
+#
+# Every camera or recording the vision code reads from is a FrameSource:
+#
+#   PiCameraSource   PiCamera video port, YUV captured to memory, the Y plane
+#                    is handed out as the grayscale frame (no JPEG, no disk)
+#   OpenCVSource     cv2.VideoCapture device (V4L2 webcam, /dev/video0)
+#   ReplaySource     recorded video file or directory of images, for running
+#                    and benchmarking the vision stack without hardware
+#
+#   cam = capture.PiCameraSource((640, 480), 30)
+#   cam.start()                     # optional, grab on a background thread
+#   frame, stamp = cam.read_stamped()
+#   ...
+#   cam.release()
+#
+# Frames are grayscale uint8 arrays, stamps are time.time() of the capture
+# (recording time for ReplaySource). read() returns (ret, frame) like
+# cv2.VideoCapture.read().
+#
+# After start() a background thread grabs into a small ring of frame slots.
+# read_stamped() returns the newest frame and drops any older ones waiting,
+# so a slow consumer always works on a fresh frame. A returned frame stays
+# valid until the next read.
+
+
+class FrameSource:
+    '''Base class, subclasses implement grab() and close().'''
+
+    def __init__(self, buffer_size=3):
+        self.buffer_size = buffer_size  # Frames waiting for the consumer at most
+        self.dropped = 0                # Stale frames dropped since start()
+        self.thread = None
+        self.running = False
+        self.ended = False
+        self.cv = threading.Condition()
+        self.pending = collections.deque()  # Slots with unread frames, oldest first
+        self.free = []                  # Slots not in use
+        self.current = None             # Slot handed to the consumer
+
+    def grab(self):
+        # Returns (frame, stamp) of the next frame, (None, None) at the end.
+        # frame may be reused by the next grab().
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.__grab_frames)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __grab_frames(self):
+        while self.running:
+            frame, stamp = self.grab()
+            if frame is None:
+                break
+            with self.cv:
+                if self.free:
+                    slot = self.free.pop()
+                elif len(self.pending) >= self.buffer_size:
+                    # Consumer is behind, overwrite the oldest waiting frame
+                    slot = self.pending.popleft()
+                    self.dropped += 1
+                else:
+                    slot = [None, None]
+            if slot[0] is None or slot[0].shape != frame.shape:
+                slot[0] = numpy.empty_like(frame)
+            numpy.copyto(slot[0], frame)
+            slot[1] = stamp
+            with self.cv:
+                self.pending.append(slot)
+                self.cv.notify()
+        with self.cv:
+            self.ended = True
+            self.cv.notify()
+
+    def read_stamped(self):
+        # Returns (frame, stamp), (None, None) once the source has ended
+        if self.thread is None:
+            return self.grab()
+        with self.cv:
+            if self.current is not None:
+                self.free.append(self.current)
+                self.current = None
+            while not self.pending and not self.ended:
+                self.cv.wait()
+            if not self.pending:
+                return None, None
+            # Newest frame wins, older ones are stale
+            while len(self.pending) > 1:
+                self.free.append(self.pending.popleft())
+                self.dropped += 1
+            self.current = self.pending.popleft()
+            return self.current[0], self.current[1]
+
+    def read(self):
+        frame, stamp = self.read_stamped()
+        return frame is not None, frame
+
+    def release(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.close()
+
+
+class _YUVOutput:
+    '''picamera output writing each frame into a reused buffer.'''
+
+    def __init__(self, size):
+        self.buf = numpy.empty(size, dtype=numpy.uint8)
+        self.pos = 0
+
+    def write(self, data):
+        n = min(len(data), len(self.buf) - self.pos)
+        self.buf[self.pos:self.pos + n] = numpy.frombuffer(data, dtype=numpy.uint8, count=n)
+        self.pos += n
+        return len(data)
+
+    def flush(self):
+        # End of a frame, the next one starts at the beginning again
+        self.pos = 0
+
+
+class PiCameraSource(FrameSource):
+    '''Continuous grayscale capture from the PiCamera video port.'''
+
+    def __init__(self, resolution=(640, 480), framerate=30, buffer_size=3):
+        FrameSource.__init__(self, buffer_size)
+        from picamera import PiCamera
+        width, height = resolution
+        self.camera = PiCamera(resolution=resolution, framerate=framerate)
+        # The camera pads YUV rows to a multiple of 32 and the plane height to
+        # a multiple of 16
+        fwidth = (width + 31) // 32 * 32
+        fheight = (height + 15) // 16 * 16
+        self.output = _YUVOutput(fwidth * fheight * 3 // 2)
+        # Grayscale view of the Y plane without the padding
+        self.gray = self.output.buf[:fwidth * fheight].reshape(fheight, fwidth)[:height, :width]
+        self.frames = self.camera.capture_continuous(self.output, format='yuv', use_video_port=True)
+
+    def grab(self):
+        try:
+            next(self.frames)
+        except StopIteration:
+            return None, None
+        return self.gray, time.time()
+
+    def close(self):
+        self.frames.close()
+        self.camera.close()
+
+
+class OpenCVSource(FrameSource):
+    '''Grayscale frames from a cv2.VideoCapture device.'''
+
+    def __init__(self, device=0, resolution=None, buffer_size=3):
+        FrameSource.__init__(self, buffer_size)
+        self.cap = cv2.VideoCapture(device)
+        # Don't let the driver queue up old frames
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if resolution is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+        self.img = None
+
+    def grab(self):
+        ret, self.img = self.cap.read(self.img)
+        if not ret:
+            return None, None
+        stamp = time.time()
+        if self.img.ndim == 3:
+            return cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY), stamp
+        return self.img, stamp
+
+    def close(self):
+        self.cap.release()
+
+
+class ReplaySource(FrameSource):
+    '''Frames from a video file or a directory of images.'''
+
+    # Frames are delivered as fast as they are read, or at the recorded rate
+    # with realtime=True. Stamps are the recording time in seconds from the
+    # first frame; image directories (read in file name order) are assumed
+    # to be recorded at fps. loop=True starts over at the end.
+
+    extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.pgm', '.tif', '.tiff')
+
+    def __init__(self, path, realtime=False, loop=False, fps=30., buffer_size=3):
+        FrameSource.__init__(self, buffer_size)
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.fps = fps
+        self.cap = None
+        self.files = None
+        if os.path.isdir(path):
+            self.files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                                if f.lower().endswith(self.extensions))
+            if not self.files:
+                raise IOError("No images in " + path)
+        elif os.path.exists(path):
+            self.cap = cv2.VideoCapture(path)
+        else:
+            raise IOError("No such file or directory: " + path)
+        self.index = 0
+        self.offset = 0.        # Recording time of previous passes when looping
+        self.last = 0.
+        self.start_time = None
+
+    def __next_frame(self):
+        if self.files is not None:
+            if self.index >= len(self.files):
+                return None, None
+            img = cv2.imread(self.files[self.index], cv2.IMREAD_GRAYSCALE)
+            stamp = self.index / self.fps
+        else:
+            ret, img = self.cap.read()
+            if not ret:
+                return None, None
+            stamp = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        self.index += 1
+        return img, stamp
+
+    def rewind(self):
+        self.index = 0
+        if self.cap is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def grab(self):
+        img, stamp = self.__next_frame()
+        if img is None and self.loop and self.index > 0:
+            self.offset = self.last + 1. / self.fps
+            self.rewind()
+            img, stamp = self.__next_frame()
+        if img is None:
+            return None, None
+        stamp += self.offset
+        self.last = stamp
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.time() - stamp
+            wait = self.start_time + stamp - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        return img, stamp
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
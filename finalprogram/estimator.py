@@ -0,0 +1,313 @@
+import math
+import threading
+import time
+import numpy
+
+# Drone state estimation
+#
+# An extended Kalman filter runs at a fixed rate on its own thread, between
+# and independent of camera frames. It predicts from the last motion command
+# sent to the motors and corrects with whatever measurements came in since
+# the last step:
+#
+#   AprilTag fixes      (x, y, altitude, heading) from localization.py
+#   ToF ranges          a sensor looking down (bearing None) measures the
+#                       altitude. A horizontal sensor gets a range state of
+#                       its own that the body velocity shortens or lengthens,
+#                       so a sequence of ranges to anything that stays put
+#                       tells the filter how fast the drone moves.
+#
+# State (map axes as in localization.py, body axes forward / left / up):
+#
+#   x, y, z     map position in meters
+#   heading     radians counterclockwise from map x
+#   u, v, w     body velocity forward, left and up in m/s
+#   r           yaw rate in rad/s, positive left
+#   d0 ...      range of each horizontal sensor in meters
+#
+# Motor commands only say which way the drone is pushed, so each command is
+# mapped to a velocity in COMMAND_INPUTS that the body velocity approaches
+# with time constant tau. The process noise covers the rest.
+#
+# Every update observes state components directly, only the prediction is
+# nonlinear. Measurements more than three standard deviations from the
+# prediction are dropped; after max_rejects in a row the filter believes the
+# measurement instead (a new obstacle in a sensor's beam, a filter that lost
+# track). Arrays are allocated once, a step does a few small matrix products
+# in place.
+#
+# Fixes come from frames that are already some time old when the vision
+# thread publishes them. The filter keeps a short history of predicted
+# poses and moves a fix by the motion since its frame was taken.
+#
+#   ekf = estimator.StateEstimator([fusion.RangeSensor(0, **fusion.VL53L1X)])
+#   thread = estimator.EstimatorThread(ekf, tag_state.get_pose, [(tof_latest, [0])])
+#   thread.start()
+#   ekf.command("forward")
+#   state, std, stamp = ekf.latest()
+
+X, Y, Z, HEADING, U, V, W, R = range(8)
+CORE = 8                # Drone states, range states follow
+
+# Body velocity each motion command aims for: u, v, w in m/s, r in deg/s
+SPEED = 0.3
+CLIMB = 0.2
+TURN = 30.
+COMMAND_INPUTS = {"forward": (SPEED, 0., 0., 0.), "backward": (-SPEED, 0., 0., 0.),
+                  "left": (0., 0., 0., TURN), "right": (0., 0., 0., -TURN),
+                  "up": (0., 0., CLIMB, 0.), "down": (0., 0., -CLIMB, 0.),
+                  "stop": (0., 0., 0., 0.)}
+
+# Process noise, standard deviation added per sqrt(second)
+Q_POSITION = 0.02       # m
+Q_HEADING = 0.02        # rad
+Q_VELOCITY = 0.15       # m/s
+Q_YAW_RATE = 0.3        # rad/s
+Q_RANGE = 0.05          # m, obstacles that move
+
+# Standard deviation of an AprilTag fix: x, y, altitude in m, heading in rad
+FIX_SIGMA = (0.05, 0.05, 0.05, math.radians(3.))
+
+# Gates on the normalized innovation, chi-square at 99.7 % (3 sigma) for
+# one and four degrees of freedom
+GATE_1 = 9.
+GATE_4 = 16.25
+
+
+class StateEstimator:
+    '''Extended Kalman filter of the drone's pose and velocity.'''
+
+    def __init__(self, sensors=(), tau=0.5, history=64, max_rejects=5):
+        self.sensors = list(sensors)    # fusion.RangeSensor of each range source, bearing None: down
+        self.tau = tau                  # Seconds for the velocity to follow a command
+        self.max_rejects = max_rejects
+        # Range state index of each horizontal sensor, None for a downward one
+        self.rows = []
+        bearings = []
+        for s in self.sensors:
+            if s.bearing is None:
+                self.rows.append(None)
+            else:
+                self.rows.append(CORE + len(bearings))
+                bearings.append(math.radians(s.bearing))
+        self.cos_b = [math.cos(b) for b in bearings]
+        self.sin_b = [math.sin(b) for b in bearings]
+        n = CORE + len(bearings)
+        self.n = n
+        self.x = numpy.zeros(n)
+        # Pose unknown until the first fix, at rest
+        self.P = numpy.diag([1e3] * 4 + [0.1] * 4 + [1e3] * len(bearings))
+        self.F = numpy.eye(n)
+        self.FP = numpy.empty((n, n))
+        self.KH = numpy.empty((n, n))
+        self.P_diagonal = self.P.reshape(-1)[::n + 1]      # View, P is only ever changed in place
+        # Flat indices of the entries of F that change with the state, in
+        # the order predict() sets them
+        entries = [(X, HEADING), (X, U), (X, V), (Y, HEADING), (Y, U), (Y, V),
+                   (Z, W), (HEADING, R), (U, U), (V, V), (W, W), (R, R)]
+        entries += [(row, U) for row in range(CORE, n)] + [(row, V) for row in range(CORE, n)]
+        self.jacobian = numpy.array([row * n + col for row, col in entries])
+        self.q = numpy.array([Q_POSITION] * 3 + [Q_HEADING] + [Q_VELOCITY] * 3 + [Q_YAW_RATE] +
+                             [Q_RANGE] * len(bearings)) ** 2
+        self.fix_R = numpy.diag(numpy.square(FIX_SIGMA))
+        self.target = (0., 0., 0., 0.)  # u, v, w, r the last command aims for
+        self.initialized = False        # First fix received
+        self.known = [False] * n        # Range states that hold a reading
+        self.rejects = [0] * (len(self.sensors) + 1)    # Per sensor, last entry: fixes
+        self.stamp = None               # Time the state is for
+        # Ring of (stamp, x, y, z, heading) after each prediction
+        self.past = numpy.full((history, 5), -numpy.inf)
+        self.past_next = 0
+        # (state, std, stamp) published by publish()
+        self.newest = (None, None, None)
+
+    def command(self, name):
+        # Motion command sent to the motors, see COMMAND_INPUTS. Called from
+        # the thread driving the motors, the tuple is swapped in whole.
+        u, v, w, r = COMMAND_INPUTS[name]
+        self.target = (u, v, w, math.radians(r))
+
+    def predict(self, stamp):
+        # Moves the state forward to stamp
+        if self.stamp is None:
+            self.stamp = stamp
+            return
+        dt = stamp - self.stamp
+        if dt <= 0:
+            return
+        self.stamp = stamp
+        # Python floats, numpy scalar arithmetic would cost more than the
+        # matrix products
+        state = self.x.tolist()
+        x, y, z, heading, u, v, w, r = state[:CORE]
+        c, s = math.cos(heading), math.sin(heading)
+        a = 1. - math.exp(-dt / self.tau)
+        # Jacobian at the state before it moves, in one put()
+        self.F.put(self.jacobian, [(-u * s - v * c) * dt, c * dt, -s * dt,
+                                   (u * c - v * s) * dt, s * dt, c * dt,
+                                   dt, dt] + [1. - a] * 4 +
+                   [-cb * dt for cb in self.cos_b] + [-sb * dt for sb in self.sin_b])
+        x += (u * c - v * s) * dt
+        y += (u * s + v * c) * dt
+        z += w * dt
+        heading = _wrap(heading + r * dt)
+        tu, tv, tw, tr = self.target
+        state[:CORE] = [x, y, z, heading, u + (tu - u) * a, v + (tv - v) * a,
+                        w + (tw - w) * a, r + (tr - r) * a]
+        for i, (cb, sb) in enumerate(zip(self.cos_b, self.sin_b)):
+            state[CORE + i] -= (cb * u + sb * v) * dt
+        self.x[:] = state
+        # P = F P F' + Q dt
+        numpy.dot(self.F, self.P, out=self.FP)
+        numpy.dot(self.FP, self.F.T, out=self.P)
+        self.P_diagonal += self.q * dt
+        i = self.past_next
+        self.past[i] = (stamp, x, y, z, heading)
+        self.past_next = (i + 1) % len(self.past)
+
+    def fix(self, pose, stamp):
+        # AprilTag fix (x, y, altitude, heading in degrees) from a frame taken
+        # at stamp
+        z = numpy.array([pose[0], pose[1], pose[2], math.radians(pose[3])])
+        if not self.initialized:
+            self.__reset(slice(0, 4), z, self.fix_R)
+            self.initialized = True
+            return
+        # Motion since the frame, from the prediction history
+        i = int(numpy.argmin(numpy.abs(self.past[:, 0] - stamp)))
+        if abs(self.past[i, 0] - stamp) < 0.1:
+            z += self.x[:4] - self.past[i, 1:]
+            z[3] = _wrap(z[3])
+        y = z - self.x[:4]
+        y[3] = _wrap(y[3])
+        S_inv = numpy.linalg.inv(self.P[:4, :4] + self.fix_R)
+        if y.dot(S_inv).dot(y) > GATE_4:
+            if self.__rejected(len(self.sensors)):
+                self.__reset(slice(0, 4), z, self.fix_R)
+            return
+        self.rejects[-1] = 0
+        K = self.P[:, :4].dot(S_inv)
+        self.x += K.dot(y)
+        numpy.dot(K, self.P[:4], out=self.KH)
+        self.P -= self.KH
+        self.x[HEADING] = _wrap(self.x[HEADING])
+
+    def add_range(self, sensor, dist):
+        # Reading of sensors[sensor] in its raw unit, None for no reading
+        s = self.sensors[sensor]
+        row = self.rows[sensor]
+        if dist is None or dist != dist or not s.min_range <= dist * s.scale < s.max_range:
+            # Nothing in range, the range state starts over with the next reading
+            if row is not None:
+                self.known[row] = False
+            return
+        dist = dist * s.scale
+        R = (s.std(dist) / 1000.) ** 2
+        dist /= 1000.
+        if row is None:
+            row = Z
+        elif not self.known[row]:
+            self.__reset(row, dist, R)
+            self.known[row] = True
+            return
+        y = dist - self.x[row]
+        S = self.P[row, row] + R
+        if y * y > GATE_1 * S:
+            if self.__rejected(sensor):
+                self.__reset(row, dist, R)
+            return
+        self.rejects[sensor] = 0
+        K = self.P[:, row] / S
+        self.x += K * y
+        numpy.outer(K, self.P[row], out=self.KH)
+        self.P -= self.KH
+
+    def __rejected(self, source):
+        # Counts a gated out measurement, True once there were too many
+        self.rejects[source] += 1
+        if self.rejects[source] < self.max_rejects:
+            return False
+        self.rejects[source] = 0
+        return True
+
+    def __reset(self, rows, z, R):
+        # Sets state rows to a measurement, uncorrelated with the rest
+        self.x[rows] = z
+        self.P[rows, :] = 0.
+        self.P[:, rows] = 0.
+        self.P[rows, rows] = R
+
+    def publish(self):
+        # Makes the state visible to latest(), one tuple replaced at once
+        if not self.initialized:
+            return
+        state = self.x[:CORE].tolist()
+        std = numpy.sqrt(numpy.maximum(self.P.diagonal()[:CORE], 0.)).tolist()
+        state[HEADING] = math.degrees(state[HEADING])
+        state[R] = math.degrees(state[R])
+        std[HEADING] = math.degrees(std[HEADING])
+        std[R] = math.degrees(std[R])
+        self.newest = (state, std, self.stamp)
+
+    def latest(self):
+        # Returns (state, std, stamp): x, y, z, heading, u, v, w, r with
+        # heading in degrees and r in deg/s, their standard deviations and
+        # the time they are for. (None, None, None) before the first fix.
+        return self.newest
+
+
+def _wrap(angle):
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+class EstimatorThread(threading.Thread):
+    '''Steps a StateEstimator at a fixed rate with the newest measurements.'''
+
+    # fixes() returns (pose, stamp) like TagState.get_pose. range_sources
+    # are (latest, sensors) pairs as for fusion.FusionThread: latest()
+    # returns (distances, stamp) or (distances, stamps), the distances go to
+    # the estimator's sensors of the same position in sensors. Measurements
+    # already used (same stamp) are skipped.
+
+    def __init__(self, estimator, fixes=None, range_sources=(), rate=100.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.estimator = estimator
+        self.fixes = fixes
+        self.range_sources = range_sources
+        self.period = 1. / rate
+        self.fix_stamp = None           # Stamp of the last fix used
+        self.added = {}                 # Sensor -> stamp of its last reading used
+        self.step_time = 0.             # Seconds the last step took
+        self.running = True
+
+    def step(self, now):
+        ekf = self.estimator
+        ekf.predict(now)
+        if self.fixes is not None:
+            pose, stamp = self.fixes()
+            if pose is not None and stamp != self.fix_stamp:
+                self.fix_stamp = stamp
+                ekf.fix(pose, stamp)
+        for latest, sensors in self.range_sources:
+            distances, stamps = latest()
+            if not isinstance(stamps, (list, tuple)):
+                stamps = [stamps] * len(distances)
+            for sensor, dist, stamp in zip(sensors, distances, stamps):
+                if stamp is not None and self.added.get(sensor) != stamp:
+                    self.added[sensor] = stamp
+                    ekf.add_range(sensor, dist)
+        ekf.publish()
+
+    def run(self):
+        next_time = time.time()
+        while self.running:
+            start = time.time()
+            self.step(start)
+            self.step_time = time.time() - start
+            next_time = max(next_time + self.period, time.time())
+            time.sleep(max(next_time - time.time(), 0.))
+
+    def stop(self):
+        self.running = False
+        self.join()
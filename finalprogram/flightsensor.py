@@ -1,40 +1,62 @@
-import qwiic_vl53l1x as qwiic
 import time
 import RPi.GPIO as GPIO
+import tof_array
 
 GPIO.setmode(GPIO.BCM)
 XSHUT = [23, 20] # 15
 address = {23 : 0x2B, 20 : 0x2D, 15: 0x2F}
 
-for pin in XSHUT:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.LOW)
-
-time.sleep(1)
 print("VL53L1X Qwiic Test\n")
-tofs = []
-for i in range(len(XSHUT)):
-    GPIO.output(XSHUT[i], GPIO.HIGH)
-    time.sleep(1)
-    tofs.append(qwiic.QwiicVL53L1X())
-    tofs[i].set_i2c_address(address[XSHUT[i]])  
-    if (tofs[i].sensor_init() == None):                                  # Begin returns 0 on a good init
-        print("Sensor online!\n")
+# Sensors still addressed from a previous run are reused without a reset
+sensor_array = tof_array.SensorArray([(pin, address[pin]) for pin in XSHUT])
+tofs = sensor_array.bring_up()
+print("Sensors online! ({} already configured)\n".format(len(sensor_array.warm)))
 
 
-def measurement():
-    global distances
+# Continuous ranging
+# All sensors range on their own every INTER_MEASUREMENT ms, measurement()
+# only collects the results, so a full sweep takes one timing budget no
+# matter how many sensors there are. A sensor without a new result in time
+# reads None for that sweep, an old distance is never passed off as new.
+TIMING_BUDGET = 33          # ms, one of 15 (short mode only), 20, 33, 50, 100, 200, 500
+INTER_MEASUREMENT = 40      # ms, must be >= TIMING_BUDGET
+ranging = False
+period = INTER_MEASUREMENT / 1000.  # s between results of one sensor
 
-    distances = []
+def start_ranging(timing_budget=TIMING_BUDGET, inter_measurement=INTER_MEASUREMENT):
+    global ranging, period
     for tof in tofs:
+        tof.set_timing_budget_in_ms(timing_budget)
+        tof.set_inter_measurement_in_ms(inter_measurement)
         tof.start_ranging()
-        time.sleep(.005)
-        distances.append(tof.get_distance())
-        time.sleep(.005)
+    period = inter_measurement / 1000.
+    ranging = True
+
+def stop_ranging():
+    global ranging
+    for tof in tofs:
         tof.stop_ranging()
-    
-    distances.append(10)
-    return distances
+    ranging = False
+
+def measurement():
+    # Returns a new distance in mm from every sensor, None for a sensor with
+    # no new result within two measurement periods
+    if not ranging:
+        start_ranging()
+    distances = [None] * len(tofs)
+    pending = list(range(len(tofs)))
+    deadline = time.time() + 2 * period
+    while pending and time.time() < deadline:
+        for i in list(pending):
+            if tofs[i].check_for_data_ready():
+                distances[i] = tofs[i].get_distance()
+                tofs[i].clear_interrupt()      # Arm for the next result
+                pending.remove(i)
+        if pending:
+            time.sleep(.001)
+
+    # No right sensor fitted yet (XSHUT 15)
+    return distances + [None]
 
 
 
@@ -42,13 +64,10 @@ def measurement():
 if __name__ == '__main__':
     while True:
             try:
-                for ToF in tofs:
-                    ToF.start_ranging()                                              # Write configuration bytes to initiate measurement
-                    time.sleep(.005)
-                    distance = ToF.get_distance()    # Get the result of the measurement from the sensor
-                    time.sleep(.005)
-                    ToF.stop_ranging()
-
+                for distance in measurement()[:len(tofs)]:
+                    if distance is None:
+                        print("Distance(mm): no new result")
+                        continue
                     distanceInches = distance / 25.4
                     distanceFeet = distanceInches / 12.0
 
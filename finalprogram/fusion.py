@@ -0,0 +1,197 @@
+import math
+import threading
+import time
+import numpy
+
+# Range sensor fusion
+#
+# Readings from all range sensors (VL53L1X, VL53L0X, ultrasonic) go into one
+# small polar occupancy grid around the drone: bearing bins all the way
+# round, range rings out to max_range. Each sensor has a mounting bearing
+# and a noise model. A reading marks the rings before it free and the rings
+# around it occupied, in every bin the sensor's field of view covers, as
+# log-odds. Bins forget what they saw with time constant tau, so the grid
+# follows the drone without odometry; rotate() turns it with the drone
+# when the yaw change is known.
+#
+# An update touches only the bins in one field of view, so its cost is
+# bounded by the widest sensor and doesn't grow with the number of readings.
+# After every update the nearest occupied range of the touched bins is
+# stored, so the navigator's nearest(bearing) is a lookup.
+#
+# Bearings are in degrees, 0 straight ahead, positive to the left.
+# Distances are in mm.
+#
+#   grid = fusion.ObstacleGrid([fusion.RangeSensor(0, **fusion.VL53L1X),
+#                               fusion.RangeSensor(90, **fusion.VL53L1X)])
+#   grid.add(0, 850, stamp)
+#   grid.nearest(10)        # mm, None if nothing known there
+
+# Noise models, sigma in mm plus sigma_rel of the distance
+VL53L1X = dict(fov=27, min_range=40, max_range=4000, sigma=15, sigma_rel=0.03)
+VL53L0X = dict(fov=25, min_range=30, max_range=1200, sigma=10, sigma_rel=0.03)
+HC_SR04 = dict(fov=15, min_range=20, max_range=4000, sigma=5, sigma_rel=0.01, scale=10)      # reads cm
+MAXBOTIX = dict(fov=30, min_range=300, max_range=7000, sigma=10, sigma_rel=0.01)             # R####, mm
+
+L_OCC = 0.85        # Log-odds added to the cells a reading hits
+L_FREE = -0.4       # Log-odds added to the cells in front of it
+L_MAX = 4.          # Log-odds are clamped to +-L_MAX
+L_THRESHOLD = 0.5   # Cells above this count as occupied
+
+
+class RangeSensor:
+    '''Mounting and noise model of one range sensor.'''
+
+    def __init__(self, bearing, fov, min_range, max_range, sigma, sigma_rel=0., scale=1.):
+        self.bearing = bearing          # Degrees from straight ahead, positive left
+        self.fov = fov                  # Full beam width in degrees
+        self.min_range = min_range      # mm, closer readings are not trusted
+        self.max_range = max_range      # mm, farther readings mean nothing in range
+        self.sigma = sigma              # mm
+        self.sigma_rel = sigma_rel
+        self.scale = scale              # mm per unit of the raw reading
+
+    def std(self, dist):
+        return self.sigma + self.sigma_rel * dist
+
+
+class ObstacleGrid:
+    '''Rolling polar occupancy grid fed by range readings.'''
+
+    def __init__(self, sensors, bins=36, max_range=4000., resolution=50., tau=1.0, max_age=0.5):
+        self.sensors = sensors
+        self.bins = bins
+        self.bin_width = 360. / bins
+        self.rings = int(math.ceil(max_range / resolution))
+        self.resolution = resolution
+        self.max_range = self.rings * resolution
+        self.centers = (numpy.arange(self.rings) + 0.5) * resolution
+        self.tau = tau                  # Seconds for evidence to decay to 1/e
+        self.max_age = max_age          # Bins not updated for longer are unknown
+        self.lock = threading.Lock()
+        self.logodds = numpy.zeros((bins, self.rings))
+        self.hit = numpy.full((bins, self.rings), numpy.inf)    # Last reading that hit each cell
+        self.stamp = numpy.full(bins, -numpy.inf)               # Last update of each bin
+        self.near = numpy.full(bins, numpy.inf)                 # Nearest occupied range per bin
+        self.offset = 0.                # Rotation left over from rotate(), less than one bin
+        # Bins each sensor covers
+        self.covers = [self.__bins_in(s.bearing, s.fov) for s in sensors]
+
+    def __bins_in(self, bearing, fov):
+        first = int(math.floor((bearing - fov / 2.) / self.bin_width + 0.5))
+        last = int(math.floor((bearing + fov / 2.) / self.bin_width + 0.5))
+        return numpy.arange(first, last + 1) % self.bins
+
+    def index(self, bearing):
+        return int(math.floor(bearing / self.bin_width + 0.5)) % self.bins
+
+    def add(self, sensor, dist, stamp=None):
+        # Adds one reading of sensors[sensor] in its raw unit, None for no
+        # reading
+        if dist is None or dist != dist:
+            return
+        if stamp is None:
+            stamp = time.time()
+        s = self.sensors[sensor]
+        dist = dist * s.scale
+        if dist < s.min_range:
+            return
+        bins = self.covers[sensor]
+        with self.lock:
+            rows = self.logodds[bins]
+            # Decay what the bins held since their last update
+            age = numpy.maximum(stamp - self.stamp[bins], 0.)
+            rows *= numpy.exp(-age / self.tau)[:, None]
+            reach = min(dist, s.max_range, self.max_range)
+            free = self.centers < reach - s.std(dist)
+            if dist < s.max_range:
+                hits = numpy.abs(self.centers - dist) <= max(s.std(dist), self.resolution / 2.)
+                # A cell the reading hits is not also free
+                free &= ~hits
+                rows[:, hits] += L_OCC
+                self.hit[numpy.ix_(bins, hits)] = dist
+            rows[:, free] += L_FREE
+            numpy.clip(rows, -L_MAX, L_MAX, out=rows)
+            self.logodds[bins] = rows
+            self.stamp[bins] = numpy.maximum(self.stamp[bins], stamp)
+            occupied = rows > L_THRESHOLD
+            first = occupied.argmax(axis=1)
+            found = occupied[numpy.arange(len(bins)), first]
+            self.near[bins] = numpy.where(found, self.hit[bins, first], numpy.inf)
+
+    def add_sweep(self, sensors, distances, stamp=None):
+        # Adds readings of several sensors taken at the same time
+        for sensor, dist in zip(sensors, distances):
+            self.add(sensor, dist, stamp)
+
+    def rotate(self, angle):
+        # The drone turned angle degrees to the left, obstacles move right
+        with self.lock:
+            self.offset -= angle
+            shift = int(round(self.offset / self.bin_width))
+            if shift:
+                self.offset -= shift * self.bin_width
+                for a in (self.logodds, self.hit, self.stamp, self.near):
+                    a[:] = numpy.roll(a, shift, axis=0)
+
+    def nearest(self, bearing, now=None):
+        # Nearest obstacle in mm at bearing, inf if the bin is known free,
+        # None if it hasn't been seen within max_age
+        if now is None:
+            now = time.time()
+        b = self.index(bearing)
+        if now - self.stamp[b] > self.max_age:
+            return None
+        return float(self.near[b])
+
+    def closest(self, now=None):
+        # (bearing, distance) of the nearest obstacle seen within max_age,
+        # (None, None) if there is none
+        if now is None:
+            now = time.time()
+        with self.lock:
+            near = numpy.where(now - self.stamp <= self.max_age, self.near, numpy.inf)
+        b = int(near.argmin())
+        if near[b] == numpy.inf:
+            return None, None
+        bearing = b * self.bin_width
+        return (bearing - 360. if bearing > 180. else bearing), float(near[b])
+
+
+class FusionThread(threading.Thread):
+    '''Feeds new readings from sensor drivers into an ObstacleGrid.'''
+
+    # sources: (latest, sensors) pairs. latest() returns (distances, stamp)
+    # or (distances, stamps) like TofSampler and UltrasonicArray do; the
+    # distances go to the grid's sensors of the same position in sensors.
+    # Readings already added (same stamp) are skipped.
+
+    def __init__(self, grid, sources, rate=20.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.grid = grid
+        self.sources = sources
+        self.period = 1. / rate
+        self.added = {}                 # Sensor -> stamp of its last added reading
+        self.running = True
+
+    def poll(self):
+        for latest, sensors in self.sources:
+            distances, stamps = latest()
+            if not isinstance(stamps, (list, tuple)):
+                stamps = [stamps] * len(distances)
+            for sensor, dist, stamp in zip(sensors, distances, stamps):
+                if stamp is not None and self.added.get(sensor) != stamp:
+                    self.added[sensor] = stamp
+                    self.grid.add(sensor, dist, stamp)
+
+    def run(self):
+        next_time = time.time()
+        while self.running:
+            self.poll()
+            next_time = max(next_time + self.period, time.time())
+            time.sleep(next_time - time.time())
+
+    def stop(self):
+        self.running = False
+        self.join()
@@ -0,0 +1,189 @@
+import math
+import os
+import threading
+import time
+import numpy
+
+# AprilTag landmark map
+#
+# The tag positions are read from a text file, one tag per line:
+#
+#   # id  x  y  [heading]
+#   1     0  0
+#   2     1  3   90
+#
+# x, y in meters on the floor, heading in degrees of the tag's x axis from
+# map x (default 0, see localization.py). Blank lines and # comments are
+# skipped, a tag listed twice is an error.
+#
+# The map is kept in numpy arrays sorted by ID, with a uniform grid over
+# the floor as spatial index: near() and visible() only look at the grid
+# cells a query covers, so they stay cheap with hundreds of tags. A
+# LandmarkMap also behaves like the old AT_coords dict (id in map, map[id]
+# -> [x, y]), so it can be handed to anything that took AT_coords.
+#
+# reload() reads the file again and swaps the new map in with a single
+# assignment, readers never see a half loaded map. watch() reloads on its
+# own whenever the file changes.
+#
+#   AT_coords = landmarks.LandmarkMap("AT_map.txt")
+#   AT_coords.watch()
+#   ids, pixels = AT_coords.visible(pose, camera_params, (640, 480))
+
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "AT_map.txt")
+
+
+def read_map(path):
+    # Returns (ids, xy, headings) arrays from a map file
+    ids, xy, headings = [], [], []
+    seen = set()
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if len(fields) not in (3, 4):
+                raise ValueError("{}:{}: expected id x y [heading]".format(path, n))
+            tag_id = int(fields[0])
+            if tag_id in seen:
+                raise ValueError("{}:{}: tag {} listed twice".format(path, n, tag_id))
+            seen.add(tag_id)
+            ids.append(tag_id)
+            xy.append([float(fields[1]), float(fields[2])])
+            headings.append(float(fields[3]) if len(fields) == 4 else 0.)
+    order = numpy.argsort(ids)
+    return (numpy.array(ids, dtype=numpy.int32)[order],
+            numpy.array(xy, dtype=float).reshape(-1, 2)[order],
+            numpy.array(headings, dtype=float)[order])
+
+
+class _Index:
+    '''Immutable map arrays with a uniform grid index over them.'''
+
+    def __init__(self, ids, xy, headings, cell):
+        self.ids = ids
+        self.xy = xy
+        self.headings = headings
+        self.cell = cell
+        self.rows = dict((tag_id, i) for i, tag_id in enumerate(ids.tolist()))
+        # Tags sorted by grid cell, cell -> (start, end) into order
+        cells = numpy.floor(xy / cell).astype(numpy.int64)
+        self.order = numpy.lexsort((cells[:, 1], cells[:, 0]))
+        self.cells = {}
+        for start, i in enumerate(self.order):
+            key = (int(cells[i, 0]), int(cells[i, 1]))
+            if key in self.cells:
+                self.cells[key] = (self.cells[key][0], start + 1)
+            else:
+                self.cells[key] = (start, start + 1)
+
+    def find(self, tag_id):
+        # Row of tag_id, -1 if it isn't in the map
+        return self.rows.get(tag_id, -1)
+
+    def near(self, x, y, radius):
+        # Rows of the tags within radius of (x, y)
+        c0, r0 = int(math.floor((x - radius) / self.cell)), int(math.floor((y - radius) / self.cell))
+        c1, r1 = int(math.floor((x + radius) / self.cell)), int(math.floor((y + radius) / self.cell))
+        if (c1 - c0 + 1) * (r1 - r0 + 1) > len(self.cells):
+            # Query covers more cells than there are tags, check them all
+            rows = numpy.arange(len(self.ids))
+        else:
+            spans = [self.cells[(i, j)] for i in range(c0, c1 + 1) for j in range(r0, r1 + 1)
+                     if (i, j) in self.cells]
+            if not spans:
+                return numpy.zeros(0, dtype=numpy.intp)
+            rows = numpy.concatenate([self.order[start:end] for start, end in spans])
+        d = self.xy[rows] - (x, y)
+        return rows[(d * d).sum(axis=1) <= radius * radius]
+
+
+class LandmarkMap:
+    '''AprilTag map positions loaded from a file, with a spatial index.'''
+
+    def __init__(self, path=MAP_FILE, cell=2.):
+        self.path = path
+        self.cell = cell            # Grid cell size in meters
+        self.version = 0            # Incremented on every (re)load
+        self.mtime = None
+        self.watcher = None
+        self.index = None
+        self.reload()
+
+    def reload(self):
+        # Reads the file again, keeps the old map if the new one is broken
+        mtime = os.path.getmtime(self.path)
+        ids, xy, headings = read_map(self.path)
+        self.index = _Index(ids, xy, headings, self.cell)
+        self.mtime = mtime
+        self.version += 1
+
+    def watch(self, interval=1.):
+        # Reloads the map whenever the file changes, checked every interval s
+        def check():
+            failed = None       # mtime of a broken file, not tried again
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.path.getmtime(self.path)
+                    if mtime != self.mtime and mtime != failed:
+                        failed = mtime
+                        self.reload()
+                        print("Reloaded {} tags from {}".format(len(self), self.path))
+                except (IOError, OSError, ValueError) as e:
+                    print("Landmark map not reloaded: {}".format(e))
+        self.watcher = threading.Thread(target=check)
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    # AT_coords dict behaviour
+    def __contains__(self, tag_id):
+        return self.index.find(tag_id) >= 0
+
+    def __getitem__(self, tag_id):
+        index = self.index
+        i = index.find(tag_id)
+        if i < 0:
+            raise KeyError(tag_id)
+        return [float(index.xy[i, 0]), float(index.xy[i, 1])]
+
+    def __len__(self):
+        return len(self.index.ids)
+
+    def __iter__(self):
+        return iter(self.index.ids.tolist())
+
+    def heading(self, tag_id, default=0.):
+        index = self.index
+        i = index.find(tag_id)
+        return default if i < 0 else float(index.headings[i])
+
+    def near(self, x, y, radius):
+        # IDs of the tags within radius meters of (x, y)
+        index = self.index
+        return index.ids[index.near(x, y, radius)]
+
+    def visible(self, pose, camera_params, image_size, margin=0.):
+        # Tags in view of a downward camera at pose (x, y, altitude, heading),
+        # as (ids, pixels) with the predicted image position of each tag's
+        # center. margin widens the image by that many pixels on every side.
+        # Nothing is predicted on or below the floor (altitude <= 0), where
+        # the projection is undefined; callers take no IDs as unknown.
+        index = self.index
+        x, y, altitude, heading = pose
+        if not altitude > 0:
+            return index.ids[:0], numpy.zeros((0, 2))
+        fx, fy, cx, cy = camera_params
+        width, height = image_size
+        # Floor radius the image covers, from its farthest corner
+        reach = math.hypot(max(cx, width - cx) + margin, max(cy, height - cy) + margin)
+        rows = index.near(x, y, altitude * reach / min(fx, fy))
+        # Map offsets into camera right / back (image x / y) components
+        a = math.radians(heading)
+        d = index.xy[rows] - (x, y)
+        right = d[:, 0] * math.sin(a) - d[:, 1] * math.cos(a)
+        back = -d[:, 0] * math.cos(a) - d[:, 1] * math.sin(a)
+        pixels = numpy.column_stack([cx + fx * right / altitude, cy + fy * back / altitude])
+        inside = (pixels[:, 0] >= -margin) & (pixels[:, 0] <= width + margin) & \
+                 (pixels[:, 1] >= -margin) & (pixels[:, 1] <= height + margin)
+        return index.ids[rows[inside]], pixels[inside]
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import time
+import protocol
+
+# Load test for the drone command server
+#
+# Starts many concurrent clients that each send a stream of telemetry
+# requests and reports throughput and latency. By default it targets the
+# server_test.py stand-in on 127.0.0.1:12002 with one-shot requests, which
+# is also what the stand-in in async_server.py listens on:
+#
+#   python3 ../server_test.py &              (or: python3 async_server.py -q &)
+#   python3 load_test.py --clients 20 --requests 50
+#
+# --mode session/binary open one persistent session per client and keep
+# --window requests in flight on it (async_server.py only).
+
+COMMANDS = ["at", "tof", "curr wp"]
+
+
+async def oneshot_client(host, port, requests, timeout, latencies, errors):
+    for n in range(requests):
+        message = COMMANDS[n % len(COMMANDS)]
+        start = time.time()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            writer.write(message.encode())
+            await writer.drain()
+            await asyncio.wait_for(reader.read(1024), timeout)
+            writer.close()
+            latencies.append(time.time() - start)
+        except (OSError, asyncio.TimeoutError):
+            errors.append(message)
+
+
+async def session_client(host, port, requests, timeout, latencies, errors, binary, window):
+    request = protocol.BINARY_REQUEST if binary else protocol.SESSION_REQUEST
+    accept = protocol.BINARY_ACCEPT if binary else protocol.SESSION_ACCEPT
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(request.encode())
+        if (await asyncio.wait_for(reader.read(1024), timeout)).decode() != accept:
+            raise OSError("session refused")
+    except (OSError, asyncio.TimeoutError):
+        errors.extend(["session"] * requests)
+        return
+
+    sent = {}           # Request ID -> send time
+    slots = asyncio.Semaphore(window)
+
+    async def read_replies():
+        for n in range(requests):
+            header = await reader.readexactly(protocol.FRAME_HEADER.size)
+            length, req_id = protocol.FRAME_HEADER.unpack(header)
+            await reader.readexactly(length)
+            latencies.append(time.time() - sent.pop(req_id))
+            slots.release()
+
+    replies = asyncio.ensure_future(read_replies())
+    for n in range(requests):
+        await slots.acquire()
+        cmd, arg = protocol.parse_request(COMMANDS[n % len(COMMANDS)])
+        if binary:
+            payload = protocol.pack_request(cmd, arg)
+        else:
+            payload = protocol.format_request(cmd, arg).encode()
+        sent[n] = time.time()
+        writer.write(protocol.pack_frame(n, payload))
+        await writer.drain()
+    try:
+        await asyncio.wait_for(replies, timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        errors.extend(["reply"] * len(sent))
+    writer.close()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100. * len(values)))]
+
+
+async def main(args):
+    latencies = []
+    errors = []
+    if args.mode == "oneshot":
+        clients = [oneshot_client(args.host, args.port, args.requests, args.timeout, latencies, errors)
+                   for c in range(args.clients)]
+    else:
+        clients = [session_client(args.host, args.port, args.requests, args.timeout, latencies, errors,
+                                  args.mode == "binary", args.window)
+                   for c in range(args.clients)]
+    start = time.time()
+    await asyncio.gather(*clients)
+    elapsed = time.time() - start
+
+    print("{} clients x {} requests ({})".format(args.clients, args.requests, args.mode))
+    print("completed: {}  errors: {}  time: {:.2f} s  throughput: {:.0f} req/s".format(
+        len(latencies), len(errors), elapsed, len(latencies) / elapsed))
+    if latencies:
+        latencies.sort()
+        print("latency ms  p50: {:.2f}  p95: {:.2f}  p99: {:.2f}  max: {:.2f}".format(
+            1000 * percentile(latencies, 50), 1000 * percentile(latencies, 95),
+            1000 * percentile(latencies, 99), 1000 * latencies[-1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the drone command server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12002)
+    parser.add_argument("--clients", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    parser.add_argument("--mode", choices=["oneshot", "session", "binary"], default="oneshot")
+    parser.add_argument("--window", type=int, default=4, help="requests in flight per session")
+    parser.add_argument("--timeout", type=float, default=5., help="seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,269 @@
+import math
+import numpy
+
+# Localization from AprilTags
+#
+# The camera looks straight down at tags lying flat at known map positions
+# (AT_coords, meters). Two ways to get the drone's (x, y, altitude, heading)
+# in the map:
+#
+# joint (default)  The map position of every corner of every mapped tag in
+#                  view is known, so the camera pose is solved once from all
+#                  of them: a homography from the floor to the image by
+#                  stacked DLT, decomposed into a rotation and translation
+#                  and refined by a few Gauss-Newton steps on the
+#                  reprojection error. No per tag pose estimation.
+# per tag          Pose estimated by the detector for each tag (C
+#                  estimate_tag_pose), inverted to get the camera in the
+#                  tag's frame, moved to the map and averaged, weighted by
+#                  the pose error.
+#
+# Map axes: x, y on the floor, z up, heading in degrees counterclockwise
+# from x. A tag's own x axis points along map x unless AT_headings (or the
+# heading column of a landmarks.LandmarkMap) says otherwise, its top edge
+# faces +y. The drone's front is the top of the camera image.
+#
+# With a LandmarkMap and image_size, per tag pose estimation is limited to
+# the tags the map says are in view from the last fix. Every mapped tag is
+# estimated again when none is predicted in view, or after max_missed
+# frames without a fix, so a drone that left the predicted view (tags
+# found there get no pose, so give no fix) is found again.
+#
+# Given a calibration.Calibration, the joint solve undistorts the corners
+# it uses. Per tag pose estimation works on the frame, which has to be
+# undistorted before detection for that (VisionThread undistort).
+#
+#   localizer = localization.Localizer(AT_coords, (fx, fy, cx, cy), 0.1)
+#   tags = localizer.detect(detector, img)
+#   located = localizer.locate(tags)    # None without a mapped tag
+#
+# localization_benchmark.py compares the two on a recording.
+
+# Corners of a tag as detected (apriltag_detection.p order), in the tag's
+# frame (x right, y down), in units of half the tag size
+TAG_CORNERS = numpy.array([[-1., 1.], [1., 1.], [1., -1.], [-1., -1.]])
+
+
+def _skew(v):
+    # Cross product matrices of an (n, 3) array of vectors
+    m = numpy.zeros(v.shape[:-1] + (3, 3))
+    m[..., 0, 1] = -v[..., 2]
+    m[..., 0, 2] = v[..., 1]
+    m[..., 1, 0] = v[..., 2]
+    m[..., 1, 2] = -v[..., 0]
+    m[..., 2, 0] = -v[..., 1]
+    m[..., 2, 1] = v[..., 0]
+    return m
+
+
+def _rotation(w):
+    # Rotation matrix of a rotation vector (Rodrigues)
+    angle = numpy.linalg.norm(w)
+    if angle < 1e-12:
+        return numpy.eye(3) + _skew(w)
+    k = _skew(w / angle)
+    return numpy.eye(3) + math.sin(angle) * k + (1. - math.cos(angle)) * k.dot(k)
+
+
+def solve_pose(points, corners, camera_params, iterations=5):
+    # Camera pose from floor points and where they are in the image.
+    # points: (n, 2) map x, y (z = 0), corners: (n, 2) pixels, n >= 4.
+    # Returns (R, t) taking map points into the camera frame, p = R P + t.
+    fx, fy, cx, cy = camera_params
+    u = (corners[:, 0] - cx) / fx
+    v = (corners[:, 1] - cy) / fy
+    X, Y = points[:, 0], points[:, 1]
+    n = len(points)
+
+    # DLT: two rows per point of A h = 0, h the floor to image homography
+    A = numpy.zeros((2 * n, 9))
+    A[0::2, 0] = X
+    A[0::2, 1] = Y
+    A[0::2, 2] = 1.
+    A[0::2, 6] = -u * X
+    A[0::2, 7] = -u * Y
+    A[0::2, 8] = -u
+    A[1::2, 3] = X
+    A[1::2, 4] = Y
+    A[1::2, 5] = 1.
+    A[1::2, 6] = -v * X
+    A[1::2, 7] = -v * Y
+    A[1::2, 8] = -v
+    # Least squares h is the eigenvector of A'A with the smallest eigenvalue
+    H = numpy.linalg.eigh(A.T.dot(A))[1][:, 0].reshape(3, 3)
+
+    # H ~ [r1 r2 t], scaled so r1, r2 are unit length and the points are in
+    # front of the camera
+    scale = 2. / (numpy.linalg.norm(H[:, 0]) + numpy.linalg.norm(H[:, 1]))
+    if H[2].dot([X.mean(), Y.mean(), 1.]) < 0:
+        scale = -scale
+    H = H * scale
+    M = numpy.column_stack([H[:, 0], H[:, 1], numpy.cross(H[:, 0], H[:, 1])])
+    U, S, Vt = numpy.linalg.svd(M)
+    R = U.dot(Vt)
+    if numpy.linalg.det(R) < 0:
+        R = U.dot(numpy.diag([1., 1., -1.])).dot(Vt)
+    t = H[:, 2]
+
+    # Gauss-Newton on the reprojection error in normalized image coordinates
+    P = numpy.column_stack([X, Y, numpy.zeros(n)])
+    observed = numpy.column_stack([u, v]).ravel()
+    for i in range(iterations):
+        RP = P.dot(R.T)
+        pc = RP + t
+        z = pc[:, 2]
+        projected = (pc[:, :2] / z[:, None]).ravel()
+        # d(u, v)/d(camera point), (n, 2, 3)
+        D = numpy.zeros((n, 2, 3))
+        D[:, 0, 0] = 1. / z
+        D[:, 1, 1] = 1. / z
+        D[:, :, 2] = -pc[:, :2] / (z * z)[:, None]
+        # Camera point moves by -[RP]x dw for a rotation update dw, by dt
+        # for a translation update
+        J = numpy.concatenate([numpy.matmul(D, -_skew(RP)), D], axis=2).reshape(2 * n, 6)
+        step = numpy.linalg.solve(J.T.dot(J), J.T.dot(observed - projected))
+        R = _rotation(step[:3]).dot(R)
+        t = t + step[3:]
+        if numpy.abs(step).max() < 1e-8:
+            break
+    return R, t
+
+
+class Localizer:
+    '''Drone pose from AprilTag detections and the map of tag positions.'''
+
+    def __init__(self, AT_coords, camera_params, tag_size, AT_headings=None, max_tags=2, joint=True,
+                 image_size=None, calibration=None, max_missed=5):
+        self.AT_coords = AT_coords          # AprilTag ID -> known (x,y) coordinates, dict or LandmarkMap
+        self.AT_headings = AT_headings or {}    # AprilTag ID -> heading of the tag's x axis in degrees
+        self.camera_params = camera_params  # (fx, fy, cx, cy) in pixels
+        self.tag_size = tag_size            # Edge of the tag's black square in meters
+        self.max_tags = max_tags            # Per tag: pose estimated for at most this many tags per frame
+        self.joint = joint                  # Solve one pose from all corners instead of per tag
+        self.image_size = image_size        # (width, height) in pixels, to predict tags in view
+        self.calibration = calibration      # Lens distortion of the corners, None: no correction
+        self.corners = {}                   # AprilTag ID -> map x, y of its corners
+        self.version = None                 # Landmark map version the corners are from
+        self.last = None                    # Last pose found, None once it is too old to predict from
+        self.max_missed = max_missed        # Frames without a fix after which last is dropped
+        self.missed = 0                     # Frames without a fix since the last one
+
+    def detect(self, detector, img):
+        if self.joint:
+            # Corners are all the joint solve needs
+            return detector.detect(img)
+        # Pose estimation only for mapped tags
+        return detector.detect(img, True, self.camera_params, self.tag_size,
+                               pose_ids=self.expected(), max_poses=self.max_tags)
+
+    def expected(self):
+        # IDs of the tags that can be in view: predicted from the last fix
+        # with a landmark map, else every mapped tag
+        if self.last is None or self.image_size is None or not hasattr(self.AT_coords, 'visible'):
+            return self.AT_coords
+        # Half an image of margin for the motion since the last fix
+        ids, pixels = self.AT_coords.visible(self.last, self.camera_params, self.image_size,
+                                             max(self.image_size) / 2.)
+        if not len(ids):
+            # No prediction, say from a bad fix
+            return self.AT_coords
+        return set(ids.tolist())
+
+    def heading(self, tag_id):
+        # Heading of a tag's x axis in degrees
+        if tag_id in self.AT_headings:
+            return self.AT_headings[tag_id]
+        if hasattr(self.AT_coords, 'heading'):
+            return self.AT_coords.heading(tag_id)
+        return 0.
+
+    def locate(self, tags):
+        # Returns (pose, AT_ID, AT_dist, AT_ang) or None if no mapped tag is
+        # usable. pose is the drone's (x, y, altitude, heading), AT_ID the
+        # most reliable tag, AT_dist its distance in meters and AT_ang its
+        # heading relative to the drone in degrees.
+        if self.joint:
+            located = self.locate_joint(tags)
+        else:
+            located = self.locate_per_tag(tags)
+        if located is not None:
+            self.last = located[0]
+            self.missed = 0
+        else:
+            self.missed += 1
+            if self.missed >= self.max_missed:
+                self.last = None
+        return located
+
+    def tag_corners(self, tag_id):
+        # Map x, y of the four corners of a tag, in detection order
+        version = getattr(self.AT_coords, 'version', None)
+        if version != self.version:
+            # The landmark map was reloaded
+            self.corners = {}
+            self.version = version
+        if tag_id not in self.corners:
+            self.corners[tag_id] = self.__tag_corners(tag_id)
+        return self.corners[tag_id]
+
+    def __tag_corners(self, tag_id):
+        heading = math.radians(self.heading(tag_id))
+        c, s = math.cos(heading), math.sin(heading)
+        dx = TAG_CORNERS[:, 0] * self.tag_size / 2.
+        dy = -TAG_CORNERS[:, 1] * self.tag_size / 2.
+        x0, y0 = self.AT_coords[tag_id]
+        return numpy.column_stack([x0 + c * dx - s * dy, y0 + s * dx + c * dy])
+
+    def __result(self, x, y, altitude, heading, tag_id, AT_dist):
+        AT_ang = (self.heading(tag_id) - heading + 180.) % 360. - 180.
+        return (float(x), float(y), float(altitude), float(heading)), tag_id, float(AT_dist), AT_ang
+
+    def locate_joint(self, tags):
+        used = [tag for tag in tags if tag.tag_id in self.AT_coords]
+        if not used:
+            return None
+        points = numpy.concatenate([self.tag_corners(tag.tag_id) for tag in used])
+        corners = numpy.concatenate([tag.corners for tag in used])
+        if self.calibration is not None:
+            corners = self.calibration.undistort_points(corners)
+        R, t = solve_pose(points, corners, self.camera_params)
+        # Camera position in the map, front is the camera's -y axis
+        x, y, altitude = -R.T.dot(t)
+        heading = math.degrees(math.atan2(-R[1, 1], -R[1, 0]))
+        best = max(used, key=lambda tag: tag.decision_margin)
+        x0, y0 = self.AT_coords[best.tag_id]
+        AT_dist = math.sqrt((x - x0) ** 2 + (y - y0) ** 2 + altitude ** 2)
+        return self.__result(x, y, altitude, heading, best.tag_id, AT_dist)
+
+    def tag_pose(self, tag):
+        # Returns the drone's (x, y, altitude, heading) from one detection
+        # with a pose
+        R = tag.pose_R
+        t = tag.pose_t.reshape(3)
+        # Camera position in the tag frame (x right, y down the tag, z into
+        # the floor)
+        p = -R.T.dot(t)
+        # Drone front, the camera's -y axis, in the tag frame
+        front = -R[1]
+        tag_heading = math.radians(self.heading(tag.tag_id))
+        c, s = math.cos(tag_heading), math.sin(tag_heading)
+        dx, dy = p[0], -p[1]
+        x0, y0 = self.AT_coords[tag.tag_id]
+        x = x0 + c * dx - s * dy
+        y = y0 + s * dx + c * dy
+        heading = math.degrees(math.atan2(-front[1], front[0]) + tag_heading)
+        return x, y, -p[2], heading
+
+    def locate_per_tag(self, tags):
+        used = [tag for tag in tags
+                if tag.tag_id in self.AT_coords and tag.pose_err is not None and tag.pose_err == tag.pose_err]
+        if not used:
+            return None
+        poses = numpy.array([self.tag_pose(tag) for tag in used])
+        weights = numpy.array([1. / (tag.pose_err + 1e-6) for tag in used])
+        weights /= weights.sum()
+        x, y, altitude = weights.dot(poses[:, :3])
+        angles = numpy.radians(poses[:, 3])
+        heading = math.degrees(math.atan2(weights.dot(numpy.sin(angles)), weights.dot(numpy.cos(angles))))
+        best = int(numpy.argmax(weights))
+        return self.__result(x, y, altitude, heading, used[best].tag_id, numpy.linalg.norm(used[best].pose_t))
@@ -0,0 +1,99 @@
+import argparse
+import sys
+import time
+import numpy
+import capture
+import Apriltag
+import localization
+
+# Joint vs per tag localization on a recording
+#
+#   python3 localization_benchmark.py frames/ --tags 1:0,0 2:1,3 --tag-size 0.1
+#
+# Every frame is detected twice, once plain for the joint solve and once
+# with C pose estimation of the mapped tags for the per tag solution. The
+# cost of a solution is the time spent on pose work: for per tag the extra
+# detection time pose estimation adds plus averaging, for joint the solve.
+# Also prints how much the two positions move over the recording (standard
+# deviation, a still camera should give 0) and how far apart they are.
+
+
+def parse_tags(tags):
+    # "id:x,y" -> {id: [x, y]}
+    AT_coords = {}
+    for tag in tags:
+        tag_id, xy = tag.split(':')
+        AT_coords[int(tag_id)] = [float(i) for i in xy.split(',')]
+    return AT_coords
+
+
+def report(name, times, poses):
+    times = numpy.array(times) * 1000
+    print("{:8s} pose ms  mean: {:.3f}  p50: {:.3f}  max: {:.3f}   spread x,y,alt: {} m  heading: {:.3f} deg".format(
+        name, times.mean(), numpy.median(times), times.max(),
+        " ".join("{:.4f}".format(s) for s in poses[:, :3].std(axis=0)),
+        poses[:, 3].std()))
+
+
+def main(args):
+    AT_coords = parse_tags(args.tags)
+    camera_params = [float(i) for i in args.camera.split(',')]
+    source = capture.ReplaySource(args.path)
+    detector = Apriltag.Detector(families=args.families,
+                                 quad_decimate=args.decimate,
+                                 searchpath=args.searchpath)
+    joint = localization.Localizer(AT_coords, camera_params, args.tag_size, joint=True)
+    per_tag = localization.Localizer(AT_coords, camera_params, args.tag_size,
+                                     max_tags=len(AT_coords), joint=False)
+
+    joint_times, per_tag_times = [], []
+    joint_poses, per_tag_poses = [], []
+    tag_counts = []
+    while True:
+        img, stamp = source.read_stamped()
+        if img is None:
+            break
+        start = time.time()
+        tags = joint.detect(detector, img)
+        detect_time = time.time() - start
+        start = time.time()
+        located = joint.locate(tags)
+        joint_time = time.time() - start
+
+        start = time.time()
+        tags = per_tag.detect(detector, img)
+        located_per_tag = per_tag.locate(tags)
+        per_tag_time = time.time() - start - detect_time
+
+        if located is None or located_per_tag is None:
+            continue
+        joint_times.append(joint_time)
+        per_tag_times.append(max(per_tag_time, 0.))
+        joint_poses.append(located[0])
+        per_tag_poses.append(located_per_tag[0])
+        tag_counts.append(sum(1 for tag in tags if tag.tag_id in AT_coords))
+    source.release()
+
+    if not joint_poses:
+        print("No frames with mapped tags in " + args.path)
+        return 1
+    joint_poses = numpy.array(joint_poses)
+    per_tag_poses = numpy.array(per_tag_poses)
+    print("{} frames with mapped tags, {:.1f} tags per frame".format(len(joint_poses), numpy.mean(tag_counts)))
+    report("joint", joint_times, joint_poses)
+    report("per tag", per_tag_times, per_tag_poses)
+    diff = numpy.linalg.norm(joint_poses[:, :3] - per_tag_poses[:, :3], axis=1)
+    print("difference  mean: {:.4f} m  max: {:.4f} m".format(diff.mean(), diff.max()))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare joint and per tag AprilTag localization")
+    parser.add_argument("path", help="video file or directory of images")
+    parser.add_argument("--tags", nargs="+", required=True, help="map positions, id:x,y in meters")
+    parser.add_argument("--tag-size", type=float, default=0.1, help="edge of the black square in meters")
+    parser.add_argument("--camera", default="502,502,320,240", help="fx,fy,cx,cy in pixels")
+    parser.add_argument("--families", default="tag36h11")
+    parser.add_argument("--decimate", type=float, default=1.0, help="quad_decimate")
+    parser.add_argument("--searchpath", nargs="+", default=['apriltags/lib', 'apriltags/lib64', 'apriltags'])
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,355 @@
+import math
+import struct
+
+# Wire protocol shared by server_control.py and base_station.py
+#
+# One-shot mode (original): the client connects, sends a single text command,
+# reads at most one reply and the connection is closed.
+#
+# Session mode: the client connects and sends SESSION_REQUEST as a one-shot
+# message. If the server answers SESSION_ACCEPT the socket stays open and every
+# following message in both directions is a frame:
+#
+#       | payload length (uint32) | request ID (uint32) | payload |
+#
+# The server answers every request frame with exactly one frame carrying the
+# same request ID, so several requests can be in flight on one socket.
+#
+# Frame payloads are text commands/replies, or binary messages (see below) if
+# the client asked for a binary session with SESSION_REQUEST + " binary <v>"
+# and the server answered SESSION_ACCEPT + " binary <v>".
+
+SESSION_REQUEST = "session"
+SESSION_ACCEPT = "session ok"
+
+FRAME_HEADER = struct.Struct('!II')
+
+# Frames larger than this are treated as a corrupted stream
+MAX_FRAME_SIZE = 1 << 16
+
+
+def pack_frame(req_id, payload):
+    return FRAME_HEADER.pack(len(payload), req_id) + payload
+
+
+def send_frame(sock, req_id, payload):
+    sock.sendall(pack_frame(req_id, payload))
+
+
+def recv_exact(sock, nbytes):
+    # Returns None if the peer closes the socket before nbytes arrive
+    buf = b''
+    while len(buf) < nbytes:
+        chunk = sock.recv(nbytes - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def recv_frame(sock):
+    # Blocking read of one frame, returns (request ID, payload) or (None, None) on EOF
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None, None
+    length, req_id = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("Frame of {} bytes exceeds limit".format(length))
+    payload = recv_exact(sock, length)
+    if payload is None:
+        return None, None
+    return req_id, payload
+
+
+class FrameReader:
+    '''Reassembles frames from a non-blocking byte stream.'''
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        # Add received bytes and return every complete (request ID, payload)
+        self.buf += data
+        frames = []
+        while len(self.buf) >= FRAME_HEADER.size:
+            length, req_id = FRAME_HEADER.unpack_from(self.buf)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError("Frame of {} bytes exceeds limit".format(length))
+            end = FRAME_HEADER.size + length
+            if len(self.buf) < end:
+                break
+            frames.append((req_id, bytes(self.buf[FRAME_HEADER.size:end])))
+            del self.buf[:end]
+        return frames
+
+
+# Telemetry push
+#
+# Inside a session the client may send "sub <topics> <rate> [change]", e.g.
+# "sub at,tof,wp 10 change". The server then pushes frames with request ID
+# PUSH_ID carrying the same reply the matching poll command ("at", "tof",
+# "curr wp", "det", "pose", "state") would have returned. Text pushes are "<topic>:<reply>", binary
+# pushes are a binary reply whose kind is the topic. Topics are sampled at
+# <rate> Hz; with "change" a topic is only pushed when its value differs
+# from the last one pushed. "unsub" stops the stream.
+
+PUSH_ID = 0xFFFFFFFF
+TOPICS = ("at", "tof", "wp", "det", "pose", "state")
+
+
+# Messages
+#
+# Both encodings carry the same values:
+#   request: (cmd, arg)     cmd is the text command word, arg is None, the
+#                           mode (int), the waypoint [x, y, z, theta],
+#                           (topics, rate, change) for "sub", or the raw text
+#                           for an unrecognized command (cmd "text")
+#   reply:   (kind, value)  kind is "text", "at", "tof", "wp", "det", "pose"
+#                           or "state"
+#       "text": str
+#       "at":   (AT_visible, AT_ID, x, y, AT_dist, AT_ang), AT_ID is None if
+#               no tag with known coordinates is in view
+#       "tof":  (TOF_dist, TOF_status, TOF_age), distance and status lists
+#               and the age of the readings in seconds. A distance is None
+#               for a sensor without a reading, TOF_age is None if unknown
+#               (older servers don't send it)
+#       "wp":   [x, y, z, theta]
+#       "det":  (quad_decimate, nthreads, frame_time, detect_rate), the
+#               detector settings in use, mean detection time in seconds
+#               and fraction of frames with a tag
+#       "pose": (x, y, altitude, heading, age), the drone's position in the
+#               AprilTag map, heading in degrees and the age of the fix in
+#               seconds, all None before the first fix
+#       "state": (x, y, z, heading, u, v, w, r, the standard deviation of
+#               each of those eight, age), the state estimator's drone
+#               state: map position, heading in degrees, body velocity
+#               forward, left and up, yaw rate in deg/s, and the age of the
+#               estimate in seconds. All None before the first fix
+
+# Commands without arguments
+COMMANDS = ("quit", "forward", "backward", "right", "left", "up", "down",
+            "stop", "curr wp", "at", "tof", "unsub", "det", "pose", "state")
+
+
+def _num(x):
+    # Format numbers like the original protocol, 1.0 -> "1", unknown -> "nan"
+    if x is None:
+        return "nan"
+    x = float(x)
+    return str(int(x)) if x.is_integer() else repr(x)
+
+
+def parse_request(message):
+    args = message.split(' ')
+    try:
+        if message in COMMANDS:
+            return message, None
+        elif args[0] == "mode":
+            return "mode", int(args[1])
+        elif args[0] == "wp":
+            return "wp", [float(i) for i in args[1].split(',')]
+        elif args[0] == "sub":
+            return "sub", (args[1].split(','), float(args[2]), "change" in args[3:])
+    except (IndexError, ValueError):
+        pass
+    return "text", message
+
+
+def format_request(cmd, arg):
+    if cmd == "mode":
+        return "mode " + str(arg)
+    elif cmd == "wp":
+        return "wp " + ",".join(_num(i) for i in arg)
+    elif cmd == "sub":
+        topics, rate, change = arg
+        return "sub " + ",".join(topics) + " " + _num(rate) + (" change" if change else "")
+    elif cmd == "text":
+        return arg
+    return cmd
+
+
+def format_reply(kind, value):
+    if kind == "at":
+        AT_visible, AT_ID, x, y, AT_dist, AT_ang = value
+        msg = str(AT_visible)
+        if AT_visible and AT_ID is not None:
+            msg += "," + str(AT_ID) + "," + _num(x) + "," + _num(y) + "," + _num(AT_dist) + "," + _num(AT_ang)
+        return msg
+    elif kind == "tof":
+        TOF_dist, TOF_status, TOF_age = value
+        return ",".join([_num(d) for d in TOF_dist] + [str(s) for s in TOF_status] + [_num(TOF_age)])
+    elif kind == "wp" or kind == "det" or kind == "pose" or kind == "state":
+        return ",".join(_num(i) for i in value)
+    return value
+
+
+def parse_reply(kind, msg):
+    if kind == "at":
+        AT_info = msg.split(',')
+        if AT_info[0] == "True" and len(AT_info) == 6:
+            x, y, AT_dist, AT_ang = [float(i) for i in AT_info[2:]]
+            return (True, int(AT_info[1]), x, y, _opt(AT_dist), _opt(AT_ang))
+        return (AT_info[0] == "True", None, None, None, None, None)
+    elif kind == "tof":
+        TOF_info = msg.split(',')
+        n = len(TOF_info) // 2
+        TOF_age = _opt(float(TOF_info[2*n])) if len(TOF_info) % 2 else None
+        return [_opt(float(i)) for i in TOF_info[:n]], [int(i) for i in TOF_info[n:2*n]], TOF_age
+    elif kind == "wp":
+        return [float(i) for i in msg.split(',')]
+    elif kind == "det":
+        quad_decimate, nthreads, frame_time, detect_rate = [float(i) for i in msg.split(',')]
+        return (quad_decimate, int(nthreads), frame_time, detect_rate)
+    elif kind == "pose" or kind == "state":
+        return tuple(_opt(float(i)) for i in msg.split(','))
+    return msg
+
+
+# Binary encoding
+#
+# Every message starts with a one byte opcode, multi-byte fields are in
+# network order. Requests:
+#   OP_TEXT         utf-8 text command (anything not covered below)
+#   OP_CMD_BASE+n   COMMANDS[n], no payload
+#   OP_MODE         uint8 mode
+#   OP_WP           4 float32 x, y, z, theta
+#   OP_SUB          uint8 topic mask (bit n = TOPICS[n]), float32 rate, uint8 change
+# Replies:
+#   OP_TEXT         utf-8 text
+#   OP_AT           uint8 visible, int16 ID (-1: none), 4 float32 x, y, dist, ang
+#   OP_TOF          uint8 n, n float32 distances, n uint8 statuses, float32 age
+#   OP_WP           4 float32 x, y, z, theta
+#   OP_DET          float32 quad_decimate, uint8 nthreads, float32 frame_time, float32 detect_rate
+#   OP_POSE         5 float32 x, y, altitude, heading, age (NaN: unknown)
+#   OP_STATE        17 float32 state, standard deviations, age (NaN: unknown)
+
+BINARY_VERSION = 2
+BINARY_REQUEST = SESSION_REQUEST + " binary " + str(BINARY_VERSION)
+BINARY_ACCEPT = SESSION_ACCEPT + " binary " + str(BINARY_VERSION)
+
+OP_TEXT = 0
+OP_MODE = 1
+OP_WP = 2
+OP_SUB = 3
+OP_AT = 4
+OP_TOF = 5
+OP_DET = 6
+OP_POSE = 7
+OP_STATE = 8
+OP_CMD_BASE = 16
+
+_OP = struct.Struct('!B')
+_MODE = struct.Struct('!BB')
+_WP = struct.Struct('!B4f')
+_SUB = struct.Struct('!BBfB')
+_AT = struct.Struct('!BBh4f')
+_DET = struct.Struct('!BfBff')
+_POSE = struct.Struct('!B5f')
+_STATE = struct.Struct('!B17f')
+_TOF_HEADER = struct.Struct('!BB')
+_TOF = {}   # Sensor count -> struct of the distances, statuses and age
+
+NAN = float('nan')
+
+
+def _tof_struct(n):
+    if n not in _TOF:
+        _TOF[n] = struct.Struct('!{}f{}Bf'.format(n, n))
+    return _TOF[n]
+
+
+def _float(x):
+    return NAN if x is None else x
+
+
+def _opt(x):
+    return None if math.isnan(x) else x
+
+
+def pack_request(cmd, arg):
+    if cmd in COMMANDS:
+        return _OP.pack(OP_CMD_BASE + COMMANDS.index(cmd))
+    elif cmd == "mode":
+        return _MODE.pack(OP_MODE, arg)
+    elif cmd == "wp":
+        return _WP.pack(OP_WP, *arg)
+    elif cmd == "sub":
+        topics, rate, change = arg
+        mask = 0
+        for t in topics:
+            mask |= 1 << TOPICS.index(t)
+        return _SUB.pack(OP_SUB, mask, rate, change)
+    return _OP.pack(OP_TEXT) + arg.encode()
+
+
+def unpack_request(payload):
+    op = payload[0]
+    if op >= OP_CMD_BASE:
+        return COMMANDS[op - OP_CMD_BASE], None
+    elif op == OP_MODE:
+        return "mode", _MODE.unpack(payload)[1]
+    elif op == OP_WP:
+        return "wp", list(_WP.unpack(payload)[1:])
+    elif op == OP_SUB:
+        _, mask, rate, change = _SUB.unpack(payload)
+        topics = [t for n, t in enumerate(TOPICS) if mask & (1 << n)]
+        return "sub", (topics, rate, bool(change))
+    return parse_request(payload[1:].decode())
+
+
+def pack_reply(kind, value):
+    if kind == "at":
+        AT_visible, AT_ID, x, y, AT_dist, AT_ang = value
+        if AT_ID is None:
+            return _AT.pack(OP_AT, AT_visible, -1, NAN, NAN, NAN, NAN)
+        return _AT.pack(OP_AT, AT_visible, AT_ID, x, y, _float(AT_dist), _float(AT_ang))
+    elif kind == "tof":
+        TOF_dist, TOF_status, TOF_age = value
+        n = len(TOF_dist)
+        return _TOF_HEADER.pack(OP_TOF, n) + _tof_struct(n).pack(*([_float(d) for d in TOF_dist] +
+                                                                    list(TOF_status) + [_float(TOF_age)]))
+    elif kind == "wp":
+        return _WP.pack(OP_WP, *value)
+    elif kind == "det":
+        return _DET.pack(OP_DET, *value)
+    elif kind == "pose":
+        return _POSE.pack(OP_POSE, *[_float(i) for i in value])
+    elif kind == "state":
+        return _STATE.pack(OP_STATE, *[_float(i) for i in value])
+    return _OP.pack(OP_TEXT) + value.encode()
+
+
+def unpack_reply(payload):
+    op = payload[0]
+    if op == OP_AT:
+        _, AT_visible, AT_ID, x, y, AT_dist, AT_ang = _AT.unpack(payload)
+        if AT_ID < 0:
+            return "at", (bool(AT_visible), None, None, None, None, None)
+        return "at", (bool(AT_visible), AT_ID, x, y, _opt(AT_dist), _opt(AT_ang))
+    elif op == OP_TOF:
+        n = payload[1]
+        values = _tof_struct(n).unpack_from(payload, _TOF_HEADER.size)
+        return "tof", ([_opt(d) for d in values[:n]], list(values[n:2*n]), _opt(values[2*n]))
+    elif op == OP_WP:
+        return "wp", list(_WP.unpack(payload)[1:])
+    elif op == OP_DET:
+        return "det", _DET.unpack(payload)[1:]
+    elif op == OP_POSE:
+        return "pose", tuple(_opt(i) for i in _POSE.unpack(payload)[1:])
+    elif op == OP_STATE:
+        return "state", tuple(_opt(i) for i in _STATE.unpack(payload)[1:])
+    return "text", payload[1:].decode()
+
+
+def pack_push(topic, value, binary):
+    if binary:
+        return pack_reply(topic, value)
+    return (topic + ":" + format_reply(topic, value)).encode()
+
+
+def unpack_push(payload, binary):
+    # Returns (topic, value)
+    if binary:
+        return unpack_reply(payload)
+    topic, reply = payload.decode().split(":", 1)
+    return topic, parse_reply(topic, reply)
@@ -164,6 +164,7 @@ RESULT__AMBIENT_COUNT_RATE_MCPS_SD =									0x0090
 VL53L1_RESULT__FINAL_CROSSTALK_CORRECTED_RANGE_MM_SD0 =					0x0096
 VL53L1_RESULT__PEAK_SIGNAL_COUNT_RATE_CROSSTALK_CORRECTED_MCPS_SD0 =	0x0098
 VL53L1_RESULT__OSC_CALIBRATE_VAL =										0x00DE
+VL53L1_RESULT_BLOCK_SIZE =												17		# RESULT__RANGE_STATUS up to the signal rate
 VL53L1_FIRMWARE__SYSTEM_STATUS =										0x00E5
 VL53L1_IDENTIFICATION__MODEL_ID =										0x010F
 VL53L1_ROI_CONFIG__MODE_ROI_CENTRE_SPAD =								0x013E
@@ -488,6 +489,10 @@ class QwiicVL53L1X(object):
 	# Available Addresses:
 	available_addresses = _AVAILABLE_I2C_ADDRESS
 
+	#----------------------------------------------
+	# Raw RESULT__RANGE_STATUS -> ranging status error (see get_range_status())
+	RANGE_STATUS = {9:0, 6:1, 4:2, 8:3, 5:4, 3:5, 19:6, 7:7, 12:9, 18:10, 22:11, 23:12, 13:13}
+
 	#----------------------------------------------
 	# Constructor
 	def __init__(self, address = None, debug = None, i2c_driver = None):
@@ -647,8 +652,7 @@ class QwiicVL53L1X(object):
 		tmp = 0
 		timeout = 0
 
-		for Addr in range(0x2D, 0x87 + 1):
-			self.status = self.__i2cWrite(self.address, Addr, VL51L1X_DEFAULT_CONFIGURATION[Addr - 0x2D], 1)
+		self.status = self.__i2cWriteBlock(self.address, 0x2D, VL51L1X_DEFAULT_CONFIGURATION)
 		
 		self.status = self.start_ranging()
 		while(tmp == 0):
@@ -967,16 +971,7 @@ class QwiicVL53L1X(object):
 
 		:return:	Signal per SPAD (Kilo Count Per Second/SPAD).
 		"""
-		self.status = 0
-		SpNb=1
-
-		signal = self.__i2cRead(self.address,
-			VL53L1_RESULT__PEAK_SIGNAL_COUNT_RATE_CROSSTALK_CORRECTED_MCPS_SD0, 2)
-		SpNb = self.__i2cRead(self.address,
-			VL53L1_RESULT__DSS_ACTUAL_EFFECTIVE_SPADS_SD0, 2)
-		signalRate = (2000.0*signal/SpNb)
-
-		return signalRate
+		return self.get_result()['signal_per_spad']
 
 
 	def get_ambient_per_spad(self):
@@ -985,14 +980,7 @@ class QwiicVL53L1X(object):
 
 		:return:	Ambient per SPAD
 		"""
-		self.status = 0
-		SpNb=1
-
-		AmbientRate = self.__i2cRead(self.address, RESULT__AMBIENT_COUNT_RATE_MCPS_SD, 2)
-		SpNb = self.__i2cRead(self.address, VL53L1_RESULT__DSS_ACTUAL_EFFECTIVE_SPADS_SD0, 2)
-		ambPerSp=(2000.0 * AmbientRate / SpNb)
-		
-		return ambPerSp
+		return self.get_result()['ambient_per_spad']
 
 
 	def get_signal_rate(self):
@@ -1051,28 +1039,47 @@ class QwiicVL53L1X(object):
 		RgSt = self.__i2cRead(self.address, VL53L1_RESULT__RANGE_STATUS, 1)
 		RgSt = RgSt&0x1F
 
-		def get_range_status_switch(var):
-			switcher = {
-				9:0,
-				6:1,
-				4:2,
-				8:3,
-				5:4,
-				3:5,
-				19:6,
-				7:7,
-				12:9,
-				18:10,
-				22:11,
-				23:12,
-				13:13}
-			return switcher.get(var,255)
-		
-		rangeStatus = get_range_status_switch(RgSt)
+		rangeStatus = self.RANGE_STATUS.get(RgSt, 255)
 
 		return rangeStatus
 
 
+	def get_result(self):
+		"""
+		This function reads the whole result block in a single I2C transaction and returns everything a ranging produced
+
+		:return:	Dictionary with
+						* distance- distance in mm
+						* range_status- ranging status error, see get_range_status()
+						* signal_rate- signal in kcps
+						* ambient_rate- ambient rate in kcps
+						* spad_nb- number of enabled SPADs
+						* signal_per_spad- signal per SPAD in kcps/SPAD
+						* ambient_per_spad- ambient per SPAD in kcps/SPAD
+		:rtype:		Dictionary
+		"""
+		self.status = 0
+		Temp = self.__i2cReadBlock(self.address, VL53L1_RESULT__RANGE_STATUS, VL53L1_RESULT_BLOCK_SIZE)
+
+		# Offsets of the registers inside the block
+		def word(register):
+			i = register - VL53L1_RESULT__RANGE_STATUS
+			return (Temp[i] << 8) | Temp[i + 1]
+
+		SpNb = word(VL53L1_RESULT__DSS_ACTUAL_EFFECTIVE_SPADS_SD0)
+		signal = word(VL53L1_RESULT__PEAK_SIGNAL_COUNT_RATE_CROSSTALK_CORRECTED_MCPS_SD0)
+		ambient = word(RESULT__AMBIENT_COUNT_RATE_MCPS_SD)
+
+		return {
+			'distance': word(VL53L1_RESULT__FINAL_CROSSTALK_CORRECTED_RANGE_MM_SD0),
+			'range_status': self.RANGE_STATUS.get(Temp[0] & 0x1F, 255),
+			'signal_rate': signal * 8,
+			'ambient_rate': ambient * 8,
+			'spad_nb': SpNb >> 8,
+			'signal_per_spad': 2000.0 * signal / SpNb if SpNb else 0.0,
+			'ambient_per_spad': 2000.0 * ambient / SpNb if SpNb else 0.0}
+
+
 	def set_offset(self, OffsetValue):
 		"""
 		This function programs the offset correction in mm
@@ -1613,3 +1620,41 @@ class QwiicVL53L1X(object):
 		#	data = ( val << (i*8) ) + data
 
 		return data
+
+
+	# Largest SMBus block write, including the register LSB sent first
+	I2C_BLOCK_MAX = 32
+
+	def __i2cWriteBlock(self, address, register, data):
+		"""
+		Writes a list of bytes to consecutive registers starting at register, in as few I2C transactions as the bus allows.
+
+		:param	register:	16-bit register address of the first byte
+		:param	data:		list of byte values
+
+		:return:	status- (*self*) Indicator for I2C transaction success???
+		:rtype:		Boolean
+		"""
+
+		chunk = self.I2C_BLOCK_MAX - 1
+		for i in range(0, len(data), chunk):
+			start = register + i
+			self.status = self._i2c.writeBlock(address, start >> 8, [start & 0xFF] + list(data[i:i + chunk]))
+
+		return self.status
+
+
+	def __i2cReadBlock(self, address, register, nbytes):
+		"""
+		Reads nbytes consecutive registers starting at register in one I2C transaction.
+
+		:param	register:	16-bit register address of the first byte
+		:param	nbytes:		number of bytes to read
+
+		:return:	data
+		:rtype:		list
+		"""
+
+		read_data = self._i2c.__i2c_rdwr__(address, [register >> 8, register & 0xFF], nbytes)
+
+		return list(read_data)
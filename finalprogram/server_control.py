@@ -1,48 +1,34 @@
-import socket
 from multiprocessing import Process,Pipe
 import time
 import motors as co
 import flightsensor as sensor
 import Apriltag 
-from pupil_apriltags import Detector
 from picamera.array import PiRGBArray
 from picamera import PiCamera
 import cv2
+import vision
+import capture
+import localization
+import landmarks
+import calibration
+import async_server
+import tof_sampler as sampler
+import fusion
+import estimator
+serverIP = '192.168.0.109'
 serverPort = 12002
 
-serverSocket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-serverSocket.bind(('192.168.0.109',serverPort))
-serverSocket.listen(1)
-
-running = True          # Looping variable
-wp = [0,0,1,0]          # Current waypoint
-op_mode = 0             # 0: full auto, 1: waypoint, 2: manual
-AT_visible = True      # True: AprilTag currently in view of camera, False: otherwise
 AT_ID = 1               # ID of last visible AprilTag
 AT_dist = 1           # Last measured distance to AprilTag in meters
 AT_ang = 0             # Last measured angle of AprilTag
-AT_coords = {1:[0,0],\
-             2:[1,3],\
-             4:[2,-1],\
-             5:[-2,1],\
-             3:[1,0],\
-             4:[2,0],\
-             7:[0,1],\
-             6:[-1,-1]}   # Dictionary mapping AprilTag IDs to known (x,y) coordinates
+# AprilTag IDs -> known (x,y) coordinates, from AT_map.txt. Edits to the
+# file are picked up while running.
+AT_coords = landmarks.LandmarkMap(landmarks.MAP_FILE)
+AT_coords.watch()
              
-# Time of flight distances
-# Left, center, right
-TOF_dist = [5.8,1.5,0.1]
-
-# Time of flight status
-# Left, center, right
-# 0: OK
-# 1: Danger
-# 2: Collision imminent
-TOF_status = [0, 1, 2]
 #Apriltag section
 # visualization = True
-at_detector = Detector(searchpath=['apriltags/lib', 'apriltags/lib64'],
+at_detector = Apriltag.Detector(searchpath=['apriltags/lib', 'apriltags/lib64'],
                            families='tag36h11',
                            nthreads=1,
                            quad_decimate=1.0,
@@ -50,94 +36,127 @@ at_detector = Detector(searchpath=['apriltags/lib', 'apriltags/lib64'],
                            refine_edges=1,
                            decode_sharpening=0.25,
                            debug=0)
-cam = cv2.VideoCapture(0)
-cam.set(cv2.CAP_PROP_BUFFERSIZE,1)
-print("The server is ready to receive")
-num=0
+# The tuner moves quad_decimate and nthreads within these bounds to hold
+# DET_TARGET seconds per detection
+DET_TARGET = 0.1
+DET_DECIMATE = (1.0, 3.0)
+DET_THREADS = (1, 4)
+at_tuner = vision.DetectorTuner(at_detector, DET_TARGET,
+                                DET_DECIMATE[0], DET_DECIMATE[1],
+                                DET_THREADS[0], DET_THREADS[1])
+# Frames are grabbed on their own thread, stale ones are dropped
+cam = capture.OpenCVSource(0).start()
+
+# Localization: the drone's position from the poses of the mapped tags in
+# view. Pose estimation runs only for tags in AT_coords, at most
+# LOC_MAX_TAGS of them per frame.
+# Camera intrinsics from calibrate.py, nominal Pi camera v2 values at
+# 640x480 until the camera is calibrated
 try:
-    while running:
-        connectionSocket, addr = serverSocket.accept()
-        message = connectionSocket.recv(1024).decode()
-        print("received message: "+message)
-        ret, img = cam.read()
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        if num==5:
-            num=0
-            tags = at_detector.detect(img)
-            if tags:
-                #AT_ID=int(str(tags[0]))
-                print("ID "+ str(tags[0]))
-        num=num+1
-        # if AT_ang >180 or AT_ang <-180:
-            # AT_ang=0
-        if message == "quit":
-            # Close server (debugging)
-            return_msg = "quitting"
-            co.quitserver()
-            cam.release()
-            cv2.destroyAllWindows()
-            running = False
-        elif message == "forward":
-            co.forward()
-            # Manual command move forward
-            pass
-        elif message == "backward":
-            co.backward()
-            # Manual command move backward
-            pass
-        elif message == "right":
-            #AT_ang=AT_ang+5
-            co.right()
-            # Manual command pivot right
-            pass
-        elif message == "left":
-            #AT_ang=AT_ang-5
-            co.left()
-            # Manual command pivot left
-            pass
-        elif message == "up":
-            #AT_dist=AT_dist+0.1
-            co.top()
-            # Manual command increase altitude
-            pass
-        elif message == "down":
-            #AT_dist=AT_dist-0.1
-            co.bot()
-            # Manual command decrease altitude
-            pass
-        elif message == "stop":
-            co.stopmotor()
-            # Manual command stop motors
-            pass
-        elif message == "curr wp":
-            # Requesting current waypoint
-            return_msg = str(wp[0]) + "," + str(wp[1]) + "," + str(wp[2]) + "," + str(wp[3])
-        elif message.split(' ')[0] == "mode":
-            op_mode = int(message.split(' ')[1])
-            print("new op mode: " + str(op_mode))
-        elif message.split(' ')[0] == "wp":
-            # Waypoint command set new waypoint
-            wp[:] = [int(i) for i in message.split(' ')[1].split(',')]
-        elif message == "at":
-            # Requesting AprilTag data
-            return_msg = str(AT_visible)
-            if AT_visible and (AT_ID in AT_coords):
-                return_msg += "," + str(AT_ID) + "," + str(AT_coords[AT_ID][0]) + "," + str(AT_coords[AT_ID][1]) + "," + str(AT_dist) + "," + str(AT_ang)
-        elif message == "tof":
-            TOF_dist=sensor.measurement()
-            # Requesting time of flight data
-            return_msg = ""
-            for n in range(3):
-                return_msg = return_msg + str(TOF_dist[n]) + ","
-            for n in range(3):
-                return_msg = return_msg + str(TOF_status[n]) + ","
-            return_msg = return_msg[:-1]
-        else:
-            print("Not recognized")
-            return_msg = "Not recognized"
-        connectionSocket.send(return_msg.encode())
-        connectionSocket.close()
-    print ("running = {}".format(running))
-    serverSocket.close()
-except:
-    serverSocket.close()
+    camera_cal = calibration.load()
+    CAMERA_PARAMS = camera_cal.camera_params()
+    IMAGE_SIZE = camera_cal.image_size
+except (IOError, OSError):
+    camera_cal = None
+    CAMERA_PARAMS = (502., 502., 320., 240.)   # fx, fy, cx, cy in pixels
+    IMAGE_SIZE = (640, 480)                     # width, height in pixels
+TAG_SIZE = 0.1          # Edge of the tags' black square in meters
+LOC_MAX_TAGS = 2
+localizer = localization.Localizer(AT_coords, CAMERA_PARAMS, TAG_SIZE, max_tags=LOC_MAX_TAGS,
+                                   image_size=IMAGE_SIZE, calibration=camera_cal)
+
+# Camera capture and AprilTag detection run in the background, commands only
+# read the latest published tag state
+tag_state = vision.TagState(AT_ID, AT_dist, AT_ang)
+# The joint solve only undistorts tag corners, per tag pose estimation
+# needs whole frames undistorted
+undistort = camera_cal.undistort if camera_cal is not None and not localizer.joint else None
+vision_thread = vision.VisionThread(cam, at_tuner, tag_state, localizer=localizer, undistort=undistort)
+vision_thread.start()
+
+# The ToF sensors are swept continuously in the background, commands only
+# read the newest sweep. Distances in mm.
+TOF_RATE = 20           # Sweeps per second
+TOF_DANGER = 500        # Closer than this: danger
+TOF_COLLISION = 200     # Closer than this: collision imminent
+tof_sampler = sampler.TofSampler(sensor.measurement, TOF_RATE,
+                                 danger=TOF_DANGER, collision=TOF_COLLISION)
+tof_sampler.start()
+
+# Range readings are merged into a polar obstacle grid around the drone for
+# the navigator, see fusion.py. Mounting bearings of the flightsensor
+# sensors in sweep order (left, center, right), degrees left of straight
+# ahead.
+TOF_BEARINGS = sampler.TOF_BEARINGS
+obstacles = fusion.ObstacleGrid([fusion.RangeSensor(b, **fusion.VL53L1X) for b in TOF_BEARINGS])
+fusion_thread = fusion.FusionThread(obstacles, [(lambda: tof_sampler.latest()[::2], range(len(TOF_BEARINGS)))],
+                                    TOF_RATE)
+fusion_thread.start()
+
+# The drone's state is estimated at a fixed rate from the motor commands,
+# localization fixes and ToF ranges, see estimator.py
+EKF_RATE = 100          # Steps per second
+ekf = estimator.StateEstimator([fusion.RangeSensor(b, **fusion.VL53L1X) for b in TOF_BEARINGS])
+ekf_thread = estimator.EstimatorThread(ekf, tag_state.get_pose,
+                                       [(lambda: tof_sampler.latest()[::2], range(len(TOF_BEARINGS)))],
+                                       EKF_RATE)
+ekf_thread.start()
+
+class DroneHardware:
+    '''Hardware used by async_server, only ever called from its HardwareActor.'''
+
+    def forward(self):
+        co.forward()
+        ekf.command("forward")
+
+    def backward(self):
+        co.backward()
+        ekf.command("backward")
+
+    def right(self):
+        co.right()
+        ekf.command("right")
+
+    def left(self):
+        co.left()
+        ekf.command("left")
+
+    def up(self):
+        co.top()
+        ekf.command("up")
+
+    def down(self):
+        co.bot()
+        ekf.command("down")
+
+    def stop(self):
+        co.stopmotor()
+        ekf.command("stop")
+
+    def quit(self):
+        co.quitserver()
+        vision_thread.stop()
+        ekf_thread.stop()
+        fusion_thread.stop()
+        tof_sampler.stop()
+        sensor.stop_ranging()
+        cam.release()
+        cv2.destroyAllWindows()
+
+    def tof(self):
+        return tof_sampler.latest()
+
+    def tag(self):
+        return tag_state.get()
+
+    def detector(self):
+        return at_tuner.settings()
+
+    def pose(self):
+        return tag_state.get_pose()
+
+    def state(self):
+        return ekf.latest()
+
+# Serves any number of base stations and loggers at once until "quit"
+async_server.run(DroneHardware(), serverIP, serverPort, AT_coords)
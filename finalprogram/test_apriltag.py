@@ -0,0 +1,74 @@
+import math
+import os
+import numpy
+import pytest
+
+pytest.importorskip("cv2")
+import Apriltag
+
+# python3 -m pytest test_apriltag.py
+#
+# Needs OpenCV and the compiled apriltag library in apriltags/lib (see apriltags/
+# install.sh) or in the directory named by APRILTAG_LIB, skipped otherwise.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEARCHPATH = [os.environ.get('APRILTAG_LIB', ''), os.path.join(HERE, 'apriltags/lib'),
+              os.path.join(HERE, 'apriltags/lib64')]
+
+# First codes of tag36h11, as in apriltags/apriltag_gen.py
+TAG36H11 = (0xd5d628584, 0xd97f18b49, 0xdd280910e)
+
+
+def tag_image(code, scale=8):
+    # Black square with the data bits and a white border, scale px per cell
+    d = numpy.frombuffer(numpy.array(code, ">i8"), numpy.uint8)
+    bits = numpy.unpackbits(d)[-36:].reshape((6, 6))
+    bits = numpy.pad(numpy.pad(bits, 1, 'constant', constant_values=0), 2, 'constant', constant_values=1)
+    return numpy.kron(bits, numpy.ones((scale, scale), numpy.uint8)) * 255
+
+
+def frame(tags, shape=(480, 640)):
+    # tags: (tag ID, (row, col)) of each tag's top left corner
+    img = numpy.full(shape, 255, numpy.uint8)
+    for tag_id, (row, col) in tags:
+        t = tag_image(TAG36H11[tag_id])
+        img[row:row + t.shape[0], col:col + t.shape[1]] = t
+    return img
+
+
+@pytest.fixture
+def detector():
+    try:
+        return Apriltag.Detector(families='tag36h11', quad_decimate=1.0, searchpath=SEARCHPATH)
+    except OSError:
+        pytest.skip("apriltag library not available")
+
+
+def test_track_matches_detect(detector):
+    first = frame([(1, (100, 200))])
+    assert len(detector.track(first)) == 1
+
+    # Shifted tag, found within the region around the last detection
+    shifted = frame([(1, (107, 205))])
+    tracked = detector.track(shifted)
+    assert detector._since_scan == 1
+    row0, row1, col0, col1 = detector._roi
+    assert (row1 - row0) * (col1 - col0) < shifted.size / 4
+
+    full = detector.detect(shifted)
+    assert len(tracked) == len(full) == 1
+    assert tracked.tag_id[0] == full[0].tag_id == 1
+    # Detection in the smaller image is not bit for bit the same, the
+    # corners agree to a small fraction of a pixel
+    assert numpy.abs(tracked.corners[0] - full[0].corners).max() < 0.05
+    assert numpy.abs(tracked.center[0] - full[0].center).max() < 0.05
+
+
+def test_track_rescans_when_tag_missed(detector):
+    detector.track(frame([(1, (100, 200))]))
+    # Tag moved far outside the tracked region: full scan finds it
+    moved = frame([(1, (350, 500))])
+    tracked = detector.track(moved)
+    assert len(tracked) == 1
+    assert detector._since_scan == 0
+    assert math.hypot(*(tracked.center[0] - detector.detect(moved)[0].center)) < 0.05
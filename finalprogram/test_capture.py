@@ -0,0 +1,85 @@
+import queue
+import time
+import numpy
+import pytest
+
+pytest.importorskip("cv2")
+import capture
+
+# python3 -m pytest test_capture.py
+
+
+class QueueSource(capture.FrameSource):
+    '''Frames put by the test, None ends the source.'''
+
+    def __init__(self, buffer_size=3):
+        capture.FrameSource.__init__(self, buffer_size)
+        self.frames = queue.Queue()
+        self.buf = numpy.zeros((4, 6), numpy.uint8)    # Reused like a camera buffer
+
+    def put(self, n):
+        self.frames.put(n)
+
+    def grab(self):
+        n = self.frames.get()
+        if n is None:
+            return None, None
+        self.buf[:] = n
+        return self.buf, float(n)
+
+
+def wait_for(condition, timeout=2.):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_newest_frame_wins():
+    src = QueueSource().start()
+    for n in (1, 2, 3):
+        src.put(n)
+    wait_for(lambda: len(src.pending) == 3)
+    frame, stamp = src.read_stamped()
+    assert stamp == 3. and frame.max() == 3
+    assert src.dropped == 2
+    src.put(None)
+    assert src.read_stamped() == (None, None)
+    src.release()
+
+
+def test_slots_reused():
+    src = QueueSource().start()
+    buffers = set()
+    for n in range(1, 21):
+        src.put(n)
+        frame, stamp = src.read_stamped()
+        assert stamp == n and (frame == n).all()
+        # Frames are copies, not the grabber's buffer
+        assert frame is not src.buf
+        buffers.add(id(frame))
+    # The frame handed out and the one being filled
+    assert len(buffers) <= 2
+    assert src.dropped == 0
+    src.put(None)
+    src.release()
+
+
+def test_consumer_behind():
+    src = QueueSource(buffer_size=3).start()
+    for n in range(1, 6):
+        src.put(n)
+    wait_for(lambda: src.frames.empty() and src.dropped == 2)
+    assert len(src.pending) == 3
+    frame, stamp = src.read_stamped()
+    assert stamp == 5.
+    assert src.dropped == 4
+    src.put(None)
+    src.release()
+
+
+def test_read_without_thread():
+    src = QueueSource()
+    src.put(7)
+    ret, frame = src.read()
+    assert ret and frame is src.buf
@@ -0,0 +1,92 @@
+import numpy
+import fusion
+import tof_sampler
+
+# python3 -m pytest test_fusion.py
+
+
+def test_sweep_bearings():
+    # A flightsensor sweep is left, center, right
+    grid = fusion.ObstacleGrid([fusion.RangeSensor(b, **fusion.VL53L1X) for b in tof_sampler.TOF_BEARINGS])
+    grid.add_sweep(range(3), [600, 1500, None], stamp=10.)
+    assert abs(grid.nearest(90, now=10.) - 600) <= grid.resolution
+    assert abs(grid.nearest(0, now=10.) - 1500) <= grid.resolution
+    assert grid.nearest(-90, now=10.) is None
+    bearing, dist = grid.closest(now=10.)
+    assert abs(bearing - 90) <= fusion.VL53L1X['fov'] / 2. and abs(dist - 600) <= grid.resolution
+
+
+def narrow_grid(**kwargs):
+    # One sensor straight ahead covering a single bin
+    sensor = fusion.RangeSensor(0, fov=5, min_range=40, max_range=4000, sigma=20)
+    return fusion.ObstacleGrid([sensor], **kwargs)
+
+
+def test_log_odds_update():
+    grid = narrow_grid()
+    grid.add(0, 1000, stamp=1.)
+    row = grid.logodds[grid.index(0)]
+    centers = grid.centers
+    hit = numpy.abs(centers - 1000) <= 25
+    free = (centers < 1000 - 20) & ~hit
+    assert numpy.allclose(row[hit], fusion.L_OCC)
+    assert numpy.allclose(row[free], fusion.L_FREE)
+    assert numpy.all(row[~hit & ~free] == 0)
+    # Only the bin in view changed
+    assert numpy.count_nonzero(grid.logodds) == numpy.count_nonzero(row)
+    assert grid.nearest(0, now=1.) == 1000
+
+
+def test_log_odds_clamped():
+    grid = narrow_grid(tau=1e9)
+    for i in range(20):
+        grid.add(0, 1000, stamp=1. + i * 1e-3)
+    row = grid.logodds[grid.index(0)]
+    assert row.max() == fusion.L_MAX
+    assert row.min() == -fusion.L_MAX
+
+
+def test_decay_and_age():
+    grid = narrow_grid(tau=1., max_age=0.5)
+    grid.add(0, 1000, stamp=1.)
+    before = grid.logodds[grid.index(0)].copy()
+    # Free space reading a tau later: the old evidence is down to 1/e
+    grid.add(0, None, stamp=2.)
+    grid.add(0, 5000, stamp=2.)
+    after = grid.logodds[grid.index(0)]
+    hit = numpy.abs(grid.centers - 1000) <= 25
+    assert numpy.allclose(after[hit], before[hit] * numpy.exp(-1.) + fusion.L_FREE)
+    # Nothing occupied any more
+    assert grid.nearest(0, now=2.) == numpy.inf
+    # Bin not updated for longer than max_age is unknown
+    assert grid.nearest(0, now=2.6) is None
+    assert grid.nearest(90, now=2.) is None
+
+
+def test_out_of_range_readings():
+    grid = narrow_grid()
+    grid.add(0, 10, stamp=1.)       # Below min_range, ignored
+    grid.add(0, None, stamp=1.)
+    grid.add(0, float('nan'), stamp=1.)
+    assert not grid.logodds.any()
+
+
+def test_rotate():
+    grid = narrow_grid(tau=1e9, max_age=1e9)
+    grid.add(0, 1000, stamp=1.)
+    # Drone turns 90 degrees left, the obstacle is now on its right
+    grid.rotate(90)
+    assert grid.nearest(-90, now=1.) == 1000
+    assert grid.nearest(0, now=1.) is None
+    # Turns smaller than a bin add up
+    for i in range(10):
+        grid.rotate(-9)
+    assert grid.nearest(0, now=1.) == 1000
+
+
+def test_closest():
+    grid = fusion.ObstacleGrid([fusion.RangeSensor(b, fov=5, min_range=40, max_range=4000, sigma=20)
+                                for b in (90, 0, -90)])
+    assert grid.closest(now=1.) == (None, None)
+    grid.add_sweep(range(3), [1500, 3000, 800], stamp=1.)
+    assert grid.closest(now=1.) == (-90, 800)
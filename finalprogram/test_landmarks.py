@@ -0,0 +1,101 @@
+import os
+import numpy
+import pytest
+import landmarks
+
+# python3 -m pytest test_landmarks.py
+
+MAP = """# id  x  y  [heading]
+1  0  0
+2  1  3   90
+3  1  0   # comment
+7  10 10
+5  -2 1
+"""
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def map_file(tmp_path):
+    path = str(tmp_path / "map.txt")
+    write(path, MAP)
+    return path
+
+
+def test_lookup(map_file):
+    AT_coords = landmarks.LandmarkMap(map_file, cell=2.)
+    assert len(AT_coords) == 5
+    assert list(AT_coords) == [1, 2, 3, 5, 7]
+    assert 2 in AT_coords and 4 not in AT_coords
+    assert AT_coords[2] == [1., 3.]
+    assert AT_coords.heading(2) == 90.
+    assert AT_coords.heading(1) == 0.
+    assert AT_coords.heading(4, default=None) is None
+    with pytest.raises(KeyError):
+        AT_coords[4]
+
+
+def test_near_matches_brute_force(map_file):
+    AT_coords = landmarks.LandmarkMap(map_file, cell=2.)
+    ids, xy, headings = landmarks.read_map(map_file)
+    for x, y, radius in [(0, 0, 1.5), (1, 1, 2.5), (9, 9, 2), (-3, 5, 1), (0, 0, 100)]:
+        expected = ids[numpy.hypot(xy[:, 0] - x, xy[:, 1] - y) <= radius]
+        assert sorted(AT_coords.near(x, y, radius).tolist()) == sorted(expected.tolist())
+
+
+def test_visible(map_file):
+    AT_coords = landmarks.LandmarkMap(map_file)
+    camera_params = (500., 500., 320., 240.)
+    # 1 m above tag 1 facing +x: tag 3 is 1 m ahead, 500 px above the center
+    ids, pixels = AT_coords.visible((0., 0., 1., 0.), camera_params, (640, 480))
+    assert ids.tolist() == [1]
+    assert numpy.allclose(pixels[0], [320, 240])
+    ids, pixels = AT_coords.visible((0., 0., 1., 0.), camera_params, (640, 480), margin=300)
+    found = dict(zip(ids.tolist(), pixels.tolist()))
+    assert sorted(found) == [1, 3]
+    assert numpy.allclose(found[3], [320, -260])
+    # Higher up tag 3 comes into view, tag 5 (behind and to the left) is
+    # still below the image
+    ids, pixels = AT_coords.visible((0., 0., 4., 0.), camera_params, (640, 480))
+    found = dict(zip(ids.tolist(), pixels.tolist()))
+    assert sorted(found) == [1, 3]
+    assert numpy.allclose(found[3], [320, 115])
+    # Turned left by 90 degrees, tag 3 is on the right of the image
+    ids, pixels = AT_coords.visible((0., 0., 4., 90.), camera_params, (640, 480))
+    found = dict(zip(ids.tolist(), pixels.tolist()))
+    assert numpy.allclose(found[3], [445, 240])
+
+
+def test_visible_on_the_floor(map_file):
+    AT_coords = landmarks.LandmarkMap(map_file)
+    camera_params = (500., 500., 320., 240.)
+    for altitude in (0., -0.5, float('nan')):
+        ids, pixels = AT_coords.visible((0., 0., altitude, 0.), camera_params, (640, 480), margin=300)
+        assert len(ids) == 0 and pixels.shape == (0, 2)
+
+
+def test_reload(map_file):
+    AT_coords = landmarks.LandmarkMap(map_file)
+    version = AT_coords.version
+    write(map_file, MAP + "9 4 4\n")
+    AT_coords.reload()
+    assert AT_coords.version == version + 1
+    assert AT_coords[9] == [4., 4.]
+    assert list(AT_coords.near(4, 4, 0.5)) == [9]
+
+
+def test_broken_file_keeps_map(map_file):
+    AT_coords = landmarks.LandmarkMap(map_file)
+    version = AT_coords.version
+    write(map_file, MAP + "1 5 5\n")
+    with pytest.raises(ValueError):
+        AT_coords.reload()
+    write(map_file, "1 2\n")
+    with pytest.raises(ValueError):
+        AT_coords.reload()
+    assert AT_coords.version == version
+    assert AT_coords[1] == [0., 0.]
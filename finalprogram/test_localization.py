@@ -0,0 +1,64 @@
+import numpy
+import pytest
+import landmarks
+import localization
+
+# python3 -m pytest test_localization.py
+
+MAP = """# id  x  y
+1  0  0
+3  1  0
+7  10 10
+"""
+
+CAMERA_PARAMS = (500., 500., 320., 240.)
+
+
+class Tag:
+    '''Detection as the detector returns it, pose_err NaN without a pose.'''
+
+    def __init__(self, tag_id, altitude=None):
+        self.tag_id = tag_id
+        self.pose_err = float('nan')
+        if altitude is not None:
+            # Straight above the tag facing map x: camera x is the tag's y,
+            # camera y the tag's -x
+            self.pose_R = numpy.array([[0., 1., 0.], [-1., 0., 0.], [0., 0., 1.]])
+            self.pose_t = numpy.array([[0.], [0.], [altitude]])
+            self.pose_err = 1e-6
+
+
+@pytest.fixture
+def localizer(tmp_path):
+    path = str(tmp_path / "map.txt")
+    with open(path, 'w') as f:
+        f.write(MAP)
+    return localization.Localizer(landmarks.LandmarkMap(path), CAMERA_PARAMS, 0.1, joint=False,
+                                  image_size=(640, 480), max_missed=3)
+
+
+def test_fix_limits_expected(localizer):
+    assert set(localizer.expected()) == {1, 3, 7}
+    pose, AT_ID, AT_dist, AT_ang = localizer.locate([Tag(1, 1.)])
+    assert pose == pytest.approx((0., 0., 1., 0.))
+    assert localizer.expected() == {1, 3}
+
+
+def test_recovers_outside_prediction(localizer):
+    localizer.locate([Tag(1, 1.)])
+    # Flown over to tag 7: seen, but outside the prediction it gets no pose
+    for frame in range(localizer.max_missed - 1):
+        assert localizer.locate([Tag(7)]) is None
+        assert 7 not in localizer.expected()
+    assert localizer.locate([Tag(7)]) is None
+    assert 7 in localizer.expected()
+    pose = localizer.locate([Tag(7, 1.)])[0]
+    assert pose[:2] == pytest.approx((10., 10.))
+    assert localizer.expected() == {7}
+
+
+def test_empty_prediction(localizer):
+    # A fix away from every tag, or on the floor, predicts nothing in view
+    for last in ((20., 20., 1., 0.), (0., 0., 0., 0.)):
+        localizer.last = last
+        assert set(localizer.expected()) == {1, 3, 7}
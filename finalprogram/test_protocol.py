@@ -0,0 +1,75 @@
+import pytest
+import protocol
+
+# python3 -m pytest test_protocol.py
+
+REPLIES = [
+    ("text", "ok"),
+    ("at", (True, 3, 1.5, -2.0, 1.25, 32.5)),
+    ("at", (False, None, None, None, None, None)),
+    ("tof", ([5.5, None, 0.25], [0, 1, 2], 0.125)),
+    ("tof", ([5.5, 1.5, 0.25], [0, 1, 2], None)),
+    ("wp", [1.0, 2.5, 1.0, 90.0]),
+    ("det", (1.5, 2, 0.0625, 0.5)),
+    ("pose", (1.0, 3.0, 1.25, 32.0, 0.5)),
+    ("pose", (None,) * 5),
+    ("state", tuple(float(i) / 4 for i in range(16)) + (0.5,)),
+    ("state", (None,) * 17),
+]
+
+REQUESTS = [
+    ("quit", None), ("forward", None), ("curr wp", None), ("tof", None), ("state", None),
+    ("mode", 2),
+    ("wp", [1.0, 2.5, 1.0, 90.0]),
+    ("sub", (["at", "tof", "state"], 10.0, True)),
+    ("sub", (["wp"], 2.5, False)),
+]
+
+
+@pytest.mark.parametrize("kind, value", REPLIES)
+def test_binary_reply(kind, value):
+    # Values are chosen to be exact in float32
+    assert protocol.unpack_reply(protocol.pack_reply(kind, value)) == (kind, value)
+
+
+@pytest.mark.parametrize("kind, value", [r for r in REPLIES if r[0] != "text"])
+def test_text_reply(kind, value):
+    assert protocol.parse_reply(kind, protocol.format_reply(kind, value)) == value
+
+
+@pytest.mark.parametrize("cmd, arg", REQUESTS)
+def test_requests(cmd, arg):
+    assert protocol.unpack_request(protocol.pack_request(cmd, arg)) == (cmd, arg)
+    assert protocol.parse_request(protocol.format_request(cmd, arg)) == (cmd, arg)
+
+
+def test_unknown_request():
+    assert protocol.parse_request("hover") == ("text", "hover")
+    assert protocol.unpack_request(protocol.pack_request("text", "hover")) == ("text", "hover")
+    # Malformed arguments are passed on as text
+    assert protocol.parse_request("wp 1,x") == ("text", "wp 1,x")
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_push(binary):
+    value = (True, 3, 1.5, -2.0, 1.25, 32.5)
+    assert protocol.unpack_push(protocol.pack_push("at", value, binary), binary) == ("at", value)
+
+
+def test_frame_reader_split_and_joined():
+    frames = [(1, b"at"), (2, b""), (protocol.PUSH_ID, b"x" * 300)]
+    data = b"".join(protocol.pack_frame(req_id, payload) for req_id, payload in frames)
+    # Byte by byte
+    reader = protocol.FrameReader()
+    got = []
+    for i in range(len(data)):
+        got += reader.feed(data[i:i + 1])
+    assert got == frames
+    # All at once
+    assert protocol.FrameReader().feed(data) == frames
+
+
+def test_frame_reader_oversized():
+    header = protocol.FRAME_HEADER.pack(protocol.MAX_FRAME_SIZE + 1, 1)
+    with pytest.raises(ValueError):
+        protocol.FrameReader().feed(header)
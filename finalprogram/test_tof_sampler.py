@@ -0,0 +1,76 @@
+import time
+import tof_sampler
+
+# python3 -m pytest test_tof_sampler.py
+
+
+def make_sampler():
+    return tof_sampler.TofSampler(None, danger=500., collision=200., ttc=0.5, speed_window=0.25)
+
+
+def test_status_levels():
+    sampler = make_sampler()
+    sampler.add([1000, 400, 150, None], 1.0)
+    TOF_dist, TOF_status, stamps = sampler.latest()
+    assert TOF_dist == [1000, 400, 150, None]
+    assert TOF_status == [0, 1, 2, 0]
+    assert stamps == [1.0, 1.0, 1.0, None]
+
+
+def test_closing_speed():
+    sampler = make_sampler()
+    # 2000 mm to 1000 mm in 0.3 s: contact in 0.3 s, under ttc
+    sampler.add([2000, 2000], 1.0)
+    sampler.add([1000, 1900], 1.3)
+    TOF_dist, TOF_status, stamps = sampler.latest()
+    assert TOF_status == [2, 0]
+
+
+def test_closing_speed_needs_window():
+    sampler = make_sampler()
+    # Readings closer together than speed_window give no speed
+    sampler.add([2000], 1.0)
+    sampler.add([1000], 1.1)
+    assert sampler.latest()[1] == [0]
+
+
+def test_missing_result_keeps_reading():
+    sampler = make_sampler()
+    sampler.add([1000, 400], 1.0)
+    sampler.add([None, 350], 1.05)
+    TOF_dist, TOF_status, stamps = sampler.latest()
+    assert TOF_dist == [1000, 350]
+    assert TOF_status == [0, 1]
+    # The old reading keeps its own stamp
+    assert stamps == [1.0, 1.05]
+    assert sampler.readings(0) == [(1.0, 1000)]
+    assert sampler.readings(1) == [(1.0, 400), (1.05, 350)]
+    assert sampler.readings(5) == []
+
+
+def test_latest_is_a_copy():
+    sampler = make_sampler()
+    sampler.add([1000], 1.0)
+    sampler.latest()[0][0] = 0
+    assert sampler.latest()[0] == [1000]
+
+
+def test_history_size():
+    sampler = tof_sampler.TofSampler(None, history=4)
+    for i in range(10):
+        sampler.add([1000 + i], float(i))
+    assert [d for t, d in sampler.readings(0)] == [1006, 1007, 1008, 1009]
+
+
+def test_stamp_after_sweep():
+    # A sweep blocking on the bus is stamped when its readings are known
+    def measure():
+        time.sleep(0.05)
+        sampler.running = False
+        return [1000, 1000, 1000]
+    sampler = tof_sampler.TofSampler(measure)
+    start = time.time()
+    sampler.start()
+    sampler.join(1.)
+    stamps = sampler.latest()[2]
+    assert stamps[0] >= start + 0.05
@@ -0,0 +1,132 @@
+import json
+import os
+import time
+import RPi.GPIO as GPIO
+import qwiic_vl53l1x as qwiic
+
+# VL53L1X sensor array bring-up
+#
+# All VL53L1X start at the same I2C address, so each one is held in reset
+# with its XSHUT pin and released alone to be moved to its own address.
+# Instead of fixed sleeps every step polls the bus: after pulling XSHUT low
+# we wait until the default address stops answering, after raising it until
+# boot_state() reports the sensor booted.
+#
+# The addresses the sensors end up on are saved to a small JSON file. The
+# sensors keep their address as long as they are powered, so when the drone
+# process restarts every sensor found at its saved address is used as is,
+# and only the missing ones go through XSHUT sequencing again. Such a sensor
+# also still holds its ranging configuration, which sensor_init() loads as
+# a default block of 135 registers followed by a blocking test measurement,
+# so that is skipped too. A valid timing budget tells the configuration is
+# there: right after power-up the register reads as none of the budgets.
+#
+#   array = tof_array.SensorArray([(23, 0x2B), (20, 0x2D)])
+#   tofs = array.bring_up()       # QwiicVL53L1X objects in pin order
+
+DEFAULT_ADDRESS = qwiic.QwiicVL53L1X.available_addresses[0]
+SENSOR_ID = 0xEEAC
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tof_addresses.json")
+
+
+class SensorArray:
+    '''Brings up VL53L1X sensors on their own I2C addresses.'''
+
+    def __init__(self, addresses, map_file=MAP_FILE, timeout=0.5):
+        # addresses: (XSHUT pin, wanted I2C address) of every sensor, in order
+        self.pins = [pin for pin, address in addresses]
+        self.addresses = dict(addresses)    # XSHUT pin -> wanted I2C address
+        self.map_file = map_file
+        self.timeout = timeout              # Seconds to wait for a sensor to reset or boot
+        self.warm = []                      # Pins found already configured by bring_up()
+
+    def load_map(self):
+        # Returns the saved XSHUT pin -> I2C address map, empty if there is none
+        try:
+            with open(self.map_file) as f:
+                return dict((int(pin), address) for pin, address in json.load(f).items())
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_map(self, current):
+        with open(self.map_file, 'w') as f:
+            json.dump(dict((str(pin), address) for pin, address in current.items()), f)
+
+    def present(self, tof):
+        # True if a booted VL53L1X answers at tof.address
+        try:
+            return tof.get_sensor_id() == SENSOR_ID and tof.boot_state() != 0
+        except (IOError, OSError):
+            return False
+
+    def configured(self, tof):
+        # True if sensor_init() already ran on tof since it powered up
+        try:
+            return tof.get_timing_budget_in_ms() != 0
+        except (IOError, OSError):
+            return False
+
+    def wait(self, condition):
+        deadline = time.time() + self.timeout
+        while not condition():
+            if time.time() > deadline:
+                return False
+            time.sleep(.001)
+        return True
+
+    def bring_up(self):
+        # Returns one initialized QwiicVL53L1X per pin, raises IOError if a
+        # sensor does not come up
+        saved = self.load_map()
+        tofs = {}
+        current = {}
+
+        # Leave sensors that are already powered up running
+        for pin in self.pins:
+            GPIO.setup(pin, GPIO.OUT, initial=GPIO.HIGH)
+
+        # Warm restart: sensors still on the address we gave them last time
+        for pin in self.pins:
+            if pin in saved and saved[pin] != DEFAULT_ADDRESS:
+                tof = qwiic.QwiicVL53L1X(saved[pin])
+                if self.present(tof):
+                    tofs[pin] = tof
+                    current[pin] = saved[pin]
+        self.warm = list(tofs)
+
+        cold = [pin for pin in self.pins if pin not in tofs]
+        if cold:
+            # Hold the rest in reset until nothing answers on the default address
+            for pin in cold:
+                GPIO.output(pin, GPIO.LOW)
+            default = qwiic.QwiicVL53L1X(DEFAULT_ADDRESS)
+            if not self.wait(lambda: not self.present(default)):
+                raise IOError("VL53L1X still answering at 0x{:02X} with XSHUT low".format(DEFAULT_ADDRESS))
+
+            # Release them one at a time and move each to its address
+            for pin in cold:
+                GPIO.output(pin, GPIO.HIGH)
+                tof = qwiic.QwiicVL53L1X(DEFAULT_ADDRESS)
+                if not self.wait(lambda: self.present(tof)):
+                    raise IOError("VL53L1X on XSHUT {} did not boot".format(pin))
+                tof.set_i2c_address(self.addresses[pin])
+                tofs[pin] = tof
+                current[pin] = self.addresses[pin]
+                # Saved right away so a crash further on doesn't lose track of it
+                self.save_map(current)
+
+        # Warm sensors whose wanted address changed just move, no reset needed
+        for pin in self.warm:
+            if current[pin] != self.addresses[pin]:
+                tofs[pin].set_i2c_address(self.addresses[pin])
+                current[pin] = self.addresses[pin]
+
+        for pin in self.pins:
+            if pin in self.warm and self.configured(tofs[pin]):
+                # Left as sensor_init() leaves it, ranging stopped
+                tofs[pin].stop_ranging()
+                continue
+            if tofs[pin].sensor_init():
+                raise IOError("VL53L1X on XSHUT {} failed to initialize".format(pin))
+        self.save_map(current)
+        return [tofs[pin] for pin in self.pins]
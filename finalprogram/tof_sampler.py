@@ -0,0 +1,116 @@
+import collections
+import threading
+import time
+
+# Background time of flight sampling
+#
+# Runs the ToF sweep (flightsensor.measurement) continuously at a fixed rate
+# on its own thread. Every reading is kept with its timestamp in a small ring
+# buffer per sensor, and the newest reading of each sensor with its danger
+# level and timestamp is published as one tuple. Readers never wait on the
+# I2C bus: latest() only reads that tuple, which is replaced in a single
+# assignment, so no lock is needed.
+#
+# measure() returns None for a sensor without a new result. Such a sensor
+# keeps its last reading, status and timestamp, so a reader can tell an old
+# reading from a new one by its timestamp.
+#
+# TOF_status per sensor:
+# 0: OK
+# 1: Danger               closer than danger
+# 2: Collision imminent   closer than collision, or closing in so fast the
+#                         distance is covered within ttc seconds
+# A sensor that never had a reading (None) is reported as 0.
+
+# Mounting bearings of the sensors in flightsensor.measurement() order:
+# left, center, right, like TOF_dist on the base station. Degrees left of
+# straight ahead.
+TOF_BEARINGS = [90, 0, -90]
+
+
+class TofSampler(threading.Thread):
+    '''Samples the ToF sensors at a fixed rate and keeps recent readings.'''
+
+    def __init__(self, measure, rate=20., history=16, danger=500., collision=200.,
+                 ttc=0.5, speed_window=0.25):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.measure = measure              # Returns one distance per sensor, None if unknown
+        self.period = 1. / rate             # Seconds between sweeps
+        self.history_size = history         # Readings kept per sensor
+        self.danger = danger                # Distances in the unit measure() returns (mm)
+        self.collision = collision
+        self.ttc = ttc                      # Time to contact in seconds that counts as imminent
+        self.speed_window = speed_window    # Closing speed is taken over about this many seconds
+        self.history = []                   # Per sensor deque of (stamp, distance), oldest first
+        self.errors = 0                     # Failed sweeps
+        self.running = True
+        # (TOF_dist, TOF_status, stamps), newest reading of each sensor
+        self.newest = ([], [], [])
+
+    def run(self):
+        next_time = time.time()
+        while self.running:
+            try:
+                distances = list(self.measure())
+            except (IOError, OSError):
+                # Bus error, try again next period
+                self.errors += 1
+            else:
+                # A sweep waits on every sensor in turn, so the readings are
+                # only known once it returns; stamping before would age them
+                # by the whole sweep
+                self.add(distances, time.time())
+            next_time = max(next_time + self.period, time.time())
+            time.sleep(max(next_time - time.time(), 0.))
+
+    def add(self, distances, stamp):
+        while len(self.history) < len(distances):
+            self.history.append(collections.deque(maxlen=self.history_size))
+        TOF_dist, TOF_status, stamps = [list(i) for i in self.newest]
+        for i, dist in enumerate(distances):
+            if i >= len(TOF_dist):
+                TOF_dist.append(None)
+                TOF_status.append(0)
+                stamps.append(None)
+            if dist is None:
+                # No new result, the last reading stands
+                continue
+            readings = self.history[i]
+            TOF_dist[i] = dist
+            TOF_status[i] = self.status(readings, dist, stamp)
+            stamps[i] = stamp
+            readings.append((stamp, dist))
+        self.newest = (TOF_dist, TOF_status, stamps)
+
+    def status(self, readings, dist, stamp):
+        if dist is None:
+            return 0
+        if dist < self.collision:
+            return 2
+        # Closing speed against the newest reading at least speed_window old
+        for then, old in reversed(readings):
+            if stamp - then >= self.speed_window:
+                if old is not None and old > dist and \
+                        dist / ((old - dist) / (stamp - then)) < self.ttc:
+                    return 2
+                break
+        if dist < self.danger:
+            return 1
+        return 0
+
+    def latest(self):
+        # Returns (TOF_dist, TOF_status, stamps) with the time of each
+        # sensor's reading, None for a sensor that never had one
+        TOF_dist, TOF_status, stamps = self.newest
+        return list(TOF_dist), list(TOF_status), list(stamps)
+
+    def readings(self, sensor):
+        # Returns the buffered (stamp, distance) of one sensor, oldest first
+        if sensor >= len(self.history):
+            return []
+        return list(self.history[sensor])
+
+    def stop(self):
+        self.running = False
+        self.join()
@@ -0,0 +1,164 @@
+import collections
+import threading
+import time
+
+# Background vision pipeline
+#
+# Grabs frames and runs AprilTag detection continuously on its own thread and
+# publishes the latest result, so command handling never waits on the camera
+# or the detector. cv2 and the detector's C code release the GIL, so the
+# request loop keeps running while a frame is being processed.
+
+
+class TagState:
+    '''Latest AprilTag observation, shared between threads.'''
+
+    def __init__(self, AT_ID=None, AT_dist=None, AT_ang=None):
+        self.lock = threading.Lock()
+        self.AT_visible = False     # True: AprilTag in view in the latest frame
+        self.AT_ID = AT_ID          # ID of last visible AprilTag
+        self.AT_dist = AT_dist      # Last measured distance to AprilTag in meters
+        self.AT_ang = AT_ang        # Last measured angle of AprilTag
+        self.stamp = None           # time.time() of the frame the tags came from
+        self.frames = 0             # Number of frames processed
+        self.pose = None            # Last drone (x, y, altitude, heading) from localization
+        self.pose_stamp = None      # time.time() of the frame pose came from
+
+    def update(self, tags, stamp, located=None):
+        # located: Localizer.locate() result for the frame, if localizing
+        with self.lock:
+            self.AT_visible = len(tags) > 0
+            if located is not None:
+                self.pose, self.AT_ID, self.AT_dist, self.AT_ang = located
+                self.pose_stamp = stamp
+            elif tags:
+                self.AT_ID = tags[0].tag_id
+            self.stamp = stamp
+            self.frames += 1
+
+    def get(self):
+        # Returns (AT_visible, AT_ID, AT_dist, AT_ang, stamp)
+        with self.lock:
+            return self.AT_visible, self.AT_ID, self.AT_dist, self.AT_ang, self.stamp
+
+    def get_pose(self):
+        # Returns ((x, y, altitude, heading), stamp), (None, None) before
+        # the first fix
+        with self.lock:
+            return self.pose, self.pose_stamp
+
+
+class DetectorTuner:
+    '''Wraps a detector and adjusts quad_decimate and nthreads at runtime to
+hold a target detection time per frame.'''
+
+    # Works with Apriltag.Detector and pupil_apriltags.Detector, both expose
+    # the C detector struct as tag_detector_ptr. Every window frames the mean
+    # detection time is compared with target_time:
+    #   too slow: add a thread, once at max_threads raise quad_decimate
+    #   headroom: lower quad_decimate (finds smaller/farther tags), once at
+    #             min_decimate give threads back
+    # Missing tags in most frames while there is headroom also lowers
+    # quad_decimate.
+
+    def __init__(self, detector, target_time=0.1, min_decimate=1.0, max_decimate=3.0,
+                 min_threads=1, max_threads=4, window=30, step=0.5):
+        self.detector = detector
+        self.target_time = target_time      # Seconds per detection to aim for
+        self.min_decimate = min_decimate
+        self.max_decimate = max_decimate
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.step = step                    # quad_decimate change per adjustment
+        self.times = collections.deque(maxlen=window)
+        self.found = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.frame_time = 0.                # Mean detection time of the last window
+        self.detect_rate = 0.               # Fraction of frames with a tag in the last window
+        c = detector.tag_detector_ptr.contents
+        self.set(min(max(c.quad_decimate, min_decimate), max_decimate),
+                 min(max(c.nthreads, min_threads), max_threads))
+
+    def set(self, quad_decimate, nthreads):
+        with self.lock:
+            self.quad_decimate = quad_decimate
+            self.nthreads = nthreads
+        c = self.detector.tag_detector_ptr.contents
+        c.quad_decimate = quad_decimate
+        c.nthreads = nthreads
+
+    def settings(self):
+        # Returns (quad_decimate, nthreads, frame_time, detect_rate)
+        with self.lock:
+            return self.quad_decimate, self.nthreads, self.frame_time, self.detect_rate
+
+    def detect(self, img, *args, **kwargs):
+        start = time.time()
+        tags = self.detector.detect(img, *args, **kwargs)
+        self.times.append(time.time() - start)
+        self.found.append(len(tags) > 0)
+        if len(self.times) == self.times.maxlen:
+            self.adjust()
+        return tags
+
+    def adjust(self):
+        frame_time = sum(self.times) / len(self.times)
+        detect_rate = sum(self.found) / float(len(self.found))
+        with self.lock:
+            self.frame_time = frame_time
+            self.detect_rate = detect_rate
+        quad_decimate, nthreads = self.quad_decimate, self.nthreads
+        if frame_time > self.target_time:
+            if nthreads < self.max_threads:
+                nthreads += 1
+            else:
+                quad_decimate = min(quad_decimate + self.step, self.max_decimate)
+        elif frame_time < 0.6 * self.target_time or \
+                (detect_rate < 0.5 and frame_time < 0.8 * self.target_time):
+            if quad_decimate > self.min_decimate:
+                quad_decimate = max(quad_decimate - self.step, self.min_decimate)
+            elif nthreads > self.min_threads and frame_time < 0.4 * self.target_time:
+                nthreads -= 1
+        if (quad_decimate, nthreads) != (self.quad_decimate, self.nthreads):
+            self.set(quad_decimate, nthreads)
+            # Start a fresh window with the new settings
+            self.times.clear()
+            self.found.clear()
+
+
+class VisionThread(threading.Thread):
+    '''Continuously reads cam and runs detector on every frame.'''
+
+    def __init__(self, cam, detector, state, period=0., localizer=None, undistort=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cam = cam              # capture.FrameSource
+        self.detector = detector
+        self.state = state
+        self.period = period        # Minimum time between frames in seconds, 0: as fast as possible
+        self.localizer = localizer  # localization.Localizer, None: tag IDs only
+        self.undistort = undistort  # Applied to every frame before detection, e.g. Calibration.undistort
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.time()
+            img, stamp = self.cam.read_stamped()
+            if img is None:
+                # Source ended (end of a recording)
+                break
+            if self.undistort is not None:
+                img = self.undistort(img)
+            if self.localizer is not None:
+                tags = self.localizer.detect(self.detector, img)
+                self.state.update(tags, stamp, self.localizer.locate(tags))
+            else:
+                tags = self.detector.detect(img)
+                self.state.update(tags, stamp)
+            wait = self.period - (time.time() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+    def stop(self):
+        self.running = False
+        self.join()
@@ -0,0 +1,107 @@
+import argparse
+import sys
+import time
+import capture
+import vision
+import Apriltag
+
+# Runs the vision stack on a recording, without camera or drone
+#
+#   python3 vision_replay.py frames/ --log run.csv
+#   python3 vision_replay.py flight.avi --track --compare run.csv
+#
+# Frames go from a ReplaySource through the same VisionThread/TagState path
+# the drone uses, as fast as the detector allows (or at the recorded rate
+# with --realtime). Prints throughput and detection latency. --log writes
+# the tag IDs found in every frame, --compare checks a run against such a
+# log and exits with 1 if any frame differs.
+
+
+class Recorder:
+    '''Detector wrapper timing every call and keeping the tag IDs found.'''
+
+    def __init__(self, detector, track):
+        self.detector = detector
+        self.track = track
+        self.times = []
+        self.ids = []
+
+    def detect(self, img):
+        start = time.time()
+        if self.track:
+            tags = self.detector.track(img)
+        else:
+            tags = self.detector.detect_batch(img)
+        self.times.append(time.time() - start)
+        self.ids.append(sorted(int(i) for i in tags.tag_id))
+        return tags
+
+
+def read_log(path):
+    with open(path) as f:
+        return [[int(i) for i in line.split(',')[2].split()] for line in f if not line.startswith('#')]
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100. * len(values)))]
+
+
+def main(args):
+    source = capture.ReplaySource(args.path, realtime=args.realtime)
+    detector = Apriltag.Detector(families=args.families,
+                                 nthreads=args.nthreads,
+                                 quad_decimate=args.decimate,
+                                 searchpath=args.searchpath)
+    recorder = Recorder(detector, args.track)
+    state = vision.TagState()
+    # Live playback may drop frames like a camera would, a full speed run
+    # reads every frame in turn
+    if args.realtime:
+        source.start()
+    thread = vision.VisionThread(source, recorder, state)
+    start = time.time()
+    thread.start()
+    thread.join()
+    elapsed = time.time() - start
+    source.release()
+
+    frames = len(recorder.times)
+    if not frames:
+        print("No frames in " + args.path)
+        return 1
+    times = sorted(recorder.times)
+    print("{} frames in {:.2f} s, {:.1f} fps, {} dropped, tags in {} frames".format(
+        frames, elapsed, frames / elapsed, source.dropped, sum(1 for i in recorder.ids if i)))
+    print("detect ms  mean: {:.2f}  p50: {:.2f}  p95: {:.2f}  max: {:.2f}".format(
+        1000 * sum(times) / frames, 1000 * percentile(times, 50),
+        1000 * percentile(times, 95), 1000 * times[-1]))
+
+    if args.log:
+        with open(args.log, 'w') as f:
+            f.write("# frame,detect ms,tag IDs\n")
+            for n, (t, ids) in enumerate(zip(recorder.times, recorder.ids)):
+                f.write("{},{:.3f},{}\n".format(n, 1000 * t, " ".join(str(i) for i in ids)))
+
+    if args.compare:
+        expected = read_log(args.compare)
+        diff = [n for n in range(max(len(expected), frames))
+                if n >= len(expected) or n >= frames or expected[n] != recorder.ids[n]]
+        if diff:
+            print("{} frames differ from {}, first: {}".format(len(diff), args.compare, diff[:10]))
+            return 1
+        print("matches " + args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recording through AprilTag detection")
+    parser.add_argument("path", help="video file or directory of images")
+    parser.add_argument("--families", default="tag36h11")
+    parser.add_argument("--nthreads", type=int, default=1)
+    parser.add_argument("--decimate", type=float, default=2.0, help="quad_decimate")
+    parser.add_argument("--track", action="store_true", help="use ROI tracking")
+    parser.add_argument("--realtime", action="store_true", help="replay at the recorded frame rate")
+    parser.add_argument("--searchpath", nargs="+", default=['apriltags/lib', 'apriltags/lib64', 'apriltags'])
+    parser.add_argument("--log", help="write tag IDs per frame to this file")
+    parser.add_argument("--compare", help="compare tag IDs per frame with this log")
+    sys.exit(main(parser.parse_args()))
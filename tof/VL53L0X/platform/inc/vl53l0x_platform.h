@@ -100,6 +100,21 @@ typedef VL53L0X_Dev_t* VL53L0X_DEV;
  */
 void VL53L0X_init(VL53L0X_DEV Dev);
 
+/**
+ * Set the I2C read and write callbacks
+ * @param   read_func   Called as read_func(address, reg, data, length)
+ * @param   write_func  Called as write_func(address, reg, data, length)
+ * @return  None
+ */
+void VL53L0X_set_i2c(void *read_func, void *write_func);
+
+/**
+ * Do I2C natively through /dev/i2c-<bus> instead of the callbacks
+ * @param   bus       I2C bus number
+ * @return  0 on success, -1 if the bus can't be opened
+ */
+int VL53L0X_use_native_i2c(int bus);
+
 /**
  * @defgroup VL53L0X_registerAccess_group PAL Register Access Functions
  * @brief    PAL Register Access Functions
@@ -27,6 +27,11 @@ SOFTWARE.
 #include <time.h>
 #include <unistd.h>
 #include <pthread.h>
+#include <string.h>
+#include <fcntl.h>
+#include <sys/ioctl.h>
+#include <linux/i2c.h>
+#include <linux/i2c-dev.h>
 #include "vl53l0x_platform.h"
 #include "vl53l0x_api.h"
 
@@ -50,6 +55,70 @@ void VL53L0X_set_i2c(void *read_func, void *write_func)
     i2c_write_func = write_func;
 }
 
+// Native I2C: the library talks to /dev/i2c-N itself with I2C_RDWR ioctls,
+// so register accesses never go through Python callbacks
+static int i2c_fd = -1;
+
+static int native_i2c_read(uint8_t address, uint8_t reg,
+                    uint8_t *list, uint8_t length)
+{
+    struct i2c_msg msgs[2];
+    struct i2c_rdwr_ioctl_data rdwr;
+
+    // Register write and data read in one transaction (repeated start)
+    msgs[0].addr = address;
+    msgs[0].flags = 0;
+    msgs[0].len = 1;
+    msgs[0].buf = &reg;
+    msgs[1].addr = address;
+    msgs[1].flags = I2C_M_RD;
+    msgs[1].len = length;
+    msgs[1].buf = list;
+    rdwr.msgs = msgs;
+    rdwr.nmsgs = 2;
+
+    return ioctl(i2c_fd, I2C_RDWR, &rdwr) < 0 ? -1 : 0;
+}
+
+static int native_i2c_write(uint8_t address, uint8_t reg,
+                    uint8_t *list, uint8_t length)
+{
+    uint8_t buf[256];
+    struct i2c_msg msg;
+    struct i2c_rdwr_ioctl_data rdwr;
+
+    buf[0] = reg;
+    if (length > 0)
+    {
+        memcpy(buf + 1, list, length);
+    }
+    msg.addr = address;
+    msg.flags = 0;
+    msg.len = length + 1;
+    msg.buf = buf;
+    rdwr.msgs = &msg;
+    rdwr.nmsgs = 1;
+
+    return ioctl(i2c_fd, I2C_RDWR, &rdwr) < 0 ? -1 : 0;
+}
+
+int VL53L0X_use_native_i2c(int bus)
+{
+    char path[32];
+
+    if (i2c_fd < 0)
+    {
+        snprintf(path, sizeof(path), "/dev/i2c-%d", bus);
+        i2c_fd = open(path, O_RDWR);
+        if (i2c_fd < 0)
+        {
+            return -1;
+        }
+    }
+    VL53L0X_set_i2c(native_i2c_read, native_i2c_write);
+    return 0;
+}
+
 static int i2c_write(VL53L0X_DEV Dev, uint8_t cmd,
                     uint8_t *data, uint8_t len)
 {
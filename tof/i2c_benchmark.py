@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+import argparse
+import time
+import VL53L0X
+
+# Per-reading latency of the VL53L0X with Python smbus callbacks vs native
+# /dev/i2c access from the C library
+#
+#   make -C VL53L0X             (rebuild the library on the Pi first)
+#   python3 i2c_benchmark.py --readings 200
+#
+# Needs a single sensor on the bus at the default address, startRanging()
+# only re-addresses sensors that are still at the default address.
+#
+# Measures the time of get_distance() in high speed mode, which includes
+# polling for data ready, reading the result and clearing the interrupt.
+# The sensor ranges at the same rate with both backends, so the difference
+# is the I2C overhead per reading.
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100. * len(values)))]
+
+
+def bench(tof, readings):
+    times = []
+    tof.get_distance()      # First reading waits for ranging to start
+    for n in range(readings):
+        start = time.time()
+        tof.get_distance()
+        times.append(time.time() - start)
+    times.sort()
+    return times
+
+
+def report(name, times):
+    print("{:8s} mean: {:.2f}  p50: {:.2f}  p95: {:.2f}  max: {:.2f} ms".format(
+        name, 1000 * sum(times) / len(times), 1000 * percentile(times, 50),
+        1000 * percentile(times, 95), 1000 * times[-1]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare VL53L0X I2C backends")
+    parser.add_argument("--bus", type=int, default=1)
+    parser.add_argument("--readings", type=int, default=100)
+    args = parser.parse_args()
+
+    tof = VL53L0X.VL53L0X()
+    results = []
+    for name in ["python", "native"]:
+        if name == "native":
+            VL53L0X.use_native_i2c(args.bus)
+        else:
+            VL53L0X.use_python_i2c()
+        tof.start_ranging(VL53L0X.VL53L0X_HIGH_SPEED_MODE)
+        results.append((name, bench(tof, args.readings)))
+        tof.stop_ranging()
+
+    print("get_distance() latency over {} readings".format(args.readings))
+    for name, times in results:
+        report(name, times)
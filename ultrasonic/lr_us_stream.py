@@ -0,0 +1,139 @@
+import asyncio
+import collections
+import os
+import select
+import threading
+import time
+
+# Streaming parser for the long range ultrasonic serial output
+#
+# The MaxBotix sensor sends a range as "R" followed by the digits and a
+# carriage return, e.g. b"R1234\r", several times a second at 9600 baud.
+# Instead of reading the port one byte at a time, whatever is available is
+# read in one go and fed to RangeParser, a small state machine that picks
+# the frames out of the stream. Garbage and broken frames (a reset mid
+# frame, a lost byte) are skipped up to the next "R". Every range is
+# stamped with the time the read containing its "\r" returned.
+#
+# From a thread, filling a buffer the rest of the code reads from:
+#
+#   ser = serial.Serial("/dev/ttyS0", 9600)
+#   reader = lr_us_stream.RangeReader(ser)
+#   reader.start()
+#   dist, stamp = reader.latest()
+#
+# From asyncio:
+#
+#   transport, protocol = await lr_us_stream.connect(loop, ser, callback)
+#
+# callback(range, stamp) is called for every frame in both cases. Anything
+# with fileno() works as the port, a pty for tests included.
+
+MAX_DIGITS = 4      # 4 digits in mm, 3 in inches on the older models
+READ_SIZE = 256
+
+
+class RangeParser:
+	'''State machine extracting R####\\r frames from a byte stream.'''
+
+	def __init__(self, callback=None, max_digits=MAX_DIGITS):
+		self.callback = callback    # callback(range, stamp) for every frame
+		self.max_digits = max_digits
+		self.digits = None          # Digits of the frame being read, None outside a frame
+		self.frames = 0
+		self.errors = 0             # Broken frames and stray bytes skipped
+
+	def feed(self, data, stamp=None):
+		# Parses a chunk of bytes, returns the (range, stamp) of the frames
+		# completed in it
+		if stamp is None:
+			stamp = time.time()
+		found = []
+		for byte in bytearray(data):
+			if byte == 0x52:        # 'R'
+				if self.digits:
+					self.errors += 1
+				self.digits = bytearray()
+			elif self.digits is None:
+				self.errors += 1
+			elif 0x30 <= byte <= 0x39 and len(self.digits) < self.max_digits:
+				self.digits.append(byte)
+			elif byte == 0x0D and self.digits:     # '\r'
+				found.append((int(self.digits), stamp))
+				self.digits = None
+			else:
+				self.errors += 1
+				self.digits = None
+		self.frames += len(found)
+		if self.callback is not None:
+			for frame in found:
+				self.callback(*frame)
+		return found
+
+
+class RangeProtocol(asyncio.Protocol):
+	'''asyncio protocol feeding received bytes to a RangeParser.'''
+
+	def __init__(self, callback=None):
+		self.parser = RangeParser(callback)
+		self.closed = asyncio.get_event_loop().create_future()
+
+	def data_received(self, data):
+		self.parser.feed(data)
+
+	def connection_lost(self, exc):
+		if not self.closed.done():
+			self.closed.set_result(exc)
+
+
+def connect(loop, port, callback=None):
+	# Reads port on the event loop, returns (transport, protocol)
+	return loop.connect_read_pipe(lambda: RangeProtocol(callback), port)
+
+
+class RangeReader(threading.Thread):
+	'''Reads ranges from a port on its own thread and keeps recent ones.'''
+
+	def __init__(self, port, callback=None, history=16):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.port = port
+		self.fd = port.fileno()
+		self.callback = callback
+		self.parser = RangeParser(self.__add)
+		self.history = collections.deque(maxlen=history)   # (stamp, range), oldest first
+		self.newest = (None, None)  # (range, stamp), replaced in a single assignment
+		self.running = True
+
+	def __add(self, dist, stamp):
+		self.history.append((stamp, dist))
+		self.newest = (dist, stamp)
+		if self.callback is not None:
+			self.callback(dist, stamp)
+
+	def run(self):
+		while self.running:
+			# Wait for data without spinning, with a timeout to notice stop()
+			ready, _, _ = select.select([self.fd], [], [], 0.1)
+			if not ready:
+				continue
+			try:
+				data = os.read(self.fd, READ_SIZE)
+			except OSError:
+				# Port went away (pty closed, USB adapter unplugged)
+				break
+			if not data:
+				break
+			self.parser.feed(data)
+		self.running = False
+
+	def latest(self):
+		# Returns (range, stamp) of the newest frame, (None, None) before the first
+		return self.newest
+
+	def readings(self):
+		return list(self.history)
+
+	def stop(self):
+		self.running = False
+		self.join()
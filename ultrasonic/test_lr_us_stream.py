@@ -0,0 +1,75 @@
+import os
+import time
+import tty
+import lr_us_stream
+
+# python3 -m pytest test_lr_us_stream.py
+
+
+def test_frames():
+	parser = lr_us_stream.RangeParser()
+	assert parser.feed(b"R1234\rR0500\r", 1.) == [(1234, 1.), (500, 1.)]
+	assert parser.frames == 2 and parser.errors == 0
+
+
+def test_split_frames():
+	got = []
+	parser = lr_us_stream.RangeParser(lambda dist, stamp: got.append((dist, stamp)))
+	stream = b"R1234\rR0567\rR0089\r"
+	# One byte at a time, a frame is stamped with the chunk holding its '\r'
+	for n, byte in enumerate(stream):
+		parser.feed(bytes([byte]), float(n))
+	assert got == [(1234, 5.), (567, 11.), (89, 17.)]
+	# Uneven chunks across frame boundaries
+	assert parser.feed(b"R12", 20.) == []
+	assert parser.feed(b"34\rR5", 21.) == [(1234, 21.)]
+	assert parser.feed(b"67\r", 22.) == [(567, 22.)]
+	assert parser.errors == 0
+
+
+def test_garbage_skipped():
+	parser = lr_us_stream.RangeParser()
+	# Stray bytes before the first 'R', say after a sensor reset
+	assert parser.feed(b"\x00\xffxyR1234\r", 1.) == [(1234, 1.)]
+	assert parser.errors == 4
+	# Anything but a digit breaks the frame up to the next 'R'
+	assert parser.feed(b"R12\n34\rR0100\r", 2.) == [(100, 2.)]
+	assert parser.errors == 8
+
+
+def test_broken_frames():
+	parser = lr_us_stream.RangeParser()
+	# A new 'R' mid frame, a lost '\r'
+	assert [dist for dist, stamp in parser.feed(b"R12R0034\r")] == [34]
+	assert parser.errors == 1
+	# Too many digits, no digits
+	assert parser.feed(b"R12345\rR\r") == []
+	assert parser.errors == 4
+	assert parser.frames == 1
+
+
+def test_max_digits():
+	parser = lr_us_stream.RangeParser(max_digits=3)
+	assert [dist for dist, stamp in parser.feed(b"R255\rR1234\r")] == [255]
+	assert parser.errors == 2
+
+
+def test_reader_from_pty():
+	master, slave = os.openpty()
+	# Raw like a serial port, or the tty turns '\r' into '\n'
+	tty.setraw(slave)
+	port = os.fdopen(slave, 'rb', buffering=0)
+	reader = lr_us_stream.RangeReader(port)
+	reader.start()
+	try:
+		os.write(master, b"junkR0150\rR02")
+		os.write(master, b"00\r")
+		deadline = time.time() + 2.
+		while reader.parser.frames < 2 and time.time() < deadline:
+			time.sleep(0.01)
+		assert [dist for stamp, dist in reader.readings()] == [150, 200]
+		assert reader.latest()[0] == 200
+	finally:
+		reader.stop()
+		port.close()
+		os.close(master)
@@ -0,0 +1,81 @@
+import time
+import pytest
+import us_ranging
+
+# python3 -m pytest test_us_ranging.py
+
+
+def make_array(sensors, slot=0.01, **kwargs):
+	# sensors: (trigger pin, echo pin, scale)
+	gpio = us_ranging.SimulatedGPIO()
+	for trig, echo, scale in sensors:
+		gpio.link(trig, echo, scale)
+	return gpio, us_ranging.UltrasonicArray(gpio, sensors, slot=slot, **kwargs)
+
+
+def test_sweep_ranges():
+	gpio, us = make_array([(27, 17, us_ranging.SR_SCALE), (22, 10, us_ranging.SR_SCALE)])
+	gpio.set_distance(17, 50.)
+	gpio.set_distance(10, 150.)
+	distances = us.sweep()
+	# Widths come from edge ticks, exact to the microsecond
+	assert distances == pytest.approx([50., 150.], abs=2 * us_ranging.SR_SCALE)
+	assert us.timeouts == 0
+	# Sensors fired in their own slots, in schedule order
+	assert [pin for pin, tick in gpio.triggers] == [27, 22]
+	dist, stamps = us.latest()
+	assert dist == distances and None not in stamps
+
+
+def test_sweep_group():
+	# Fired together, without waiting a slot in between
+	gpio, us = make_array([(27, 17, us_ranging.SR_SCALE), (22, 10, us_ranging.SR_SCALE)],
+		slot=1., schedule=[[0, 1]])
+	gpio.set_distance(17, 30.)
+	gpio.set_distance(10, 60.)
+	start = time.time()
+	assert us.sweep() == pytest.approx([30., 60.], abs=2 * us_ranging.SR_SCALE)
+	assert time.time() - start < 0.5
+	assert [pin for pin, tick in gpio.triggers] == [27, 22]
+
+
+def test_missing_echo_times_out():
+	gpio, us = make_array([(27, 17, us_ranging.SR_SCALE), (22, 10, us_ranging.SR_SCALE)])
+	gpio.set_distance(10, 80.)
+	assert us.sweep() == [None, pytest.approx(80., abs=2 * us_ranging.SR_SCALE)]
+	assert us.timeouts == 1
+	# A missing echo is reported again, not the last distance
+	gpio.set_distance(17, 40.)
+	gpio.set_distance(10, None)
+	assert us.sweep() == [pytest.approx(40., abs=2 * us_ranging.SR_SCALE), None]
+	assert us.timeouts == 2
+
+
+def test_timeout_covers_longest_pulse():
+	# A MaxBotix at its maximum range sends a pulse of about 44 ms
+	gpio, us = make_array([(27, 17, us_ranging.LR_PW_SCALE)])
+	assert us.max_pulse([0]) > 765. / us_ranging.LR_PW_SCALE / 1e6
+	# Without an echo the ping gives up only after that pulse could have ended
+	start = time.time()
+	assert us.sweep() == [None]
+	assert time.time() - start >= us.max_pulse([0])
+	assert us.timeouts == 1
+
+
+def test_pulse_longer_than_timeout():
+	gpio, us = make_array([(27, 17, us_ranging.LR_PW_SCALE)], timeout=0.03)
+	gpio.set_distance(17, 750.)
+	assert us.sweep() == [None]
+	assert us.timeouts == 1
+	# The rest of the late pulse is ignored
+	time.sleep(0.05)
+	gpio.set_distance(17, 100.)
+	assert us.sweep() == [pytest.approx(100., abs=0.1)]
+
+
+def test_max_range_needed_for_unknown_scale():
+	gpio = us_ranging.SimulatedGPIO()
+	with pytest.raises(ValueError):
+		us_ranging.UltrasonicArray(gpio, [(27, 17, 0.02)])
+	us = us_ranging.UltrasonicArray(gpio, [(27, 17, 0.02, 300.)])
+	assert us.max_pulse([0]) == pytest.approx(us_ranging.ECHO_DELAY + 0.015)
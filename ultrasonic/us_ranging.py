@@ -0,0 +1,268 @@
+import argparse
+import threading
+import time
+
+# Ultrasonic ranging with hardware timed echo edges
+#
+# Instead of busy waiting on the echo pin and reading time.time() (which
+# burns a core and adds scheduler jitter to every distance), edges are taken
+# from pigpio callbacks. pigpiod samples the pins itself and stamps every
+# level change with its microsecond tick, so the pulse width is exact no
+# matter how late the callback reaches Python. The ranging thread only
+# sleeps on events between triggers.
+#
+# Sensors are fired in a staggered schedule: a list of groups, one group per
+# time slot. Sensors in the same group are triggered together (far apart or
+# facing away from each other), consecutive groups are a slot apart so one
+# sensor's ping doesn't end up in the next one's echo. Default is every
+# sensor in its own slot.
+#
+#   gpio = us_ranging.PigpioGPIO()
+#   us = us_ranging.UltrasonicArray(gpio, [(27, 17), (22, 10)])
+#   us.start()
+#   dist, stamp = us.latest()       # cm, None if no echo
+#   ...
+#   us.stop()
+#
+# SimulatedGPIO produces echo pulses for distances set from a test, with
+# the same (pin, level, tick) callbacks as pigpio.
+#
+#   python3 us_ranging.py --sim
+
+SR_SCALE = 0.01715          # HC-SR04: cm per us of echo pulse, 343 m/s there and back
+LR_PW_SCALE = 2.54 / 147    # MaxBotix pulse width output: 147 us per inch
+TICK_MASK = 0xFFFFFFFF      # pigpio ticks are 32 bit microseconds and wrap every ~72 min
+
+# Longest distance in cm each pulse scale reports. A ping has to wait for
+# the pulse of the farthest echo, which for a MaxBotix XL at 765 cm is 44 ms.
+MAX_RANGE = {SR_SCALE: 400., LR_PW_SCALE: 765.}
+ECHO_DELAY = 0.005          # Seconds from the trigger until the pulse can start
+
+
+class PigpioGPIO:
+	'''pigpio backend, edges are stamped by the daemon.'''
+
+	def __init__(self, host='localhost'):
+		import pigpio
+		self.pigpio = pigpio
+		self.pi = pigpio.pi(host)
+		if not self.pi.connected:
+			raise IOError("Can't connect to pigpiod on " + host)
+		self.callbacks = []
+
+	def setup_trigger(self, pin):
+		self.pi.set_mode(pin, self.pigpio.OUTPUT)
+		self.pi.write(pin, 0)
+
+	def setup_echo(self, pin, callback):
+		# callback(pin, level, tick) on every edge
+		self.pi.set_mode(pin, self.pigpio.INPUT)
+		self.callbacks.append(self.pi.callback(pin, self.pigpio.EITHER_EDGE, callback))
+
+	def trigger(self, pin):
+		# 10 us high pulse timed by the daemon
+		self.pi.gpio_trigger(pin, 10, 1)
+
+	def close(self):
+		for cb in self.callbacks:
+			cb.cancel()
+		self.pi.stop()
+
+
+class SimulatedGPIO:
+	'''Stand-in for PigpioGPIO producing echoes for set distances.'''
+
+	# Edge ticks are exact for the distance, the callbacks are delivered
+	# late from a thread like pigpio delivers them from its socket, and
+	# like pigpio always in order.
+
+	def __init__(self, latency=0.0005):
+		self.latency = latency  # Seconds from trigger to the echo going high
+		self.echo_of = {}       # Trigger pin -> (echo pin, scale)
+		self.callbacks = {}     # Echo pin -> callback
+		self.distances = {}     # Echo pin -> cm, None for no echo
+		self.triggers = []      # (trigger pin, tick) of every trigger
+
+	def tick(self):
+		return int(time.monotonic() * 1e6) & TICK_MASK
+
+	def link(self, trig, echo, scale=SR_SCALE):
+		self.echo_of[trig] = (echo, scale)
+
+	def set_distance(self, echo, dist):
+		self.distances[echo] = dist
+
+	def setup_trigger(self, pin):
+		pass
+
+	def setup_echo(self, pin, callback):
+		self.callbacks[pin] = callback
+
+	def trigger(self, pin):
+		tick = self.tick()
+		self.triggers.append((pin, tick))
+		if pin not in self.echo_of:
+			return
+		echo, scale = self.echo_of[pin]
+		dist = self.distances.get(echo)
+		if dist is None or echo not in self.callbacks:
+			return
+		width = dist / scale
+		rise = tick + int(self.latency * 1e6)
+		pulse = threading.Thread(target=self.__pulse,
+			args=(time.monotonic(), echo, rise, int(round(width))))
+		pulse.daemon = True
+		pulse.start()
+
+	def __pulse(self, start, pin, rise, width):
+		callback = self.callbacks[pin]
+		time.sleep(max(0., start + self.latency - time.monotonic()))
+		callback(pin, 1, rise & TICK_MASK)
+		time.sleep(max(0., start + self.latency + width / 1e6 - time.monotonic()))
+		callback(pin, 0, (rise + width) & TICK_MASK)
+
+	def close(self):
+		pass
+
+
+class UltrasonicArray(threading.Thread):
+	'''Ranges ultrasonic sensors in staggered slots from edge timestamps.'''
+
+	def __init__(self, gpio, sensors, schedule=None, slot=0.06, timeout=None):
+		# sensors: (trigger pin, echo pin[, scale[, max range]]) of every
+		# sensor, scale in cm per us of pulse (default SR_SCALE), max range
+		# in cm (default from MAX_RANGE).
+		# schedule: groups of sensor indices fired together, in order.
+		# timeout: seconds a ping waits for its echoes, by default long
+		# enough for the pulse of the longest range in the group.
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.gpio = gpio
+		self.sensors = []
+		for s in sensors:
+			s = tuple(s) + (SR_SCALE,) * (3 - len(s))
+			if len(s) < 4:
+				if s[2] not in MAX_RANGE:
+					raise ValueError("No max range known for scale {}".format(s[2]))
+				s += (MAX_RANGE[s[2]],)
+			self.sensors.append(s)
+		if schedule is None:
+			schedule = [[i] for i in range(len(sensors))]
+		self.schedule = schedule
+		self.slot = slot            # Seconds between the triggers of consecutive groups
+		self.timeout = timeout      # Seconds after the trigger the echo must have ended, None for max_pulse()
+		self.timeouts = 0           # Pings without a complete echo
+		self.running = True
+		self.by_echo = {}           # Echo pin -> sensor index
+		self.armed = [False] * len(sensors)
+		self.rise = [None] * len(sensors)
+		self.width = [None] * len(sensors)
+		self.done = [threading.Event() for s in sensors]
+		# (distance, stamp) per sensor, each replaced in a single assignment
+		self.readings = [(None, None)] * len(sensors)
+		for i, (trig, echo, scale, max_range) in enumerate(self.sensors):
+			self.by_echo[echo] = i
+			gpio.setup_trigger(trig)
+			gpio.setup_echo(echo, self.edge)
+
+	def edge(self, pin, level, tick):
+		# Called from the GPIO backend's thread
+		i = self.by_echo[pin]
+		if not self.armed[i]:
+			# Late echo from an earlier ping
+			return
+		if level == 1:
+			self.rise[i] = tick
+		elif self.rise[i] is not None:
+			self.width[i] = (tick - self.rise[i]) & TICK_MASK
+			self.armed[i] = False
+			self.done[i].set()
+
+	def max_pulse(self, group):
+		# Seconds from the trigger until the echoes of a group have ended
+		return ECHO_DELAY + max(self.sensors[i][3] / self.sensors[i][2] for i in group) / 1e6
+
+	def ping(self, group):
+		# Triggers a group of sensors and waits for their echoes, returns
+		# the distances (None without echo)
+		for i in group:
+			self.rise[i] = None
+			self.width[i] = None
+			self.done[i].clear()
+			self.armed[i] = True
+		for i in group:
+			self.gpio.trigger(self.sensors[i][0])
+		timeout = self.max_pulse(group) if self.timeout is None else self.timeout
+		deadline = time.time() + timeout
+		distances = []
+		for i in group:
+			self.done[i].wait(max(0., deadline - time.time()))
+			self.armed[i] = False
+			if self.width[i] is None:
+				self.timeouts += 1
+				distances.append(None)
+			else:
+				distances.append(self.width[i] * self.sensors[i][2])
+		stamp = time.time()
+		for i, dist in zip(group, distances):
+			self.readings[i] = (dist, stamp)
+		return distances
+
+	def sweep(self):
+		# One pass over the schedule, returns the distance of every sensor.
+		# Can be used as the measure function of a TofSampler.
+		next_time = time.time()
+		for n, group in enumerate(self.schedule):
+			if n:
+				next_time += self.slot
+				time.sleep(max(0., next_time - time.time()))
+			self.ping(group)
+		return [dist for dist, stamp in self.readings]
+
+	def run(self):
+		next_time = time.time()
+		while self.running:
+			for group in self.schedule:
+				if not self.running:
+					break
+				self.ping(group)
+				next_time = max(next_time + self.slot, time.time())
+				time.sleep(max(0., next_time - time.time()))
+
+	def latest(self):
+		# Returns (distances, stamps), one of each per sensor
+		readings = list(self.readings)
+		return [dist for dist, stamp in readings], [stamp for dist, stamp in readings]
+
+	def stop(self):
+		self.running = False
+		if self.is_alive():
+			self.join()
+		self.gpio.close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Range ultrasonic sensors from hardware timed edges")
+	parser.add_argument("--sensors", nargs="+", default=["27:17"], help="trigger:echo pin pairs")
+	parser.add_argument("--slot", type=float, default=0.06, help="seconds between triggers")
+	parser.add_argument("--sim", action="store_true", help="use simulated GPIO")
+	args = parser.parse_args()
+
+	sensors = [tuple(int(p) for p in s.split(':')) for s in args.sensors]
+	if args.sim:
+		gpio = SimulatedGPIO()
+		for n, (trig, echo) in enumerate(sensors):
+			gpio.link(trig, echo)
+			gpio.set_distance(echo, 50. * (n + 1))
+	else:
+		gpio = PigpioGPIO()
+	us = UltrasonicArray(gpio, sensors, slot=args.slot)
+	us.start()
+	try:
+		while True:
+			time.sleep(1)
+			dist, stamp = us.latest()
+			print(" ".join("-" if d is None else "{:.1f} cm".format(d) for d in dist))
+	except KeyboardInterrupt:
+		pass
+	us.stop()